@@ -0,0 +1,267 @@
+import argparse
+import json
+
+
+def validate_args(args):
+    if args.max_contacts is not None and args.max_contacts < 1:
+        raise ValueError('max_contacts should be at least 1.')
+    if args.food_far_field_theta is not None and args.food_far_field_theta < 0:
+        raise ValueError('food_far_field_theta should not be negative.')
+    if args.t_max_elevation < 0:
+        raise ValueError('t_max_elevation should not be negative.')
+    if args.t_feature_scale < 1:
+        raise ValueError('t_feature_scale should be at least 1.')
+    if args.memory_budget_mb is not None and args.memory_budget_mb <= 0:
+        raise ValueError('memory_budget_mb should be positive.')
+    if args.fork_step is not None and not args.fork_configs:
+        raise ValueError('fork_step needs fork_configs.')
+    if args.precision == 'compact' and not args.t_sparse:
+        raise ValueError('precision compact needs t_sparse, only the arrays of sparse terrains get smaller.')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description='Cat simulator',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        '--state_file',
+        type=str,
+        help='Load simulation from state file.',
+    )
+    parser.add_argument(
+        '--population',
+        type=int,
+        default=10,
+        help='Starting cat population.',
+    )
+    parser.add_argument(
+        '--n_steps',
+        type=int,
+        default=10,
+        help='Number of time steps.',
+    )
+    parser.add_argument(
+        '--t_width',
+        type=int,
+        default=10,
+        help='Terrain width.',
+    )
+    parser.add_argument(
+        '--t_height',
+        type=int,
+        default=10,
+        help='Terrain width.',
+    )
+    parser.add_argument(
+        '--hour_of_day',
+        type=int,
+        default=0,
+        help='Starting hour of simulation.',
+    )
+    parser.add_argument(
+        '--neighborhood',
+        type=str,
+        default='moore',
+        choices=('moore', 'von-neumann'),
+        help='Neighborhood algorithm.',
+    )
+    parser.add_argument(
+        '--neighborhood_radius',
+        type=int,
+        default=3,
+        help='Neighborhood radius.',
+    )
+    parser.add_argument(
+        '--continuous_food',
+        action='store_true',
+        help='Flag to set continuous food suppy at food locations. If not set, food will be set periodically at the '
+             '12th hour of the day.',
+    )
+    parser.add_argument(
+        '--t_elevations_file',
+        type=str,
+        help='Terrain elevations as a text file. If specified, t_height and t_width are ignored. If not '
+             'specified, elevations are set to 0. If invalid, the simulation exits.',
+    )
+    parser.add_argument(
+        '--t_cell_types_file',
+        type=str,
+        help='Terrain cell types as a text file. If specified, t_height and t_width are ignored. If not '
+             'specified, cell types are chosen random. If invalid, the simulation exits.',
+    )
+    parser.add_argument(
+        '--t_generator',
+        type=str,
+        default='uniform',
+        choices=('uniform', 'noise'),
+        help='Generator of the terrain parts not given as files. uniform draws cell types independently per cell with '
+             'flat elevations. noise generates smooth elevations and clustered food, beds and boxes from the seed.',
+    )
+    parser.add_argument(
+        '--t_max_elevation',
+        type=int,
+        default=10,
+        help='Highest elevation of the noise generator.',
+    )
+    parser.add_argument(
+        '--t_feature_scale',
+        type=int,
+        default=16,
+        help='Approximate size in cells of the food, bed and box clusters of the noise generator.',
+    )
+    parser.add_argument(
+        '--t_cache_dir',
+        type=str,
+        default='terrain-cache',
+        help='Directory to cache the terrains of the noise generator in, keyed by their parameters. Set to an empty '
+             'string to disable caching.',
+    )
+    parser.add_argument(
+        '--t_sparse',
+        action='store_true',
+        help='Flag to store only the non empty cells of the terrain, for huge mostly empty maps. Random cell types are '
+             'then drawn directly per feature, giving different maps than the default uniform generator.',
+    )
+    parser.add_argument(
+        '--precision',
+        type=str,
+        default='full',
+        choices=('full', 'compact'),
+        help='Storage precision of the per cell values and cat state, with --t_sparse only. compact stores the '
+             'layers of sparse terrains in narrow arrays (elevations int16, cell types uint8, food amounts float32, '
+             'index int32) and rounds traces to uint16 fractions of max_trace and cat health and age to float32. Use '
+             'compare_precision.py to see how far it drifts.',
+    )
+    parser.add_argument(
+        '--log_file_path',
+        type=str,
+        help='All logs go into this file.',
+        default='simulation.log'
+    )
+    parser.add_argument(
+        '--results_file_path',
+        type=str,
+        help='Simulation results as json file.',
+        default='simulation-results.json',
+    )
+    parser.add_argument(
+        '--results_format',
+        type=str,
+        default='json',
+        choices=('json', 'ndjson'),
+        help='Format of the results file. json writes the whole simulation as one document. ndjson streams one '
+             'record per line (metadata, terrain rows, cats, food cells) with constant memory.',
+    )
+    parser.add_argument(
+        '--metrics_file_path',
+        type=str,
+        help='Per step time series metrics (population, births, deaths, health, food, traces, ...). Saved as .npz if '
+             'the path ends with .npz, as CSV otherwise. If not specified, metrics are not recorded.',
+    )
+    parser.add_argument(
+        '--heatmaps_file_path',
+        type=str,
+        help='Per cell visit, sleep, attack and birth counts over the whole run, split by personality, are saved to '
+             'this .npz file. See render_heatmaps.py. If not specified, nothing is accumulated.',
+    )
+    parser.add_argument(
+        '--digest_file_path',
+        type=str,
+        help='Per step state digests (chained hash of cat positions, health, state, ids, food and traces) as NDJSON. '
+             'If not specified, digests are not computed.',
+    )
+    parser.add_argument(
+        '--memory_file_path',
+        type=str,
+        help='Memory usage per step and phase, and a report of the structures that grew, are streamed to this NDJSON '
+             'file. If not specified, memory is only monitored for --memory_budget_mb.',
+    )
+    parser.add_argument(
+        '--memory_budget_mb',
+        type=float,
+        help='Memory budget in MB. When the resident memory is about to exceed it, the state is saved to the states '
+             'directory and the simulation stops with a report of the structures that grew.',
+    )
+    parser.add_argument(
+        '--memory_trace',
+        action='store_true',
+        help='Trace allocations per phase with tracemalloc. Slows down the simulation considerably.',
+    )
+    parser.add_argument(
+        '--metrics_port',
+        type=int,
+        help='Serve run metrics (steps/sec, step latency histogram, population, births, deaths, checkpoint lag, RSS) '
+             'in the Prometheus text format at http://localhost:<port>/metrics. If not specified, nothing is served.',
+    )
+    parser.add_argument(
+        '--headless',
+        action='store_true',
+        help='Run without the render window and the keyboard listener. Needed for sparse terrains larger than '
+             'SparseTerrain.max_dense_cells, which cannot be rendered.',
+    )
+    parser.add_argument(
+        '--live_port',
+        type=int,
+        help='Stream the live state to any number of viewers over TCP on localhost at this port (0 picks a free '
+             'port). See live_client.py. If not specified, nothing is streamed.',
+    )
+    parser.add_argument(
+        '--max_contacts',
+        type=int,
+        help='Bounded contact interaction mode. Each cat interacts with at most this many randomly sampled cats in '
+             'its cell per step, with interaction probabilities rescaled to keep the expected rates. If not set, '
+             'every pair of cats in a cell interacts.',
+    )
+    parser.add_argument(
+        '--aggregate_mutual_attraction',
+        action='store_true',
+        help='Compute the mutual attraction force of a cell from per cell aggregates of its cats instead of cat by '
+             'cat. Faster for dense colonies, but floating point rounding differs from the cat by cat sum.',
+    )
+    parser.add_argument(
+        '--random_force_mode',
+        type=str,
+        default='per-neighbor',
+        choices=('per-neighbor', 'exact', 'fast'),
+        help='How random forces are generated. per-neighbor draws one random force per neighbor cell. exact draws '
+             'the same per neighbor forces for the whole step in one NumPy call. fast draws the per cat sum directly '
+             'from a normal distribution with the same mean and variance.',
+    )
+    parser.add_argument(
+        '--food_far_field_theta',
+        type=float,
+        help='Approximate food attraction with a quadtree over food cells (Barnes-Hut). Clusters of food cells whose '
+             'extent is less than theta times their distance contribute once through their centroid. Smaller is more '
+             'accurate, 0 is exact. If not set, every food cell in the radius is summed.',
+    )
+    parser.add_argument(
+        '--fork_step',
+        type=int,
+        help='Fork one branch per --fork_configs entry after this step. Branches run in parallel processes from the '
+             'shared state, each with its own random stream and results file. The main run continues unchanged.',
+    )
+    parser.add_argument(
+        '--fork_configs',
+        type=json.loads,
+        default=[],
+        help='Config overrides of the branches as a JSON list e.g. \'[{"new_food_amount": 10}, '
+             '{"trace_fading_factor": 0.5}]\'.',
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='Random seed.',
+    )
+    return parser
+
+
+def parse_args(argv=None):
+    """
+    :param argv: Arguments to parse. If None, the command line arguments.
+    """
+    args = build_parser().parse_args(argv)
+
+    validate_args(args)
+    return args
@@ -14,3 +14,21 @@ class Config:
     new_food_amount = 30
     start_food_amount = 100
     continuous_food_amount = 100
+
+    @classmethod
+    def values(cls):
+        """
+        Current constants by name, e.g. to restore them after `override`.
+        """
+        return {name: value for name, value in vars(cls).items()
+                if not name.startswith('_') and not isinstance(value, classmethod)}
+
+    @classmethod
+    def override(cls, **values):
+        """
+        Sets constants by name. Note that they are process wide.
+        """
+        for name, value in values.items():
+            if name.startswith('_') or not hasattr(cls, name) or callable(getattr(cls, name)):
+                raise ValueError(f'Unknown config constant {name}.')
+            setattr(cls, name, value)
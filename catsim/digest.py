@@ -0,0 +1,116 @@
+import hashlib
+import random
+from contextlib import contextmanager
+
+import numpy as np
+
+from .models import Cat, CatSummaryStore
+
+state_fields = ('cat_id', 'x', 'y', 'health', 'state', 'food', 'x_trace', 'y_trace')
+
+
+def state_arrays(simulation):
+    """
+    The state compared between engines, as one array per field.
+    Cats are the living cats on the terrain ordered by cat_id. Food is the food cells in grid order. Traces are the
+    values at the occupied cells in grid order followed by the layer total (the rest of the layer only decays).
+    """
+    terrain = simulation.terrain
+    cats = sorted(terrain.cats(), key=lambda c: c.cat_id)
+    occupied = terrain.occupied_cells()
+    return dict(
+        cat_id=np.array([cat.cat_id for cat in cats], dtype=np.int64),
+        x=np.array([cat.position.x for cat in cats], dtype=np.float64),
+        y=np.array([cat.position.y for cat in cats], dtype=np.float64),
+        health=np.array([cat.health for cat in cats], dtype=np.float64),
+        state=np.array([cat.state.value for cat in cats], dtype=np.int64),
+        food=np.array(terrain.food_amounts(), dtype=np.float64),
+        x_trace=np.array([cell.x_trace for cell in occupied] + [terrain.x_trace_total], dtype=np.float64),
+        y_trace=np.array([cell.y_trace for cell in occupied] + [terrain.y_trace_total], dtype=np.float64),
+    )
+
+
+class StateDigest:
+    """
+    Chained digest of the simulation state. The digest of a step covers that step's state and the digest of the
+    previous step, so one value verifies the whole trajectory so far. Per field digests tell which fields differ.
+    """
+
+    def __init__(self):
+        self.digest = b''
+        self.records = []
+
+    def update(self, step, arrays):
+        field_digests = {}
+        chained = hashlib.blake2b(self.digest, digest_size=16)
+        for name in state_fields:
+            data = np.ascontiguousarray(arrays[name]).tobytes()
+            field_digests[name] = hashlib.blake2b(data, digest_size=8).hexdigest()
+            chained.update(data)
+        self.digest = chained.digest()
+        record = dict(step=step, digest=self.digest.hex(), fields=field_digests)
+        self.records.append(record)
+        return record
+
+
+def diverging_fields(arrays_a, arrays_b, tolerance=0.0):
+    """
+    Names of the fields that differ by more than `tolerance` (absolute), or that have different sizes.
+    """
+    fields = []
+    for name in state_fields:
+        a, b = arrays_a[name], arrays_b[name]
+        if a.shape != b.shape or not np.allclose(a, b, rtol=0, atol=tolerance, equal_nan=True):
+            fields.append(name)
+    return fields
+
+
+@contextmanager
+def isolated(context: dict):
+    """
+    Swaps the process wide state a simulation uses (random module, cat ids and cat summaries) with the one saved in
+    `context`, so that several simulations can advance in lockstep in one process.
+    """
+    saved = random.getstate(), Cat._next_id, Cat.summary_store
+    if context:
+        random.setstate(context['random'])
+        Cat._next_id = context['next_id']
+        Cat.summary_store = context['summary_store']
+    else:
+        Cat._next_id = 0
+        Cat.summary_store = CatSummaryStore()
+    try:
+        yield
+    finally:
+        context['random'] = random.getstate()
+        context['next_id'] = Cat._next_id
+        context['summary_store'] = Cat.summary_store
+        random.setstate(saved[0])
+        Cat._next_id = saved[1]
+        Cat.summary_store = saved[2]
+
+
+def verify(simulation_a, simulation_b, n_steps, tolerance=0.0):
+    """
+    Advances two simulations side by side and compares their states after every step.
+    :return: (step, diverging fields) of the first divergence, None if they agree for `n_steps`
+    """
+    simulations = (simulation_a, simulation_b)
+    contexts = ({}, {})
+    for simulation, context in zip(simulations, contexts):
+        simulation.render_enabled = False
+        simulation.save_state_enabled = False
+        simulation.show_progress = False  # Progress lines of both would interleave with the caller's output
+        with isolated(context):
+            simulation._setup()
+    for _ in range(n_steps):
+        arrays = []
+        for simulation, context in zip(simulations, contexts):
+            with isolated(context):
+                if not simulation.is_finished():
+                    simulation.update()
+                arrays.append(state_arrays(simulation))
+        fields = diverging_fields(*arrays, tolerance=tolerance)
+        if fields:
+            return simulation_a.current_step, fields
+    return None
@@ -36,12 +36,35 @@ class CellType(RandomaziableEnum):
     box = 3
 
 
+class Interaction(IntEnum):
+    none = 0
+    reproduction = 1
+    attack = 2
+
+
 class Neighborhood(IntEnum):
     Moore = 0
     VonNeumann = 1
 
 
+class RandomForceMode(IntEnum):
+    per_neighbor = 0  # One random.uniform pair per neighbor cell (reference)
+    exact = 1  # Whole step drawn in one NumPy call, summed per cat
+    fast = 2  # Per cat sum drawn directly from a normal with the same mean and variance
+
+
+class Precision(IntEnum):
+    full = 0  # Python floats and ints (reference)
+    compact = 1  # Narrow NumPy types, see catsim.precision
+
+
 class LogMethod(IntEnum):
     none = 0
     console = 1
     file = 2
+
+
+class EventKind(IntEnum):
+    wake_up = 0
+    deliver = 1
+    refill_food = 2
@@ -0,0 +1,113 @@
+import numpy as np
+
+from .enums import Personality
+
+
+class HeatmapRecorder:
+    """
+    Per cell counts accumulated over the whole run, split by personality. Each layer is an int64 array of shape
+    (len(Personality), height, width).
+        visits   Cats on the cell at the end of a step
+        sleeps   Sleeping cats on the cell at the end of a step
+        attacks  Attacks made by cats on the cell
+        births   Cats born on the cell
+    Attacks and births are buffered during the step, all layers are updated with one `np.bincount` each per step.
+    With `sparse`, only the cells with counts are stored, as ascending keys personality * area + flat index with their
+    counts, so that memory grows with the visited cells instead of the area. They are densified by `load`.
+    """
+    layers = ('visits', 'sleeps', 'attacks', 'births')
+
+    def __init__(self, width, height, sparse=False):
+        self.width = width
+        self.height = height
+        self.sparse = sparse
+        if sparse:
+            self.data = {name: (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)) for name in self.layers}
+        else:
+            self.data = {name: np.zeros((len(Personality), height, width), dtype=np.int64) for name in self.layers}
+        self._events = {'attacks': [], 'births': []}  # (flat index, personality value) since the last step
+
+    def record_attack(self, cat):
+        self._events['attacks'].append((cat.position.y * self.width + cat.position.x, cat.personality.value))
+
+    def record_birth(self, cat):
+        self._events['births'].append((cat.position.y * self.width + cat.position.x, cat.personality.value))
+
+    def _add(self, name, flat, personality):
+        # Counted over the distinct cells only, so the cost does not depend on the map size
+        cells, inverse = np.unique(personality * (self.width * self.height) + flat, return_inverse=True)
+        counts = np.bincount(inverse)
+        if not self.sparse:
+            self.data[name].reshape(-1)[cells] += counts
+            return
+        keys, totals = self.data[name]
+        j = np.searchsorted(keys, cells)
+        found = j < len(keys)
+        found[found] = keys[j[found]] == cells[found]
+        totals[j[found]] += counts[found]
+        if not found.all():
+            new = ~found
+            self.data[name] = (np.insert(keys, j[new], cells[new]), np.insert(totals, j[new], counts[new]))
+
+    def end_step(self, cats):
+        """
+        :param cats: cats alive at the end of the step
+        """
+        if cats:
+            flat = np.fromiter((cat.position.y * self.width + cat.position.x for cat in cats), dtype=np.int64,
+                               count=len(cats))
+            personality = np.fromiter((cat.personality.value for cat in cats), dtype=np.int64, count=len(cats))
+            sleeping = np.fromiter((cat.is_sleeping() for cat in cats), dtype=bool, count=len(cats))
+            self._add('visits', flat, personality)
+            self._add('sleeps', flat[sleeping], personality[sleeping])
+        for name, events in self._events.items():
+            if events:
+                flat, personality = np.array(events, dtype=np.int64).T
+                self._add(name, flat, personality)
+                events.clear()
+
+    def save(self, path):
+        personalities = np.array([str(p) for p in Personality])
+        if not self.sparse:
+            np.savez_compressed(path, personalities=personalities, **self.data)
+            return
+        layers = {}
+        for name, (keys, totals) in self.data.items():
+            layers[f'{name}_keys'] = keys
+            layers[f'{name}_counts'] = totals
+        np.savez_compressed(path, personalities=personalities, shape=np.array((self.height, self.width)), **layers)
+
+
+def load(path, max_side=None):
+    """
+    Reads a heatmaps file of either layout, densified.
+    :param max_side: if a side of the map is longer, counts are summed over square blocks of cells so that neither
+    side of the arrays exceeds it
+    :return: personality names, block side in cells, and the layers by name as int64 arrays of shape
+    (len(personalities), rows, columns)
+    """
+    with np.load(path) as data:
+        personalities = [str(p) for p in data['personalities']]
+        sparse = 'shape' in data
+        if sparse:
+            height, width = data['shape'].tolist()
+        else:
+            _, height, width = data[HeatmapRecorder.layers[0]].shape
+        block = 1 if max_side is None else max(1, -(-max(width, height) // max_side))
+        rows, columns = -(-height // block), -(-width // block)
+        layers = {}
+        for name in HeatmapRecorder.layers:
+            if not sparse and block == 1:
+                layers[name] = data[name]
+                continue
+            if sparse:
+                keys, counts = data[f'{name}_keys'], data[f'{name}_counts']
+            else:
+                keys = np.flatnonzero(data[name])
+                counts = data[name].reshape(-1)[keys]
+            personality, flat = np.divmod(keys, width * height)
+            y, x = np.divmod(flat, width)
+            dense = np.zeros(len(personalities) * rows * columns, dtype=np.int64)
+            np.add.at(dense, (personality * rows + y // block) * columns + x // block, counts)
+            layers[name] = dense.reshape(len(personalities), rows, columns)
+    return personalities, block, layers
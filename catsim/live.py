@@ -0,0 +1,342 @@
+import asyncio
+import struct
+import threading
+import time
+
+import numpy as np
+
+from .config import Config
+from .enums import CellType
+from .logging import Logger
+
+MAGIC = b'CATF'
+VERSION = 1
+DELTA_FRAME = 0
+KEY_FRAME = 1
+
+# <magic, version, kind, step, width, height, number of cats>
+HEADER = struct.Struct('<4sBBIIII')
+LENGTH = struct.Struct('<I')
+
+cat_dtype = np.dtype([
+    ('cat_id', '<u4'),
+    ('x', '<u4'),
+    ('y', '<u4'),
+    ('health', '<f4'),
+    ('state', 'u1'),
+    ('gender', 'u1'),
+    ('personality', 'u1'),
+])
+
+
+def quantize_traces(values):
+    return np.clip(np.round(np.asarray(values, dtype=np.float64) * (255 / Config.max_trace)), 0, 255).astype(np.uint8)
+
+
+def quantize_food(values):
+    return np.clip(np.round(values), 0, 65535).astype(np.uint16)
+
+
+class Layers:
+    """
+    Quantized dynamic terrain layers as sent on the wire, flat in row major order. Traces are uint8 over
+    [0, Config.max_trace], food is uint16.
+    """
+
+    def __init__(self, x_trace, y_trace, food):
+        self.x_trace = x_trace
+        self.y_trace = y_trace
+        self.food = food
+
+    @staticmethod
+    def of(terrain):
+        """
+        Builds the layers from every cell of `terrain`, O(area). The server keeps them up to date incrementally
+        instead, this is for checking what a client received.
+        """
+        x_trace = [cell.x_trace for row in terrain.grid for cell in row]
+        y_trace = [cell.y_trace for row in terrain.grid for cell in row]
+        food = np.zeros(terrain.width * terrain.height, dtype=np.uint16)
+        food[terrain.index.flat[CellType.food]] = quantize_food(terrain.food_amounts())
+        return Layers(quantize_traces(x_trace), quantize_traces(y_trace), food)
+
+    def copy(self):
+        return Layers(self.x_trace.copy(), self.y_trace.copy(), self.food.copy())
+
+
+def pack_cats(cats):
+    table = np.zeros(len(cats), dtype=cat_dtype)
+    for i, cat in enumerate(cats):
+        table[i] = (cat.cat_id, cat.position.x, cat.position.y, cat.health, cat.state.value, cat.gender.value,
+                    cat.personality.value)
+    return table
+
+
+class FrameBundle:
+    """
+    One step as a delta frame (changes since the previous step), plus a snapshot of the layers to build a key frame
+    from if one was taken for this step. The key frame is only encoded if a client needs it.
+    """
+
+    def __init__(self, step, width, height, cats, cell_types, layers: Layers, changed, snapshot: Layers = None):
+        """
+        :param layers: current layers, only read here
+        :param changed: flat indices of the cells that changed since the previous step
+        """
+        self.step = step
+        self.width = width
+        self.height = height
+        self.cats = cats
+        self.cell_types = cell_types
+        self.snapshot = snapshot
+        indices = changed
+        self.delta = b''.join((
+            HEADER.pack(MAGIC, VERSION, DELTA_FRAME, step, width, height, len(cats)),
+            cats.tobytes(),
+            LENGTH.pack(len(indices)),
+            indices.tobytes(),
+            layers.x_trace[indices].tobytes(),
+            layers.y_trace[indices].tobytes(),
+            layers.food[indices].tobytes(),
+        ))
+        self._keyframe = None
+
+    def keyframe(self):
+        """
+        :return: the encoded key frame, None if no snapshot was taken for this step
+        """
+        if self._keyframe is None and self.snapshot is not None:
+            self._keyframe = b''.join((
+                HEADER.pack(MAGIC, VERSION, KEY_FRAME, self.step, self.width, self.height, len(self.cats)),
+                self.cats.tobytes(),
+                self.cell_types.tobytes(),
+                self.snapshot.x_trace.tobytes(),
+                self.snapshot.y_trace.tobytes(),
+                self.snapshot.food.tobytes(),
+            ))
+        return self._keyframe
+
+
+class FrameDecoder:
+    """
+    Client side state. Applies key and delta frames and keeps the latest cats and layers.
+    """
+
+    def __init__(self):
+        self.step = None
+        self.width = 0
+        self.height = 0
+        self.cats = np.zeros(0, dtype=cat_dtype)
+        self.cell_types = None
+        self.x_trace = None
+        self.y_trace = None
+        self.food = None
+
+    def apply(self, frame: bytes):
+        magic, version, kind, step, width, height, n_cats = HEADER.unpack_from(frame, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Invalid frame.')
+        offset = HEADER.size
+        cats = np.frombuffer(frame, dtype=cat_dtype, count=n_cats, offset=offset)
+        offset += cats.nbytes
+        if kind == KEY_FRAME:
+            n = width * height
+            self.cell_types = np.frombuffer(frame, dtype=np.uint8, count=n, offset=offset).reshape(height, width)
+            offset += n
+            self.x_trace = np.frombuffer(frame, dtype=np.uint8, count=n, offset=offset).copy()
+            offset += n
+            self.y_trace = np.frombuffer(frame, dtype=np.uint8, count=n, offset=offset).copy()
+            offset += n
+            self.food = np.frombuffer(frame, dtype=np.uint16, count=n, offset=offset).copy()
+        elif self.x_trace is None:
+            return False  # Deltas are useless until the first key frame
+        else:
+            (n,) = LENGTH.unpack_from(frame, offset)
+            offset += LENGTH.size
+            indices = np.frombuffer(frame, dtype=np.uint32, count=n, offset=offset)
+            offset += indices.nbytes
+            self.x_trace[indices] = np.frombuffer(frame, dtype=np.uint8, count=n, offset=offset)
+            offset += n
+            self.y_trace[indices] = np.frombuffer(frame, dtype=np.uint8, count=n, offset=offset)
+            offset += n
+            self.food[indices] = np.frombuffer(frame, dtype=np.uint16, count=n, offset=offset)
+        self.step, self.width, self.height, self.cats = step, width, height, cats
+        return True
+
+
+class _Client:
+    def __init__(self, writer, max_queued_frames):
+        self.writer = writer
+        self.queue = asyncio.Queue(maxsize=max_queued_frames)
+        self.needs_keyframe = True
+        self.dropped = 0
+        self.task = None
+
+
+class LiveServer:
+    """
+    Streams step frames to any number of TCP clients on localhost. Frames are length prefixed (uint32 LE).
+    The asyncio loop runs in a background thread. `publish` never blocks the simulation: each client has its own
+    bounded queue, and a client that falls behind drops frames and gets a key frame when it catches up.
+    The layers are updated in place from the cells that can have changed in the step (cells with a trace as last
+    sent, occupied cells and cells whose food changed), so a step costs as much as its content, not the area.
+    Key frames copy the layers, at most once per `keyframe_interval` seconds and only when a client needs one.
+    """
+
+    def __init__(self, port, host='127.0.0.1', max_queued_frames=4, keyframe_interval=1.0):
+        self.host = host
+        self.port = port
+        self.max_queued_frames = max_queued_frames
+        self.keyframe_interval = keyframe_interval
+        self._clients = set()
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._layers = None  # As last sent
+        self._traced = np.zeros(0, dtype=np.int64)  # Cells with a non zero trace in `_layers`
+        self._cell_types = None
+        self._keyframe_wanted = False  # Set by the loop thread when a client waits for a key frame
+        self._last_keyframe = None
+
+    def start(self):
+        ready = threading.Event()
+
+        def _run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._on_connect, self.host, self.port))
+            self.port = self._server.sockets[0].getsockname()[1]  # In case port 0 was given
+            ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=_run, name='catsim-live', daemon=True)
+        self._thread.start()
+        ready.wait()
+        Logger.log(f'Live server listening on {self.host}:{self.port}')
+
+    def stop(self):
+        if self._loop is None:
+            return
+
+        async def _close():
+            self._server.close()
+            tasks = [client.task for client in self._clients]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self._server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(_close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = None
+
+    async def _on_connect(self, _reader, writer):
+        client = _Client(writer, self.max_queued_frames)
+        client.task = asyncio.current_task()
+        self._clients.add(client)
+        self._keyframe_wanted = True
+        try:
+            while True:
+                frame = await client.queue.get()
+                writer.write(LENGTH.pack(len(frame)))
+                writer.write(frame)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._clients.discard(client)
+            writer.close()
+
+    def _broadcast(self, bundle: FrameBundle):
+        for client in self._clients:
+            if client.queue.full():
+                client.dropped += 1
+                client.needs_keyframe = True  # It will miss this delta
+                continue
+            if client.needs_keyframe:
+                keyframe = bundle.keyframe()
+                if keyframe is None:
+                    self._keyframe_wanted = True  # Deltas are useless to it until the next snapshot
+                    continue
+                client.queue.put_nowait(keyframe)
+                client.needs_keyframe = False
+            else:
+                client.queue.put_nowait(bundle.delta)
+
+    def _start_layers(self, terrain):
+        area = terrain.width * terrain.height
+        self._cell_types = np.zeros(area, dtype=np.uint8)
+        for cell_type in CellType:
+            self._cell_types[terrain.index.flat[cell_type]] = cell_type.value
+        self._layers = Layers(np.zeros(area, dtype=np.uint8), np.zeros(area, dtype=np.uint8),
+                              np.zeros(area, dtype=np.uint16))
+        self._layers.food[terrain.index.flat[CellType.food]] = quantize_food(terrain.food_amounts())
+
+    def _update_layers(self, terrain, food_changes, food_refilled):
+        """
+        :return: flat indices of the cells whose quantized values changed
+        """
+        layers = self._layers
+        width = terrain.width
+        changed = []
+        if food_refilled:
+            food_flat = terrain.index.flat[CellType.food]
+            food = quantize_food(terrain.food_amounts())
+            changed.append(food_flat[layers.food[food_flat] != food])
+            layers.food[food_flat] = food
+        elif food_changes:
+            flat = np.unique(np.asarray(food_changes, dtype=np.int64))
+            food = quantize_food([terrain.at(i % width, i // width).food_amount for i in flat.tolist()])
+            changed.append(flat[layers.food[flat] != food])
+            layers.food[flat] = food
+        occupied = [cell.position.y * width + cell.position.x for cell in terrain.occupied_cells()]
+        flat = np.union1d(self._traced, np.asarray(occupied, dtype=np.int64))
+        cells = [terrain.at(i % width, i // width) for i in flat.tolist()]
+        x_trace = quantize_traces([cell.x_trace for cell in cells])
+        y_trace = quantize_traces([cell.y_trace for cell in cells])
+        changed.append(flat[(layers.x_trace[flat] != x_trace) | (layers.y_trace[flat] != y_trace)])
+        layers.x_trace[flat] = x_trace
+        layers.y_trace[flat] = y_trace
+        self._traced = flat[(x_trace > 0) | (y_trace > 0)]
+        return np.unique(np.concatenate(changed)).astype(np.uint32)
+
+    def publish(self, simulation, food_changes=(), food_refilled=False):
+        """
+        Called by the simulation after every step. Food is read from the current terrain, the arguments only tell
+        which cells to read.
+        :param food_changes: flat indices of the cells whose food was consumed in the step
+        :param food_refilled: whether every food cell was refilled in the step
+        """
+        terrain = simulation.terrain
+        if self._layers is None:
+            self._start_layers(terrain)
+        changed = self._update_layers(terrain, food_changes, food_refilled)
+        snapshot = None
+        now = time.time()
+        if self._keyframe_wanted and (self._last_keyframe is None or
+                                      now - self._last_keyframe >= self.keyframe_interval):
+            self._keyframe_wanted = False
+            self._last_keyframe = now
+            snapshot = self._layers.copy()
+        bundle = FrameBundle(simulation.current_step, terrain.width, terrain.height, pack_cats(terrain.cats()),
+                             self._cell_types, self._layers, changed, snapshot)
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._broadcast, bundle)
+
+
+def read_frames(sock):
+    """
+    Yields the frames received on a connected socket until it is closed.
+    """
+    stream = sock.makefile('rb')
+    while True:
+        prefix = stream.read(LENGTH.size)
+        if len(prefix) < LENGTH.size:
+            return
+        (size,) = LENGTH.unpack(prefix)
+        frame = stream.read(size)
+        if len(frame) < size:
+            return
+        yield frame
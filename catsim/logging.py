@@ -20,6 +20,10 @@ class Logger:
         if method == LogMethod.file:
             open(Logger.file, 'w')
 
+    @staticmethod
+    def is_enabled():
+        return Logger.method != LogMethod.none
+
     @staticmethod
     def log(*args, **kwargs):
         if Logger.method == LogMethod.none:
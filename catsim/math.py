@@ -2,6 +2,8 @@ import math
 
 
 class Vec2:
+    __slots__ = ('x', 'y')
+
     def __init__(self, x=0.0, y=0.0):
         self.x = x
         self.y = y
@@ -33,6 +35,37 @@ class Vec2:
     def dot(self, other: 'Vec2'):
         return self.x * other.x + self.y * other.y
 
+    # In-place operations. These mutate `self` and return it, so they must only be used on vectors that are not
+    # shared (e.g. force accumulators), never on positions.
+
+    def set(self, x, y) -> 'Vec2':
+        self.x = x
+        self.y = y
+        return self
+
+    def iadd(self, other: 'Vec2') -> 'Vec2':
+        self.x += other.x
+        self.y += other.y
+        return self
+
+    def iadd_xy(self, x, y) -> 'Vec2':
+        self.x += x
+        self.y += y
+        return self
+
+    def isub(self, other: 'Vec2') -> 'Vec2':
+        self.x -= other.x
+        self.y -= other.y
+        return self
+
+    def imul(self, other: float) -> 'Vec2':
+        self.x *= other
+        self.y *= other
+        return self
+
+    def xy(self):
+        return self.x, self.y
+
     def serialize(self):
         return dict(x=self.x, y=self.y)
 
@@ -40,6 +73,28 @@ class Vec2:
         return f'{{x={round(self.x, 3)},y={round(self.y, 3)}}}'
 
 
+# Scalar-pair kernels. Same arithmetic (and operation order) as the `Vec2` methods, without allocating vectors.
+
+def norm_xy(x, y):
+    return (x * x + y * y) ** 0.5
+
+
+def unit_xy(x, y):
+    norm = norm_xy(x, y)
+    if norm == 0:
+        return 0, 0
+    inv = 1 / norm
+    return x * inv, y * inv
+
+
+def cross_xy(ax, ay, bx, by):
+    return ax * by - ay * bx
+
+
+def dot_xy(ax, ay, bx, by):
+    return ax * bx + ay * by
+
+
 def mapf(x, a, b, p, q):
     """
     maps x from range a, b to p, q
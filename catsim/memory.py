@@ -0,0 +1,213 @@
+import json
+import os
+import sys
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import numpy as np
+
+from .math import Vec2
+from .terrain import SparseTerrain, SparseLayer
+
+
+def current_rss():
+    """
+    Resident set size in bytes. None where it cannot be read (only Linux is supported).
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss():
+    """
+    Peak resident set size in bytes so far. None where it is not available.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def structure_sizes(simulation):
+    """
+    Counts and estimated sizes in bytes of the structures that grow with the population or the map.
+    Sizes of objects are shallow sizes of one instance times the count.
+    :return: dict of structure name to (count, bytes)
+    """
+    terrain = simulation.terrain
+    n_cats = len(simulation._cats)  # Every cat ever born is kept for the results
+    n_cells = len(terrain._cells) if isinstance(terrain, SparseTerrain) else terrain.width * terrain.height
+    n_vec2 = n_cells + 2 * n_cats  # Position of every cell, position and force of every cat
+    vec2_size = sys.getsizeof(Vec2(0, 0))
+    cat_size = sys.getsizeof(simulation._cats[0]) if n_cats else 0
+    cell = terrain.at(0, 0)
+    cell_size = sys.getsizeof(cell) + sys.getsizeof(cell.__dict__) + sys.getsizeof(cell.cats)
+    store = simulation._cats[0].summary_store if n_cats else None
+    store_size = 0 if store is None else sum(column.nbytes for column in store.columns.values()) + \
+        store.state_hours.nbytes
+    return dict(
+        cats=(n_cats, n_cats * cat_size),
+        cells=(n_cells, n_cells * cell_size),
+        vec2=(n_vec2, n_vec2 * vec2_size),
+        cat_summaries=(n_cats, store_size),
+        events=(len(simulation.scheduler), len(simulation.scheduler) * sys.getsizeof((0, 0, None, None))),
+    )
+
+
+def layer_sizes(simulation):
+    """
+    Bytes of the per cell layers: elevations, cell types, the arrays and buckets of the cell type index and food
+    amounts. Rows of a dense terrain are counted as their lists of references, and food amounts only on a sparse
+    terrain (a dense one keeps them in its cells).
+    :return: dict of layer name to bytes
+    """
+    def _layer_size(layer):
+        if isinstance(layer, SparseLayer):
+            return layer.flat.nbytes + layer.values.nbytes
+        if isinstance(layer, np.ndarray):
+            return layer.nbytes
+        return sys.getsizeof(layer) + sum(sys.getsizeof(row) for row in layer)
+
+    terrain = simulation.terrain
+    index = terrain.index
+    if index.compact:
+        bucket_size = sum(array.nbytes for arrays in index._buckets.values() for array in arrays)
+    else:
+        bucket_size = sum(sys.getsizeof(buckets) + sum(sys.getsizeof(key) + sys.getsizeof(cells) +
+                                                       len(cells) * sys.getsizeof(0) for key, cells in buckets.items())
+                          for buckets in index._buckets.values())
+    sizes = dict(
+        elevations=_layer_size(simulation.elevations),
+        cell_types=_layer_size(simulation.cell_types),
+        index=sum(array.nbytes for arrays in (index.flat, index.xs, index.ys) for array in arrays.values()),
+        buckets=bucket_size,
+    )
+    if isinstance(terrain, SparseTerrain):
+        food = terrain._initial_food
+        sizes['food'] = (food.nbytes if isinstance(food, np.ndarray) else
+                         sys.getsizeof(food) + len(food) * sys.getsizeof(0.0)) + sys.getsizeof(terrain._food_overrides)
+    return sizes
+
+
+class MemoryMonitor:
+    """
+    Samples memory per phase of a step, and checks it against a budget at the end of every step.
+    Phases are delimited by `mark` calls, each closing the phase since the previous mark. With `trace_allocations`,
+    allocations and their peak per phase are traced with `tracemalloc` (slow), otherwise only RSS is sampled.
+    Only the record of the last step is kept. The records of every step are streamed to `file_path`, if given.
+    """
+
+    def __init__(self, budget=None, trace_allocations=False, file_path=None):
+        """
+        :param budget: memory budget in bytes, None for no budget
+        :param file_path: NDJSON file that gets the record of every step, then the report on `stop`
+        """
+        self.budget = budget
+        self.trace_allocations = trace_allocations
+        self.file_path = file_path
+        self.last_record = None
+        self.initial_sizes = None
+        self.exceeded = False
+        self._file = None
+        self._started_tracing = False
+        self._record = None
+        self._last_rss = None
+        self._previous_step_rss = None
+        self._last_traced = None
+
+    def start(self, simulation):
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self.initial_sizes = structure_sizes(simulation)
+        self._last_rss = current_rss()
+        if self.file_path is not None:
+            self._file = open(self.file_path, 'w')
+
+    def stop(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        if self._file is not None:
+            self._file.write(json.dumps(dict(report=self.report())) + '\n')
+            self._file.close()
+            self._file = None
+
+    def begin_step(self):
+        self._record = dict(phases={})
+        self._last_rss = current_rss()
+        if self.trace_allocations:
+            self._last_traced = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+
+    def mark(self, phase):
+        rss = current_rss()
+        sample = dict(rss=rss, rss_delta=None if rss is None or self._last_rss is None else rss - self._last_rss)
+        if self.trace_allocations:
+            traced, traced_peak = tracemalloc.get_traced_memory()
+            sample['allocated'] = traced - self._last_traced
+            sample['allocated_peak'] = traced_peak - self._last_traced
+            self._last_traced = traced
+            tracemalloc.reset_peak()
+        self._record['phases'][phase] = sample
+        self._last_rss = rss
+
+    def end_step(self, step, simulation):
+        """
+        :return: True if the budget would be exceeded within the next step, judging by the growth of this one
+        """
+        rss = current_rss()
+        if rss is None:
+            rss = tracemalloc.get_traced_memory()[0] if self.trace_allocations else peak_rss()
+        sizes = structure_sizes(simulation)
+        previous_rss = rss if self._previous_step_rss is None else self._previous_step_rss
+        self._previous_step_rss = rss
+        self._record.update(step=step, rss=rss, peak_rss=peak_rss(), sizes=sizes)
+        if self._file is not None:
+            # Flushed every step, so that nothing is left buffered when the simulation forks
+            self._file.write(json.dumps(self._record) + '\n')
+            self._file.flush()
+        self.last_record = self._record
+        self._record = None
+        if self.budget is None or rss is None:
+            return False
+        self.exceeded = rss + max(0, rss - previous_rss) > self.budget
+        return self.exceeded
+
+    def growth(self):
+        """
+        :return: list of (structure, count growth, bytes growth) since the start, largest bytes growth first
+        """
+        if self.last_record is None:
+            return []
+        sizes = self.last_record['sizes']
+        growth = [(name, count - self.initial_sizes[name][0], size - self.initial_sizes[name][1])
+                  for name, (count, size) in sizes.items()]
+        return sorted(growth, key=lambda item: item[2], reverse=True)
+
+    def report(self):
+        growth = self.growth()
+        return dict(
+            budget=self.budget,
+            exceeded=self.exceeded,
+            peak_rss=peak_rss(),
+            largest_growth=growth[0][0] if growth else None,
+            growth=[dict(structure=name, count=count, bytes=size) for name, count, size in growth],
+        )
+
+    def summary(self):
+        report = self.report()
+        s = f'Peak RSS {report["peak_rss"]} bytes'
+        if self.exceeded:
+            s = f'Memory budget of {self.budget} bytes about to be exceeded. ' + s
+        if report['growth']:
+            top = report['growth'][0]
+            s += f', largest growth: {top["structure"]} (+{top["count"]} objects, ~{top["bytes"]} bytes)'
+        return s
@@ -0,0 +1,104 @@
+import numpy as np
+
+
+class MetricsRecorder:
+    """
+    Records a fixed set of aggregates every step into preallocated NumPy columns (grown by doubling).
+    Per step counters are fed inline by the simulation phases, nothing is recomputed by scanning.
+    """
+    columns = (
+        'step',
+        'hour_of_day',
+        'current_population',
+        'births',
+        'deaths',
+        'sleeping',
+        'active',
+        'food_remaining',
+        'mean_health',
+        'min_health',
+        'attacks',
+        'mean_x_trace',
+        'mean_y_trace',
+    )
+
+    def __init__(self, capacity=1024):
+        self.size = 0
+        self.capacity = capacity
+        self.data = {name: np.zeros(capacity) for name in self.columns}
+        self._reset_step()
+
+    def _reset_step(self):
+        self.births = 0
+        self.deaths = 0
+        self.attacks = 0
+        self.sleeping = 0
+        self.active = 0
+        self.health_total = 0
+        self.health_min = float('inf')
+
+    def record_birth(self):
+        self.births += 1
+
+    def record_death(self):
+        self.deaths += 1
+
+    def record_attack(self):
+        self.attacks += 1
+
+    def observe_cat(self, cat):
+        """
+        Called once for every cat alive at the end of the step.
+        """
+        if cat.is_sleeping():
+            self.sleeping += 1
+        else:
+            self.active += 1
+        self.health_total += cat.health
+        self.health_min = min(self.health_min, cat.health)
+
+    def end_step(self, step, hour_of_day, terrain):
+        if self.size == self.capacity:
+            self.capacity *= 2
+            for name, column in self.data.items():
+                self.data[name] = np.resize(column, self.capacity)
+        population = self.sleeping + self.active
+        n_cells = terrain.width * terrain.height
+        row = dict(
+            step=step,
+            hour_of_day=hour_of_day,
+            current_population=population,
+            births=self.births,
+            deaths=self.deaths,
+            sleeping=self.sleeping,
+            active=self.active,
+            food_remaining=terrain.food_total,
+            mean_health=self.health_total / population if population > 0 else np.nan,
+            min_health=self.health_min if population > 0 else np.nan,
+            attacks=self.attacks,
+            mean_x_trace=terrain.x_trace_total / n_cells,
+            mean_y_trace=terrain.y_trace_total / n_cells,
+        )
+        for name, value in row.items():
+            self.data[name][self.size] = value
+        self.size += 1
+        self._reset_step()
+
+    def as_dict(self):
+        return {name: column[:self.size] for name, column in self.data.items()}
+
+    def save(self, path):
+        """
+        Saves as `.npz` if the path ends with it, as CSV otherwise.
+        """
+        if path.endswith('.npz'):
+            self.save_npz(path)
+        else:
+            self.save_csv(path)
+
+    def save_npz(self, path):
+        np.savez(path, **self.as_dict())
+
+    def save_csv(self, path):
+        table = np.column_stack([self.as_dict()[name] for name in self.columns])
+        np.savetxt(path, table, delimiter=',', header=','.join(self.columns), comments='', fmt='%.10g')
@@ -1,55 +1,160 @@
 from math import log  # Python math module
 import random
 
+import numpy as np
+
 from .config import Config
-from .enums import Gender, Personality, State
-from .math import Vec2  # Project math module
+from .enums import Gender, Personality, State, Interaction
+from .math import Vec2, norm_xy  # Project math module
 from .utils import max_health
 from .logging import Logger
 
 
+class CatSummaryStore:
+    """
+    Population wide columnar storage of cat summaries. There is one array per counter, indexed by `cat_id`.
+    Counters start as integers and become floats once a float is added to them (same as Python's numeric promotion).
+    That is tracked with a bit per counter so that serialized values keep their type.
+    Single additions are buffered as (cat_id, amount) lists per counter and applied with one `np.add.at` per column by
+    `flush`, at the end of every step or before a value is read.
+    """
+    counters = ('attacked', 'got_attacked', 'conceived', 'delivered', 'lost_health', 'consumed_food', 'moved', 'aged')
+
+    def __init__(self, capacity=1024):
+        self.capacity = 0
+        self.columns = {name: np.zeros(0) for name in self.counters}
+        self.state_hours = np.zeros((0, len(State)), dtype=np.int64)
+        self.float_flags = np.zeros(0, dtype=np.uint8)
+        self._bits = {name: 1 << i for i, name in enumerate(self.counters)}
+        self._pending = {name: ([], []) for name in self.counters}  # Buffered cat ids and amounts
+        self._pending_floats = {name: [] for name in self.counters}  # Cat ids of the buffered float amounts
+        self._grow(capacity)
+
+    def _grow(self, capacity):
+        def _resize(array):
+            resized = np.zeros((capacity, *array.shape[1:]), dtype=array.dtype)
+            resized[:self.capacity] = array
+            return resized
+
+        self.columns = {name: _resize(column) for name, column in self.columns.items()}
+        self.state_hours = _resize(self.state_hours)
+        self.float_flags = _resize(self.float_flags)
+        self.capacity = capacity
+
+    def reserve(self, cat_id):
+        if cat_id >= self.capacity:
+            self._grow(max(2 * self.capacity, cat_id + 1))
+
+    def reset(self, cat_id):
+        self.flush()  # Nothing buffered may land on the reset row
+        for column in self.columns.values():
+            column[cat_id] = 0
+        self.state_hours[cat_id] = 0
+        self.float_flags[cat_id] = 0
+
+    def add(self, name, cat_id, amount):
+        cat_ids, amounts = self._pending[name]
+        cat_ids.append(cat_id)
+        amounts.append(amount)
+        if isinstance(amount, float):
+            self._pending_floats[name].append(cat_id)
+
+    def flush(self):
+        """
+        Applies the buffered additions, in the order they were made.
+        """
+        for name, (cat_ids, amounts) in self._pending.items():
+            if cat_ids:
+                np.add.at(self.columns[name], np.array(cat_ids, dtype=np.int64), np.array(amounts, dtype=np.float64))
+                cat_ids.clear()
+                amounts.clear()
+            float_ids = self._pending_floats[name]
+            if float_ids:
+                self.float_flags[np.array(float_ids, dtype=np.int64)] |= self._bits[name]
+                float_ids.clear()
+
+    def add_many(self, name, cat_ids, amounts):
+        """
+        Bulk version of `add`. Repeated ids are accumulated in order.
+        """
+        amounts = np.asarray(amounts)
+        cat_ids = np.asarray(cat_ids, dtype=np.int64)
+        np.add.at(self.columns[name], cat_ids, amounts)
+        if amounts.dtype.kind == 'f':
+            self.float_flags[cat_ids] |= self._bits[name]
+
+    def add_state_hours(self, cat_id, state, hours):
+        self.state_hours[cat_id, state.value] += hours
+
+    def add_state_hours_many(self, cat_ids, state_values, hours=1):
+        np.add.at(self.state_hours, (np.asarray(cat_ids, dtype=np.int64), np.asarray(state_values, dtype=np.int64)),
+                  hours)
+
+    def value(self, name, cat_id):
+        if self._pending[name][0]:
+            self.flush()
+        v = self.columns[name][cat_id]
+        return float(v) if self.float_flags[cat_id] & self._bits[name] else int(v)
+
+    def state_hours_of(self, cat_id):
+        return {state: int(self.state_hours[cat_id, state.value]) for state in State}
+
+
 class CatSummary:
-    def __init__(self):
-        self.state_hours = {state: 0 for state in State}
-        self.attacked = 0
-        self.got_attacked = 0
-        self.conceived = 0
-        self.delivered = 0
-        self.lost_health = 0
-        self.consumed_food = 0
-        self.moved = 0
-        self.aged = 0
+    """
+    A view of a single cat's row in a `CatSummaryStore`.
+    """
+    __slots__ = ('_store', '_cat_id')
+
+    def __init__(self, store: CatSummaryStore, cat_id: int):
+        self._store = store
+        self._cat_id = cat_id
+
+    def __getattr__(self, name):
+        if name in CatSummaryStore.counters:
+            return self._store.value(name, self._cat_id)
+        raise AttributeError(name)
+
+    @property
+    def state_hours(self):
+        return self._store.state_hours_of(self._cat_id)
 
     def update_moved(self, distance):
-        self.moved += distance
+        self._store.add('moved', self._cat_id, distance)
 
     def update_conceived(self):
-        self.conceived += 1
+        self._store.add('conceived', self._cat_id, 1)
 
     def update_attacked(self, amount):
-        self.attacked += amount
+        self._store.add('attacked', self._cat_id, amount)
 
     def update_got_attacked(self, amount):
-        self.got_attacked += amount
+        self._store.add('got_attacked', self._cat_id, amount)
 
     def update_delivered(self):
-        self.delivered += 1
+        self._store.add('delivered', self._cat_id, 1)
 
     def update_consumed_food(self, amount):
-        self.consumed_food += amount
+        self._store.add('consumed_food', self._cat_id, amount)
 
     def update_lost_health(self, amount):
-        self.lost_health += amount
+        self._store.add('lost_health', self._cat_id, amount)
 
     def update_aged(self, years):
-        self.aged += years
+        self._store.add('aged', self._cat_id, years)
 
     def update_state_hours(self, state, hours):
-        self.state_hours[state] += hours
+        self._store.add_state_hours(self._cat_id, state, hours)
+
+    def copy_to(self, store: CatSummaryStore, cat_id: int):
+        store.reserve(cat_id)
+        for name in CatSummaryStore.counters:
+            store.add(name, cat_id, self._store.value(name, self._cat_id))
+        store.state_hours[cat_id] += self._store.state_hours[self._cat_id]
 
     def serialize(self):
         return dict(
-            state_hours={str(state) : hours for state, hours in self.state_hours.items()},
+            state_hours={str(state): hours for state, hours in self.state_hours.items()},
             attacked=self.attacked,
             got_attacked=self.got_attacked,
             conceived=self.conceived,
@@ -67,8 +172,33 @@ class CatSummary:
                f', consumed_food={self.consumed_food}, moved={self.moved}, aged={self.aged}}}'
 
 
+class CatGroupStats:
+    """
+    Counts and strength sums of a set of cats, grouped by the attributes `Cat.mutual_attraction` depends on
+    i.e. (gender, personality, sexually active).
+    """
+    __slots__ = ('groups',)
+
+    def __init__(self, cats=()):
+        self.groups = {}
+        for cat in cats:
+            self.add(cat)
+
+    def add(self, cat: 'Cat'):
+        key = (cat.gender, cat.personality, cat.is_sexually_active())
+        count, strength_sum = self.groups.get(key, (0, 0))
+        self.groups[key] = (count + 1, strength_sum + cat._strength())
+
+    def __len__(self):
+        return sum(count for count, _strength_sum in self.groups.values())
+
+
 class Cat:
+    __slots__ = ('cat_id', 'position', 'age', 'gender', 'personality', 'health', 'state', 'hours_since_last_conception',
+                 'sleep_duration', 'fetus', '_force', '_health', '_step_finalized', 'summary')
+
     _next_id = 0
+    summary_store = CatSummaryStore()
 
     def __init__(self, position: Vec2, age: float, gender: Gender, personality: Personality, health: int, state: State,
                  sleep_duration=0, total_distance_moved=0, summary=None, fetus=None,
@@ -76,8 +206,6 @@ class Cat:
         """
         Age is in years.
         """
-        if summary is None:
-            summary = CatSummary()
         if cat_id is not None:
             Cat._next_id = max(Cat._next_id, cat_id)
         self.cat_id = Cat._next_id
@@ -96,9 +224,14 @@ class Cat:
         self._health = self.health
         self._step_finalized = True
 
-        self.summary = summary
+        Cat.summary_store.reserve(self.cat_id)
+        Cat.summary_store.reset(self.cat_id)
+        if summary is not None:
+            summary.copy_to(Cat.summary_store, self.cat_id)
+        self.summary = CatSummary(Cat.summary_store, self.cat_id)  # View of its row, in the store it was created in
 
-        Logger.log(f'[Create] Cat is created {self}')
+        if Logger.is_enabled():
+            Logger.log(f'[Create] Cat is created {self}')
 
     def mutual_attraction(self, other_cat: 'Cat', temperature: float):
         """
@@ -116,6 +249,29 @@ class Cat:
         else:
             return self._mutual_attraction_factor(other_cat)
 
+    def mutual_attraction_total(self, group_stats: 'CatGroupStats', temperature: float):
+        """
+        Sum of `mutual_attraction` over all cats summarized by `group_stats` (which should not include this cat).
+        Closed form over the group counts and strength sums, independent of the number of cats.
+        """
+        if self.is_sleeping():
+            return 0
+        strength = self._strength()
+        sexually_active = self.is_sexually_active()
+        total = 0
+        for (gender, personality, other_sexually_active), (count, strength_sum) in group_stats.groups.items():
+            if personality == self.personality:
+                attraction = 0.7 * count
+            else:
+                attraction = count * strength - strength_sum  # Sum of dominance factors
+            if gender != self.gender:
+                if sexually_active and other_sexually_active:
+                    attraction = (0.9 if temperature > 28 else 0.7) * count
+                else:
+                    attraction = 0.75 * attraction
+            total += attraction
+        return total
+
     def _mutual_attraction_factor(self, other_cat: 'Cat'):
         """
         Repulsive when `other_cat` is older.
@@ -167,44 +323,68 @@ class Cat:
         return effective_trace * Config.trace_attraction_factor
 
     def random_force(self):
+        return Vec2(*self.random_force_xy())
+
+    def random_force_xy(self):
         if self.is_sleeping():
-            return Vec2(0, 0)
-        return Vec2(random.uniform(1, -1), random.uniform(1, -1))
+            return 0, 0
+        return random.uniform(1, -1), random.uniform(1, -1)
 
     def move(self, target_position, health_damage):
-        Logger.log(f'[Action] {self} is moving to {target_position}')
-        distance = (target_position - self.position).norm()
+        if Logger.is_enabled():
+            Logger.log(f'[Action] {self} is moving to {target_position}')
+        distance = norm_xy(target_position.x - self.position.x, target_position.y - self.position.y)
         self.position = target_position
         self.damage_health(health_damage)
-        self.summary.update_moved(distance)
+        Cat.summary_store.add('moved', self.cat_id, distance)
 
-    def interact(self, other_cat: 'Cat', temperature: float):
+    def interact(self, other_cat: 'Cat', temperature: float, probability_scale=1):
         """
         Interaction between two cats when they are in the same cell.
+        :return: the `Interaction` that happened
+        """
+        return self.interactions(other_cat, temperature, probability_scale)[0]
+
+    def interactions(self, other_cat: 'Cat', temperature: float, probability_scale=1):
+        """
+        Same as `interact`, for a sampled partner standing in for `probability_scale` partners (bounded contact mode).
+        Reproduction then happens with the probability that at least one of those partners would have reproduced,
+        1 - (1 - p) ** scale. Attacks happen floor(p * scale) times plus once more with probability of the fractional
+        part, so that the expected number of attacks is p * scale (p at most 1, as in an encounter). Only the first one
+        lands on `other_cat`, the caller spreads the others over the cats it stands in for, see `attack_any`.
+        :return: (the `Interaction` that happened, number of times it happened)
         """
         if self.cat_id == other_cat.cat_id:
-            return
+            return Interaction.none, 0
         if self.is_sleeping():
-            return
+            return Interaction.none, 0
         if other_cat.is_sleeping():
-            return
+            return Interaction.none, 0
         if self.gender != other_cat.gender:
             if self.is_sexually_active() and other_cat.is_sexually_active():
                 reproduction_probability = 0.9 if temperature > 28 else 0.7
+                if probability_scale != 1:
+                    reproduction_probability = 1 - (1 - reproduction_probability) ** probability_scale
                 if random.uniform(0, 1) < reproduction_probability and self.health > 25 and other_cat.health > 25:
                     female_cat, male_cat = Cat.choose_female_cat(self, other_cat)
                     # Reproduction needs energy
                     self.damage_health(20)
                     other_cat.damage_health(20)
                     female_cat.conceive(male_cat)
-                    return
+                    return Interaction.reproduction, 1
         if self.personality != other_cat.personality:
             dominance = self._dominance_factor(other_cat)
-            attacking_probability = max(0.0, dominance)
+            attacking_probability = min(1.0, max(0.0, dominance))
+            n_attacks = 0
+            if probability_scale != 1:
+                n_attacks, attacking_probability = divmod(attacking_probability * probability_scale, 1)
+                n_attacks = int(n_attacks)
             if random.uniform(0, 1) < attacking_probability:
-                power = dominance * 10
-                self.attack(other_cat, power)
-                return
+                n_attacks += 1
+            if n_attacks:
+                self.attack(other_cat, dominance * 10)
+                return Interaction.attack, n_attacks
+        return Interaction.none, 0
 
     @staticmethod
     def choose_female_cat(cat_1, cat_2):
@@ -214,16 +394,46 @@ class Cat:
         return self.age > 4 / 12 and not self.is_pregnant()  # 4 months
 
     def attack(self, other_cat, power):
-        Logger.log(f'[Action] {self} is attacking {other_cat} with {power} power')
+        if Logger.is_enabled():
+            Logger.log(f'[Action] {self} is attacking {other_cat} with {power} power')
         other_cat.damage_health(power)
         self.damage_health(power / 5)  # Attacking drains energy
-        other_cat.summary.update_got_attacked(power)
-        self.summary.update_attacked(power)
+        Cat.summary_store.add('got_attacked', other_cat.cat_id, power)
+        Cat.summary_store.add('attacked', self.cat_id, power)
+
+    def attack_any(self, candidates, n):
+        """
+        Makes `n` attacks on `candidates`. A candidate is attacked with the probability this cat would attack it in an
+        encounter, so that weaker cats are picked more often. If `candidates` run out first, the remaining attacks
+        land on the candidates that were passed over, in turn. Candidates it cannot attack are skipped.
+        :param candidates: iterable of cats, consumed until `n` are attacked
+        :return: the attacked cats, once per attack
+        """
+        attacked = []
+        passed_over = []
+        for other_cat in candidates:
+            if other_cat.is_sleeping() or other_cat.personality == self.personality:
+                continue
+            dominance = self._dominance_factor(other_cat)
+            if dominance <= 0:
+                continue
+            if random.uniform(0, 1) < dominance:
+                attacked.append(other_cat)
+                if len(attacked) == n:
+                    break
+            else:
+                passed_over.append(other_cat)
+        if passed_over:
+            attacked.extend(passed_over[i % len(passed_over)] for i in range(n - len(attacked)))
+        for other_cat in attacked:
+            self.attack(other_cat, self._dominance_factor(other_cat) * 10)
+        return attacked
 
     def conceive(self, other_cat):
-        Logger.log(f'[Action] {self} got conceived by {other_cat}')
+        if Logger.is_enabled():
+            Logger.log(f'[Action] {self} got conceived by {other_cat}')
         self.hours_since_last_conception = 0
-        self.summary.update_conceived()
+        Cat.summary_store.add('conceived', self.cat_id, 1)
         self.fetus = Cat(
             position=self.position,
             personality=random.choice([self.personality, other_cat.personality]),
@@ -240,28 +450,31 @@ class Cat:
         self.fetus = None
         cat_baby.position = self.position
         cat_baby.state = State.active
-        self.summary.update_delivered()
-        Logger.log(f'[Action] {self} delivered {cat_baby}')
+        Cat.summary_store.add('delivered', self.cat_id, 1)
+        if Logger.is_enabled():
+            Logger.log(f'[Action] {self} delivered {cat_baby}')
         return cat_baby
 
     def consume_food(self, amount):
-        Logger.log(f'[Action] {self} is consuming {amount} foods')
+        if Logger.is_enabled():
+            Logger.log(f'[Action] {self} is consuming {amount} foods')
         final_amount = min(self.max_health(), self._health + amount)
-        self.summary.update_consumed_food(final_amount - self._health)
+        Cat.summary_store.add('consumed_food', self.cat_id, final_amount - self._health)
         self._health = final_amount
 
     def damage_health(self, amount):
         # if amount == 0:
         #     return
-        Logger.log(f'[Alert] {self} got damaged {amount}')
+        if Logger.is_enabled():
+            Logger.log(f'[Alert] {self} got damaged {amount}')
         final_amount = max(0, self._health - amount)
-        self.summary.update_lost_health(self._health - final_amount)
+        Cat.summary_store.add('lost_health', self.cat_id, self._health - final_amount)
         self._health = final_amount
 
     def age_up(self, hours=1):
         years = hours / (365 * 24)
         self.age += years
-        self.summary.update_aged(years)
+        Cat.summary_store.add('aged', self.cat_id, years)
         self.damage_health(1)
         if self.state == State.sleeping:
             self.sleep_duration += hours
@@ -269,26 +482,45 @@ class Cat:
             self.hours_since_last_conception += hours
 
     def update_state_hours(self, hours=1):
-        self.summary.update_state_hours(self.state, hours)
+        Cat.summary_store.add_state_hours(self.cat_id, self.state, hours)
         if self.is_pregnant():
-            self.fetus.summary.update_state_hours(self.state, hours)
+            Cat.summary_store.add_state_hours(self.fetus.cat_id, self.state, hours)
+
+    @staticmethod
+    def update_state_hours_many(cats, hours=1):
+        """
+        Bulk version of `update_state_hours` for a collection of cats.
+        """
+        cat_ids = [cat.cat_id for cat in cats]
+        state_values = [cat.state.value for cat in cats]
+        for cat in cats:
+            if cat.is_pregnant():
+                cat_ids.append(cat.fetus.cat_id)
+                state_values.append(cat.state.value)
+        Cat.summary_store.add_state_hours_many(cat_ids, state_values, hours)
 
     def wake_up(self):
-        Logger.log(f'[Action] {self} is wake-up after {self.sleep_duration} hours of sleep')
+        if Logger.is_enabled():
+            Logger.log(f'[Action] {self} is wake-up after {self.sleep_duration} hours of sleep')
         self.state = State.active
         self.sleep_duration = 0
 
     def sleep(self):
-        Logger.log(f'[Action] {self} is starting to sleep')
+        if Logger.is_enabled():
+            Logger.log(f'[Action] {self} is starting to sleep')
         self.state = State.sleeping
         self.sleep_duration = 0
 
     def die(self):
-        Logger.log(f'[Action] RIP {self} :(')
+        if Logger.is_enabled():
+            Logger.log(f'[Action] RIP {self} :(')
         self.state = State.dead
 
     def add_force(self, force):
-        self._force += force
+        self._force.iadd(force)
+
+    def add_force_xy(self, fx, fy):
+        self._force.iadd_xy(fx, fy)
 
     def get_force(self):
         return self._force
@@ -300,7 +532,7 @@ class Cat:
             raise ValueError('Trying to start new step without finalizing the last step.')
 
     def finalize_step(self):
-        self._force = Vec2(0, 0)
+        self._force.set(0, 0)
         self.health = self._health
         self.age_up()
         self._step_finalized = True
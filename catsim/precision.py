@@ -0,0 +1,127 @@
+"""
+Reduced precision storage (`Precision.compact`). Per cell values and cat state are rounded to narrow types:
+    traces          uint16 levels of Config.max_trace / TRACE_LEVELS, faded by truncation
+    food amounts    float32
+    health and age  float32, rounded at the end of every step
+    elevations      int16
+    cell types      uint8
+    flat indices    int32, while the map has fewer than 2 ** 31 cells
+Memory is only saved where the values live in NumPy arrays: the layers and the food of sparse terrains and the cell
+type index. Values held by Python objects keep Python's types, so they are rounded without getting smaller: trace
+levels and food of `CompactCell`s (and with them every dense terrain), and health and age of cats. Cat enums
+(gender, personality, state) stay enum members, there are no uint8 cat columns.
+Values are rounded whenever they are written, so a compact run drifts away from the full precision one. `drift`
+measures how far.
+"""
+import numpy as np
+
+from .config import Config
+from .digest import isolated, state_arrays, state_fields
+
+TRACE_LEVELS = int(np.iinfo(np.uint16).max)
+ELEVATION_DTYPE = np.int16
+CELL_TYPE_DTYPE = np.uint8
+FOOD_DTYPE = np.float32
+
+
+def to_float32(value):
+    return float(np.float32(value))
+
+
+def trace_level(value):
+    """
+    Nearest level of a trace value.
+    """
+    return round(value * TRACE_LEVELS / Config.max_trace)
+
+
+def trace_value(level):
+    return level * Config.max_trace / TRACE_LEVELS
+
+
+def flat_dtype(width, height):
+    """
+    Narrowest type of the flat indices (y * width + x) of a map.
+    """
+    return np.int32 if width * height <= np.iinfo(np.int32).max else np.int64
+
+
+def check_elevations(values):
+    """
+    :raise ValueError: if an elevation does not fit in `ELEVATION_DTYPE`
+    """
+    values = np.asarray(values)
+    info = np.iinfo(ELEVATION_DTYPE)
+    if values.size and (values.min() < info.min or values.max() > info.max):
+        raise ValueError(f'Elevations should be within [{info.min}, {info.max}] with compact precision.')
+
+
+def round_cat_state(cats):
+    """
+    Rounds the health and age of `cats` to float32, in one NumPy pass. They are stored back as Python floats, so this
+    bounds their precision but not their size.
+    """
+    if not cats:
+        return
+    values = np.array([(cat.health, cat._health, cat.age) for cat in cats], dtype=np.float32).tolist()
+    for cat, (health, working_health, age) in zip(cats, values):
+        cat.health, cat._health, cat.age = health, working_health, age
+
+
+def _drift_record(step, full, compact):
+    """
+    :param full: `state_arrays` of the full precision simulation
+    :param compact: `state_arrays` of the compact precision simulation
+    """
+    _, i, j = np.intersect1d(full['cat_id'], compact['cat_id'], assume_unique=True, return_indices=True)
+    moved_apart = (full['x'][i] != compact['x'][j]) | (full['y'][i] != compact['y'][j])
+    return dict(
+        step=step,
+        population=len(full['cat_id']),
+        population_compact=len(compact['cat_id']),
+        common_cats=len(i),
+        moved_apart=float(moved_apart.mean()) if len(i) else 0.0,
+        health_error=float(np.abs(full['health'][i] - compact['health'][j]).mean()) if len(i) else 0.0,
+        food_error=float(np.abs(full['food'] - compact['food']).mean()) if len(full['food']) else 0.0,
+        trace_total_error=float(abs(full['x_trace'][-1] - compact['x_trace'][-1]) +
+                                abs(full['y_trace'][-1] - compact['y_trace'][-1])),
+    )
+
+
+def drift(simulation_full, simulation_compact, n_steps):
+    """
+    Advances a full and a compact precision simulation of the same configuration side by side, and measures how far
+    the compact one drifts after every step.
+        population, population_compact  Living cats of each
+        common_cats                     Living cats in both, by cat_id
+        moved_apart                     Share of the common cats at different positions
+        health_error                    Mean absolute health difference of the common cats
+        food_error                      Mean absolute food amount difference of the food cells
+        trace_total_error               Absolute difference of the trace layer totals, summed over both layers
+    :return: dict of the first step each state field diverged at (None if it never did), the record of the last step,
+    and the records of every step
+    """
+    simulations = (simulation_full, simulation_compact)
+    contexts = ({}, {})
+    for simulation, context in zip(simulations, contexts):
+        simulation.render_enabled = False
+        simulation.save_state_enabled = False
+        simulation.show_progress = False
+        with isolated(context):
+            simulation._setup()
+    first_divergence = dict.fromkeys(state_fields)
+    records = []
+    for _ in range(n_steps):
+        arrays = []
+        for simulation, context in zip(simulations, contexts):
+            with isolated(context):
+                if not simulation.is_finished():
+                    simulation.update()
+                arrays.append(state_arrays(simulation))
+        step = simulation_full.current_step
+        for name in state_fields:
+            a, b = arrays[0][name], arrays[1][name]
+            if first_divergence[name] is None and (a.shape != b.shape or not np.array_equal(a, b)):
+                first_divergence[name] = step
+        records.append(_drift_record(step, *arrays))
+    return dict(first_divergence=first_divergence, final=records[-1] if records else None, steps=records)
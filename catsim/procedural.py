@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from .enums import CellType
+from .utils import cell_type_weights
+
+VERSION = 1  # Bump when the generated maps change, so that stale cache entries are not reused
+
+
+def smooth_noise(rng, height, width, scale, octaves=4, persistence=0.5):
+    """
+    Fractal value noise in [0, 1]. Random values on a lattice of `scale` cells are interpolated with a smoothstep, and
+    `octaves` layers of halving scale are summed with amplitudes decaying by `persistence`.
+    """
+    noise = np.zeros((height, width), dtype=np.float32)
+    amplitude = 1.0
+    total_amplitude = 0.0
+    for _ in range(octaves):
+        lattice = rng.random((height // scale + 2, width // scale + 2), dtype=np.float32)
+        # Separable interpolation, first along x then along y
+        noise_x = _interpolate(lattice, width, scale, axis=1)
+        noise += amplitude * _interpolate(noise_x, height, scale, axis=0)
+        total_amplitude += amplitude
+        amplitude *= persistence
+        scale = max(1, scale // 2)
+    noise /= total_amplitude
+    return noise
+
+
+def _interpolate(values, n, scale, axis):
+    t = np.arange(n, dtype=np.float32) / scale
+    i0 = t.astype(np.intp)
+    t -= i0
+    t = t * t * (3 - 2 * t)  # smoothstep
+    if axis == 0:
+        t = t[:, None]
+    a = np.take(values, i0, axis=axis)
+    b = np.take(values, i0 + 1, axis=axis)
+    return a + (b - a) * t
+
+
+def _threshold(field, fraction):
+    """
+    Value above which `fraction` of the field lies. Estimated on a subsample of at most about a million cells.
+    """
+    step = max(1, int((field.size / 1e6) ** 0.5))
+    return np.quantile(field[::step, ::step], 1 - fraction)
+
+
+def generate(width, height, seed, max_elevation=10, feature_scale=16):
+    """
+    Generates a terrain from the seed only.
+    Elevations are smooth noise scaled to [0, max_elevation]. Food, beds and boxes are placed in clusters of about
+    `feature_scale` cells where their own noise fields are highest, covering about the same share of cells as
+    `random_cell_type_list`. Food takes precedence over beds and beds over boxes where clusters overlap.
+    :return: (elevations int32 array, cell types uint8 array of CellType values), both of shape (height, width)
+    """
+    rng = np.random.default_rng(seed)
+    elevation_scale = max(1, 4 * feature_scale)
+    noise = smooth_noise(rng, height, width, elevation_scale)
+    low, high = noise.min(), noise.max()
+    if high > low:
+        noise = (noise - low) / (high - low)
+    elevations = np.rint(noise * max_elevation).astype(np.int32)
+
+    weights = cell_type_weights()
+    total_weight = sum(weights.values())
+    cell_types = np.full((height, width), CellType.floor.value, dtype=np.uint8)
+    assigned = np.zeros((height, width), dtype=bool)
+    for cell_type in (CellType.food, CellType.bed, CellType.box):
+        field = smooth_noise(rng, height, width, max(1, feature_scale), octaves=2)
+        mask = field > _threshold(field, weights[cell_type] / total_weight)
+        mask &= ~assigned
+        cell_types[mask] = cell_type.value
+        assigned |= mask
+    return elevations, cell_types
+
+
+def cache_key(**parameters):
+    data = json.dumps(dict(version=VERSION, **parameters), sort_keys=True)
+    return hashlib.blake2b(data.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def generate_cached(width, height, seed, max_elevation=10, feature_scale=16, cache_dir=None):
+    """
+    `generate` with its outputs cached in `cache_dir` keyed by the parameters. Caching is skipped if `cache_dir` is
+    None.
+    """
+    parameters = dict(width=width, height=height, seed=seed, max_elevation=max_elevation,
+                      feature_scale=feature_scale)
+    if cache_dir is None:
+        return generate(**parameters)
+
+    path = os.path.join(cache_dir, f'terrain-{cache_key(**parameters)}.npz')
+    if os.path.exists(path):
+        with np.load(path) as data:
+            return data['elevations'], data['cell_types']
+
+    elevations, cell_types = generate(**parameters)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write to a temporary file first so that concurrent runs never read a partial map
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        np.savez(f, elevations=elevations, cell_types=cell_types)
+    os.replace(temp_path, path)
+    return elevations, cell_types
+
+
+def sparse_uniform_cell_types(width, height, seed, chunk_size=1 << 20):
+    """
+    Draws the same cell type shares as `random_cell_type_list` without visiting floor cells: the gaps between
+    consecutive non floor cells are geometric, then each of them gets a feature type by weight.
+    :return: (ascending flat indices, CellType values) of the non floor cells
+    """
+    rng = np.random.default_rng(seed)
+    weights = cell_type_weights()
+    total_weight = sum(weights.values())
+    p = 1 - weights[CellType.floor] / total_weight
+    area = width * height
+    chunks = []
+    last = -1
+    while True:
+        flat = last + np.cumsum(rng.geometric(p, size=chunk_size))
+        chunks.append(flat[flat < area])
+        if flat[-1] >= area:
+            break
+        last = flat[-1]
+    flat = np.concatenate(chunks)
+    features = [CellType.food, CellType.bed, CellType.box]
+    feature_weights = np.array([weights[cell_type] for cell_type in features], dtype=np.float64)
+    values = rng.choice([cell_type.value for cell_type in features], size=len(flat),
+                        p=feature_weights / feature_weights.sum()).astype(np.uint8)
+    return flat, values
@@ -0,0 +1,204 @@
+import math
+
+import numpy as np
+
+from .enums import Neighborhood
+from .math import norm_xy
+
+
+class QuadTree:
+    """
+    Static quadtree over lattice points (e.g. food cells) for Barnes-Hut style far field sums.
+    Points are ordered so that every node covers a contiguous range of them. Node masses and centroids are then prefix
+    sum differences, and can be refreshed for all nodes at once when the masses change. When only a few points differ
+    from a reference state (food consumed since the terrain was built or refilled), `update_masses` only touches the
+    nodes above them.
+    """
+
+    def __init__(self, xs, ys, leaf_size=4):
+        self.xs = np.asarray(xs, dtype=np.int64)
+        self.ys = np.asarray(ys, dtype=np.int64)
+        self.leaf_size = leaf_size
+        self._order = []
+        self.start, self.end, self.children, self.parent = [], [], [], []
+        self.min_x, self.max_x, self.min_y, self.max_y = [], [], [], []
+        if len(self.xs) > 0:
+            size = 1
+            while size < max(self.xs.max(), self.ys.max()) + 1:
+                size *= 2
+            self._build(np.arange(len(self.xs)), 0, 0, size)
+        self.order = np.array(self._order, dtype=np.int64)
+        self.tree_xs = self.xs[self.order].tolist()
+        self.tree_ys = self.ys[self.order].tolist()
+        self.start = np.array(self.start, dtype=np.int64)
+        self.end = np.array(self.end, dtype=np.int64)
+        self.position = np.empty(len(self.order), dtype=np.int64)  # Tree order position of each point
+        self.position[self.order] = np.arange(len(self.order))
+        self.leaf = np.zeros(len(self.order), dtype=np.int64)  # Leaf node of each position
+        for node, children in enumerate(self.children):
+            if not children:
+                self.leaf[self.start[node]:self.end[node]] = node
+
+        self.masses = []  # In tree order
+        self.mass = []  # Per node
+        self.moment_x = []  # Per node, sum of mass * x
+        self.moment_y = []
+        self.centroid_x = []
+        self.centroid_y = []
+        self._references = {}  # Key of a reference state -> copies of the lists above
+        self._reference_key = None
+        self._changed_positions = []  # Positions and nodes that differ from the reference state
+        self._changed_nodes = set()
+
+    def _build(self, idx, x0, y0, size, parent=-1):
+        node = len(self.start)
+        self.start.append(len(self._order))
+        self.end.append(None)
+        self.children.append([])
+        self.parent.append(parent)
+        xs, ys = self.xs[idx], self.ys[idx]
+        self.min_x.append(int(xs.min()))
+        self.max_x.append(int(xs.max()))
+        self.min_y.append(int(ys.min()))
+        self.max_y.append(int(ys.max()))
+        if len(idx) <= self.leaf_size or size <= 1:
+            self._order.extend(idx.tolist())
+        else:
+            half = size // 2
+            for qx, qy in ((x0, y0), (x0 + half, y0), (x0, y0 + half), (x0 + half, y0 + half)):
+                mask = (qx <= xs) & (xs < qx + half) & (qy <= ys) & (ys < qy + half)
+                if mask.any():
+                    self.children[node].append(self._build(idx[mask], qx, qy, half, node))
+        self.end[node] = len(self._order)
+        return node
+
+    def __len__(self):
+        return len(self.xs)
+
+    def set_masses(self, masses):
+        """
+        :param masses: mass of each point, in the order the points were given
+        """
+        masses = np.asarray(masses, dtype=np.float64)[self.order]
+        self.masses = masses.tolist()
+        cum_mass = np.concatenate(([0.0], np.cumsum(masses)))
+        cum_mass_x = np.concatenate(([0.0], np.cumsum(masses * self.xs[self.order])))
+        cum_mass_y = np.concatenate(([0.0], np.cumsum(masses * self.ys[self.order])))
+        mass = cum_mass[self.end] - cum_mass[self.start]
+        moment_x = cum_mass_x[self.end] - cum_mass_x[self.start]
+        moment_y = cum_mass_y[self.end] - cum_mass_y[self.start]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.centroid_x = (moment_x / mass).tolist()
+            self.centroid_y = (moment_y / mass).tolist()
+        self.mass = mass.tolist()
+        self.moment_x = moment_x.tolist()
+        self.moment_y = moment_y.tolist()
+        self._reference_key = None
+
+    def update_masses(self, key, reference_masses, points, masses):
+        """
+        Sets the masses to those of a reference state, except for `points`. Costs O(len(points) * depth) as long as
+        the reference state is the same as in the previous call, and a copy of the node lists when it changes.
+        :param key: hashable identifying the reference state
+        :param reference_masses: called without arguments for the masses of the reference state (in the order the
+        points were given) the first time `key` is seen
+        :param points: indices of the points that differ from the reference state, in the order the points were given
+        :param masses: their masses
+        """
+        if key not in self._references:
+            self.set_masses(reference_masses())
+            self._references[key] = (self.masses, self.mass, self.moment_x, self.moment_y, self.centroid_x,
+                                     self.centroid_y)
+        reference = self._references[key]
+        if key != self._reference_key:
+            self.masses, self.mass, self.moment_x, self.moment_y, self.centroid_x, self.centroid_y = \
+                [list(values) for values in reference]
+            self._reference_key = key
+        else:
+            # Back to the reference state
+            reference_masses, reference_mass, reference_moment_x, reference_moment_y, reference_centroid_x, \
+                reference_centroid_y = reference
+            for i in self._changed_positions:
+                self.masses[i] = reference_masses[i]
+            for node in self._changed_nodes:
+                self.mass[node] = reference_mass[node]
+                self.moment_x[node] = reference_moment_x[node]
+                self.moment_y[node] = reference_moment_y[node]
+                self.centroid_x[node] = reference_centroid_x[node]
+                self.centroid_y[node] = reference_centroid_y[node]
+        self._changed_positions = []
+        self._changed_nodes = set()
+        positions = self.position[np.asarray(points, dtype=np.int64)].tolist()
+        for i, mass in zip(positions, masses):
+            delta = mass - self.masses[i]
+            if delta == 0:
+                continue
+            self.masses[i] = mass
+            self._changed_positions.append(i)
+            x, y = self.tree_xs[i], self.tree_ys[i]
+            node = int(self.leaf[i])
+            while node >= 0:
+                self.mass[node] += delta
+                self.moment_x[node] += delta * x
+                self.moment_y[node] += delta * y
+                self._changed_nodes.add(node)
+                node = self.parent[node]
+        for node in self._changed_nodes:
+            mass = self.mass[node]
+            self.centroid_x[node] = self.moment_x[node] / mass if mass != 0 else math.nan
+            self.centroid_y[node] = self.moment_y[node] / mass if mass != 0 else math.nan
+
+    def field(self, x, y, r, neighborhood: Neighborhood, theta):
+        """
+        Approximates the sum of mass * unit(point - (x, y)) over the points in the neighborhood of radius `r`.
+        Nodes that are entirely in the neighborhood and look small from (x, y) (extent < theta * distance to the
+        centroid) contribute once through their centroid. Everything else is summed point by point, so theta = 0 is
+        exact.
+        :return: (x, y) of the sum
+        """
+        r = round(r)
+        fx, fy = 0.0, 0.0
+        if len(self) == 0:
+            return fx, fy
+        moore = neighborhood == Neighborhood.Moore
+
+        def _inside(px, py):
+            dx, dy = abs(px - x), abs(py - y)
+            return (dx <= r and dy <= r) if moore else dx + dy <= r
+
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            if self.mass[node] == 0:
+                continue
+            min_x, max_x, min_y, max_y = self.min_x[node], self.max_x[node], self.min_y[node], self.max_y[node]
+            # Distance from (x, y) to the bounding box, per axis
+            gap_x = max(min_x - x, 0, x - max_x)
+            gap_y = max(min_y - y, 0, y - max_y)
+            if (gap_x > r or gap_y > r) if moore else gap_x + gap_y > r:
+                continue  # Entirely outside
+            inside = _inside(min_x, min_y) and _inside(max_x, min_y) and _inside(min_x, max_y) and \
+                _inside(max_x, max_y)
+            if inside and theta > 0:
+                dx, dy = self.centroid_x[node] - x, self.centroid_y[node] - y
+                distance = norm_xy(dx, dy)
+                extent = max(max_x - min_x, max_y - min_y) + 1
+                if distance > 0 and extent < theta * distance:
+                    mass = self.mass[node]
+                    fx += mass * dx / distance
+                    fy += mass * dy / distance
+                    continue
+            if self.children[node]:
+                stack.extend(self.children[node])
+                continue
+            for i in range(self.start[node], self.end[node]):
+                px, py = self.tree_xs[i], self.tree_ys[i]
+                if not inside and not _inside(px, py):
+                    continue
+                dx, dy = px - x, py - y
+                distance = norm_xy(dx, dy)
+                if distance > 0:
+                    mass = self.masses[i]
+                    fx += mass * dx / distance
+                    fy += mass * dy / distance
+        return fx, fy
@@ -0,0 +1,79 @@
+"""
+Streaming results format (NDJSON). One JSON record per line, each with a `type`:
+    metadata     Run metadata, written once
+    terrain_row  Static terrain (elevations and cell types) of one row
+    terrain_cell Static terrain of one non empty cell, instead of rows with a sparse terrain
+    cat          Summary of one cat (every cat ever born)
+    food_cell    Remaining food of one food cell
+Records are generated lazily so memory stays constant regardless of the run size.
+"""
+import json
+from itertools import islice
+
+import numpy as np
+
+from .enums import CellType
+from .terrain import SparseLayer, elevation_row, cell_type_row
+
+
+def iter_records(simulation):
+    yield dict(type='metadata', **simulation.serialize_metadata())
+    if isinstance(simulation.cell_types, SparseLayer):
+        yield from _iter_sparse_terrain(simulation.elevations, simulation.cell_types)
+    else:
+        yield from _iter_terrain_rows(simulation)
+    for cat in simulation.iter_cats():
+        yield dict(type='cat', **cat.serialize())
+    for cell in simulation.terrain.cells_of_type(CellType.food):
+        yield dict(type='food_cell', position=cell.position.serialize(), food_amount=cell.food_amount)
+
+
+def _iter_terrain_rows(simulation):
+    for y in range(simulation.height):
+        yield dict(
+            type='terrain_row',
+            y=y,
+            elevations=elevation_row(simulation.elevations, y),
+            cell_types=[str(ct) for ct in cell_type_row(simulation.cell_types, y)],
+        )
+
+
+def _iter_sparse_terrain(elevations: SparseLayer, cell_types: SparseLayer):
+    """
+    Cells with a non zero elevation or a non floor type, in row major order.
+    """
+    flat = np.union1d(elevations.flat, cell_types.flat)
+    ys, xs = np.divmod(flat, elevations.width)
+    for x, y, elevation, cell_type in zip(xs.tolist(), ys.tolist(), elevations.get_many(flat).tolist(),
+                                          cell_types.get_many(flat).tolist()):
+        yield dict(type='terrain_cell', x=x, y=y, elevation=elevation, cell_type=str(CellType(cell_type)))
+
+
+def write_ndjson(simulation, path):
+    with open(path, 'w') as rf:
+        for record in iter_records(simulation):
+            rf.write(json.dumps(record))
+            rf.write('\n')
+
+
+def iter_ndjson(path):
+    with open(path, 'r') as rf:
+        for line in rf:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def read_ndjson_chunks(path, chunk_size=10000, record_type=None):
+    """
+    Reads a NDJSON results file in chunks of at most `chunk_size` records.
+    :param record_type: If given, only records of this type are returned.
+    """
+    records = iter_ndjson(path)
+    if record_type is not None:
+        records = (record for record in records if record['type'] == record_type)
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            return
+        yield chunk
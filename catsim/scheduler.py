@@ -0,0 +1,32 @@
+import heapq
+
+from .enums import EventKind
+
+
+class Scheduler:
+    """
+    Priority queue of events keyed by the step they are due at.
+    Events are not cancelled. The receiver should check that an event is still valid when it fires.
+    """
+
+    def __init__(self):
+        self._queue = []
+        self._counter = 0  # Tie breaker. Keeps the scheduling order of events due at the same step.
+
+    def schedule(self, step: int, kind: EventKind, payload=None):
+        heapq.heappush(self._queue, (step, self._counter, kind, payload))
+        self._counter += 1
+
+    def pop_due(self, step: int):
+        """
+        Removes the events due at or before `step`.
+        :return: dict of event kind to the list of payloads
+        """
+        due = {kind: [] for kind in EventKind}
+        while self._queue and self._queue[0][0] <= step:
+            _step, _counter, kind, payload = heapq.heappop(self._queue)
+            due[kind].append(payload)
+        return due
+
+    def __len__(self):
+        return len(self._queue)
@@ -1,27 +1,43 @@
+import gc
 import json
 import math
+import os
 import random
+import sys
 import time
+import traceback
 from datetime import datetime
 from platform import system
 
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
-from pynput import keyboard
+import numpy as np
 
 from .config import Config
-from .enums import Personality, Gender, CellType, Neighborhood, State
-from .terrain import Terrain
-from .models import Cat
+from .enums import (
+    Personality, Gender, CellType, Neighborhood, State, EventKind, RandomForceMode, Interaction, LogMethod,
+    Precision
+)
+from .terrain import Terrain, SparseTerrain, SparseLayer, elevation_row, cell_type_row
+from .models import Cat, CatGroupStats
+from .scheduler import Scheduler
 from .math import Vec2
 from .utils import (
     char_to_cell_type,
     random_cell_type_list,
     max_health,
     get_sleep_probability,
-    calc_force,
+    calc_force_xy,
 )
 from .logging import Logger
+from .results import write_ndjson
+from .metrics import MetricsRecorder
+from .heatmaps import HeatmapRecorder
+from .digest import StateDigest, state_arrays
+from .live import LiveServer
+from .memory import MemoryMonitor
+from .telemetry import Telemetry, MetricsServer, ProgressReporter
+from .precision import ELEVATION_DTYPE, CELL_TYPE_DTYPE, check_elevations, round_cat_state
+from .procedural import generate_cached, sparse_uniform_cell_types
+from .args import parse_args, validate_args
 
 
 class Simulation:
@@ -41,7 +57,12 @@ class Simulation:
             hour_of_day
     """
 
-    def __init__(self, args):
+    hooks = ('on_birth', 'on_death', 'on_step_end', 'on_interaction')
+
+    def __init__(self, args, interactive=True):
+        """
+        :param interactive: listen to the keyboard for pausing the render
+        """
         self.args = args
 
         # Initialize later
@@ -52,26 +73,65 @@ class Simulation:
         self.neighborhood = None
         self.neighborhood_radius = None
         self.continuous_food = None
-        self.step = 0
+        self.max_contacts = None
+        self.aggregate_mutual_attraction = False
+        self.random_force_mode = RandomForceMode.per_neighbor
+        self.food_far_field_theta = None
+        self.precision = Precision.full
+        self.current_step = 0
         self.width = 0
         self.height = 0
         self.terrain = None
-        self.elevations = None
-        self.cell_types = None
+        self.terrain_class = Terrain
+        self.elevations = None  # Rows or a 2D array, or a SparseLayer with a sparse terrain
+        self.cell_types = None  # Rows of CellType or a 2D array of their values, or a SparseLayer with a sparse terrain
         self.current_population = None
         self.results_file_path = None
+        self.results_format = None
+        self.metrics_file_path = None
+        self.metrics = None  # MetricsRecorder, if enabled
+        self.heatmaps_file_path = None
+        self.heatmaps = None  # HeatmapRecorder, if enabled
+        self.digest_file_path = None
+        self.state_digest = None  # StateDigest, if enabled
+        self.live_server = None  # LiveServer, if enabled
+        self.branch_pids = []  # Forked branches to wait for
+        self.memory_file_path = None
+        self.memory = None  # MemoryMonitor, if enabled
+        self.stop_reason = None  # Set to stop the simulation before n_steps
 
         self._cats = []  # For internal tracking
+        self.scheduler = Scheduler()  # Wake-ups, deliveries and food refills
+        self.contact_rng = None  # Samples interaction partners in bounded contact mode
+        self.np_rng = None  # Random forces in the vectorized random force modes
 
         self.log_forces = True
+        self.show_progress = True
+        self.progress = None  # ProgressReporter, if shown
+        self.telemetry = None  # Telemetry, if served
+        self.metrics_server = None  # MetricsServer, if enabled
+        self.last_step_seconds = None  # Duration of the last step
+        self.checkpoint_time = None  # Time and step of the last saved state
+        self.checkpoint_step = None
         self.start_time = None
 
-        self.key_listener = keyboard.Listener(on_press=lambda key: self._on_key_press(key, self))
-        self.key_listener.start()
+        # Observers. Call sites only check whether a list is empty when nobody is subscribed.
+        self._on_birth = []  # callback(cat_baby, mother)
+        self._on_death = []  # callback(cat)
+        self._on_step_end = []  # callback(simulation)
+        self._on_interaction = []  # callback(cat, other_cat, interaction)
+
+        self.key_listener = None
+        if interactive and not args.headless:
+            from pynput import keyboard  # Needs a display, so only imported when listening
+
+            self.key_listener = keyboard.Listener(on_press=lambda key: self._on_key_press(key, self))
+            self.key_listener.start()
 
         self.save_file = f'states/simulation-state-{datetime.now().strftime("%Y-%m-%d_%H-%M-%S")}.json'
 
-        self.render_enabled = True
+        self.save_state_enabled = True
+        self.render_enabled = not args.headless
         self.render_pause_interval = 0.1
         self.render_pause = False
         self.plots = dict()  # render plots
@@ -87,6 +147,45 @@ class Simulation:
         if simulation.ani is not None:
             simulation.ani.event_source.start()  # Unpause
 
+    @classmethod
+    def from_config(cls, config=None, **parameters):
+        """
+        Builds a simulation to embed in other programs, without keyboard listener, rendering, state saving and step
+        printing, and sets it up.
+        :param config: Config constants to override. Note that they are process wide.
+        :param parameters: command line arguments by their destination names, e.g. n_steps=100, seed=1. Defaults are
+        taken for the rest.
+        """
+        args = parse_args([])
+        for name, value in parameters.items():
+            if not hasattr(args, name):
+                raise ValueError(f'Unknown parameter {name}.')
+            setattr(args, name, value)
+        validate_args(args)
+        if config is not None:
+            Config.override(**config)
+
+        simulation = cls(args, interactive=False)
+        simulation.render_enabled = False
+        simulation.save_state_enabled = False
+        simulation.show_progress = False
+        simulation.setup()
+        return simulation
+
+    def subscribe(self, hook, callback):
+        """
+        :param hook: one of `Simulation.hooks`
+        """
+        self._observers(hook).append(callback)
+
+    def unsubscribe(self, hook, callback):
+        self._observers(hook).remove(callback)
+
+    def _observers(self, hook):
+        if hook not in self.hooks:
+            raise ValueError(f'Unknown hook {hook}.')
+        return getattr(self, f'_{hook}')
+
     def _setup_from_file(self):
         pass
 
@@ -98,12 +197,35 @@ class Simulation:
         self.neighborhood = Neighborhood.Moore if self.args.neighborhood == 'moore' else Neighborhood.VonNeumann
         self.neighborhood_radius = self.args.neighborhood_radius
         self.continuous_food = self.args.continuous_food
+        self.max_contacts = self.args.max_contacts
+        self.aggregate_mutual_attraction = self.args.aggregate_mutual_attraction
+        self.random_force_mode = {
+            'per-neighbor': RandomForceMode.per_neighbor,
+            'exact': RandomForceMode.exact,
+            'fast': RandomForceMode.fast,
+        }[self.args.random_force_mode]
+        self.food_far_field_theta = self.args.food_far_field_theta
+        self.precision = Precision.compact if self.args.precision == 'compact' else Precision.full
         self.results_file_path = self.args.results_file_path
+        self.results_format = self.args.results_format
+        self.metrics_file_path = self.args.metrics_file_path
+        if self.metrics_file_path is not None:
+            self.metrics = MetricsRecorder()
+        self.heatmaps_file_path = self.args.heatmaps_file_path
+        self.digest_file_path = self.args.digest_file_path
+        if self.digest_file_path is not None:
+            self.state_digest = StateDigest()
+        self.memory_file_path = self.args.memory_file_path
+        if self.memory_file_path is not None or self.args.memory_budget_mb is not None or self.args.memory_trace:
+            budget = None if self.args.memory_budget_mb is None else int(self.args.memory_budget_mb * 2 ** 20)
+            self.memory = MemoryMonitor(budget, self.args.memory_trace, self.memory_file_path)
 
         self.current_population = self.population
-        self.step = 0
+        self.current_step = 0
 
         random.seed(self.seed)
+        self.contact_rng = random.Random(self._contact_seed())
+        self.np_rng = np.random.default_rng(self.seed)
 
         # Build elevations
         dimensions_set = False
@@ -157,14 +279,49 @@ class Simulation:
             self.height = self.args.t_height
             self.width = self.args.t_width
 
+        if self.args.t_generator == 'noise' and (self.elevations is None or self.cell_types is None):
+            elevations, cell_types = generate_cached(
+                self.width, self.height, self.seed, max_elevation=self.args.t_max_elevation,
+                feature_scale=self.args.t_feature_scale, cache_dir=self.args.t_cache_dir or None)
+            # The arrays are passed through, a dense terrain reads them row by row and a sparse one keeps only
+            # their non default entries
+            if self.elevations is None:
+                self.elevations = elevations
+            if self.cell_types is None:
+                self.cell_types = cell_types
+
+        if self.args.t_sparse:
+            self.terrain_class = SparseTerrain
+            if self.elevations is None:
+                self.elevations = SparseLayer(self.width, self.height, [], [], default=0)
+            else:
+                self.elevations = SparseLayer.from_dense(self.elevations, default=0)
+            if self.cell_types is None:
+                flat, values = sparse_uniform_cell_types(self.width, self.height, self.seed)
+                self.cell_types = SparseLayer(self.width, self.height, flat, values, default=CellType.floor.value)
+            elif isinstance(self.cell_types, np.ndarray):
+                self.cell_types = SparseLayer.from_dense(self.cell_types, default=CellType.floor.value)
+            else:
+                self.cell_types = SparseLayer.from_dense(
+                    [[cell_type.value for cell_type in row] for row in self.cell_types], default=CellType.floor.value)
+
         if self.elevations is None:
             self.elevations = [[0 for _1 in range(self.width)] for _2 in range(self.height)]
         if self.cell_types is None:
             self.cell_types = [random_cell_type_list(self.width) for _ in range(self.height)]
 
+        if self.precision == Precision.compact:
+            # Sparse terrains only, see validate_args
+            check_elevations(self.elevations.values)
+            self.elevations = self.elevations.astype(ELEVATION_DTYPE)
+            self.cell_types = self.cell_types.astype(CELL_TYPE_DTYPE)
+
+        if self.heatmaps_file_path is not None:
+            self.heatmaps = HeatmapRecorder(self.width, self.height, sparse=self.args.t_sparse)
+
         # Build terrain
-        self.terrain = Terrain(width=self.width, height=self.height, elevations=self.elevations,
-                               cell_types=self.cell_types)
+        self.terrain = self.terrain_class(width=self.width, height=self.height, elevations=self.elevations,
+                                          cell_types=self.cell_types, precision=self.precision)
 
         # Put cats on the terrain
         for i in range(self.population):
@@ -185,6 +342,8 @@ class Simulation:
             self.terrain.put_cat(cat=cat)
             self._cats.append(cat)
 
+        self._schedule_refill(self.current_step)
+
     def _setup(self):
         Logger.log('Setting up simulation')
         t = time.time()
@@ -193,19 +352,47 @@ class Simulation:
             self._setup_from_file()
         else:
             self._setup_from_parameters()
-        self._render_init()
+        if self.render_enabled:
+            self._check_dense_view('Rendering', 'run with --headless')
+        if self.args.live_port is not None:
+            self._check_dense_view('Live streaming', 'run without --live_port')
+        if self.memory is not None:
+            self.memory.start(self)
+        if self.show_progress and Logger.method != LogMethod.console:  # Console logs would break the line
+            self.progress = ProgressReporter(self.n_steps)
+            self.progress.attach(self)
+        if self.args.metrics_port is not None:
+            self.telemetry = Telemetry()
+            self.telemetry.attach(self)
+            self.metrics_server = MetricsServer(self.telemetry, self.args.metrics_port)
+            self.metrics_server.start()
+            Logger.log('Serving metrics at http://{}:{}/metrics'.format(*self.metrics_server.address))
+        if self.args.live_port is not None:
+            self.live_server = LiveServer(self.args.live_port)
+            self.live_server.start()
+            self.live_server.publish(self)
         Logger.log(f'Elapsed {time.time() - t} s')
 
+    def _check_dense_view(self, purpose, remedy):
+        """
+        :raise ValueError: if `purpose` needs every cell of a sparse terrain larger than
+        `SparseTerrain.max_dense_cells`
+        """
+        area = self.width * self.height
+        if isinstance(self.terrain, SparseTerrain) and area > SparseTerrain.max_dense_cells:
+            raise ValueError(f'{purpose} needs every cell of the terrain, so it is limited to '
+                             f'{SparseTerrain.max_dense_cells} cells with --t_sparse. The map has {area}, {remedy}.')
+
     def temperature(self):
         return 25 - 5 * math.cos(math.pi * self.hour_of_day / 12)
 
     def annot(self):
         s = ''
-        s += f'Step: {self.step}/{self.n_steps}\n'
+        s += f'Step: {self.current_step}/{self.n_steps}\n'
         s += f'Population: {self.current_population}'
         return s
 
-    def serialize(self):
+    def serialize_metadata(self):
         return dict(
             seed=self.seed,
             n_steps=self.n_steps,
@@ -214,23 +401,58 @@ class Simulation:
             neighborhood=str(self.neighborhood),
             neighborhood_radius=self.neighborhood_radius,
             continuous_food=self.continuous_food,
-            step=self.step,
+            step=self.current_step,
             width=self.width,
             height=self.height,
             current_population=self.current_population,
             cat_next_id=Cat.next_id(),
-            elevations=self.elevations,
-            cell_types=[[str(ct) for ct in row] for row in self.cell_types],
+        )
+
+    def serialize(self):
+        if isinstance(self.cell_types, SparseLayer):
+            elevations = self.elevations.serialize()
+            cell_types = self.cell_types.serialize(lambda value: str(CellType(value)))
+        else:
+            elevations = [elevation_row(self.elevations, y) for y in range(self.height)]
+            cell_types = [[str(ct) for ct in cell_type_row(self.cell_types, y)] for y in range(self.height)]
+        return dict(
+            **self.serialize_metadata(),
+            elevations=elevations,
+            cell_types=cell_types,
             terrain=self.terrain.serialize(),
             cats=[cat.serialize() for cat in self._cats],
         )
 
+    def iter_cats(self):
+        """
+        Every cat ever born, without building a copy of the list.
+        """
+        return iter(self._cats)
+
     def save_state(self):
+        os.makedirs(os.path.dirname(self.save_file) or '.', exist_ok=True)
         data = self.serialize()
         with open(self.save_file, 'w') as sf:
             json.dump(data, sf, indent=2)
-
-    def _pre_update(self, cat, next_cats: list):
+        self.checkpoint_time = time.time()
+        self.checkpoint_step = self.current_step
+
+    def _schedule_refill(self, step):
+        """
+        Schedules the next food refill at or after `step`. Continuous food is refilled every step, otherwise at the
+        12th hour of the day.
+        """
+        if self.continuous_food:
+            self.scheduler.schedule(step, EventKind.refill_food)
+        else:
+            hour_of_day = (self.hour_of_day + step - self.current_step) % 24
+            self.scheduler.schedule(step + (12 - hour_of_day) % 24, EventKind.refill_food)
+
+    def _pre_update(self, cat, next_cats: list, wake_ups=None, deliveries=None):
+        """
+        :param wake_ups: ids of the cats with a wake-up due this step. If None, every cat is checked.
+        :param deliveries: ids of the cats with a delivery due this step. If None, every cat is checked.
+        """
         cat.start_step()
         # -- Do actions --
         # Sleep if necessary
@@ -238,15 +460,22 @@ class Simulation:
             sleep_probability = get_sleep_probability(self.terrain.cell_at(cat.position).cell_type, cat.health)
             if random.uniform(0, 1) < sleep_probability:
                 cat.sleep()
+                self.scheduler.schedule(self.current_step + Config.sleep_time, EventKind.wake_up, cat)
 
         # Force wake up if health is low
         if cat.is_sleeping() and cat.health < Config.force_wake_up_health:
-            Logger.log(f'[Alert] {cat} is forced to wake-up!')
+            if Logger.is_enabled():
+                Logger.log(f'[Alert] {cat} is forced to wake-up!')
             cat.wake_up()
 
         # Wake up if sleep duration is exceeded
-        if cat.sleep_duration >= Config.sleep_time:
-            cat.wake_up()
+        if wake_ups is None or cat.cat_id in wake_ups:
+            if cat.sleep_duration >= Config.sleep_time:
+                cat.wake_up()
+            elif wake_ups is not None and cat.is_sleeping():
+                # Scheduled with a shorter sleep_time, e.g. before a fork changed it
+                self.scheduler.schedule(self.current_step + Config.sleep_time - cat.sleep_duration,
+                                        EventKind.wake_up, cat)
 
         cell = self.terrain.cell_at(cat.position)
 
@@ -254,148 +483,341 @@ class Simulation:
         if cell.cell_type == CellType.food and not cat.is_sleeping():
             consume_ammount = min(cell.food_amount, 10, cat.max_health() - cat.health)
             if consume_ammount > 0:
-                cell.get_consumed(consume_ammount)
+                self.terrain.consume_food(cell, consume_ammount)
                 cat.consume_food(consume_ammount)
 
         # Deliver off-spring
-        if cat.is_pregnant() and cat.hours_since_last_conception >= Config.hours_to_deliver_offspring:
-            cat_baby = cat.deliver()
-            next_cats.append(cat_baby)
-            self._cats.append(cat_baby)
+        if (deliveries is None or cat.cat_id in deliveries) and cat.is_pregnant():
+            if cat.hours_since_last_conception >= Config.hours_to_deliver_offspring:
+                self._deliver(cat, next_cats)
+            elif deliveries is not None:
+                # Scheduled with a shorter hours_to_deliver_offspring, e.g. before a fork changed it
+                self.scheduler.schedule(
+                    self.current_step + Config.hours_to_deliver_offspring - cat.hours_since_last_conception,
+                    EventKind.deliver, cat)
+
+    def _deliver(self, cat, next_cats):
+        cat_baby = cat.deliver()
+        next_cats.append(cat_baby)
+        self._cats.append(cat_baby)
+        if self.metrics is not None:
+            self.metrics.record_birth()
+            self.metrics.observe_cat(cat_baby)
+        if self.heatmaps is not None:
+            self.heatmaps.record_birth(cat_baby)
+        if self._on_birth:
+            for callback in self._on_birth:
+                callback(cat_baby, cat)
+
+    def _update_food_masses(self):
+        """
+        Sets the masses of the food quadtree to the food amounts after this step's refill and consumption. Food does
+        not carry over between steps, so only the consumed cells differ from the built or refilled terrain.
+        """
+        terrain = self.terrain
+        index = terrain.index
+        if terrain.food_refilled:
+            amount = terrain.food_refill_amount
+            key, reference_masses = ('refilled', amount), lambda: [amount] * index.count(CellType.food)
+        else:
+            key, reference_masses = 'built', terrain.built_food_amounts
+        changed = sorted(set(terrain.food_changes))
+        points = np.searchsorted(index.flat[CellType.food], changed)
+        width = terrain.width
+        masses = [terrain.at(i % width, i // width).food_amount for i in changed]
+        index.quadtree(CellType.food).update_masses(key, reference_masses, points, masses)
+
+    def _contacts(self, cat, cell_cats):
+        """
+        Cats that `cat` interacts with in its cell and the factor to scale interaction probabilities with.
+        In bounded contact mode, at most `max_contacts` partners are sampled uniformly and each stands in for
+        (number of other cats / number of partners) cats, so that the expected number of attacks and the probability of
+        reproducing stay the same, see `Cat.interactions`.
+        """
+        n_others = len(cell_cats) - 1
+        if self.max_contacts is None or n_others <= self.max_contacts:
+            return cell_cats, 1
+        # Sample one extra index in case `cat` itself is picked. Cost is independent of the number of cats in the cell.
+        picks = self.contact_rng.sample(range(len(cell_cats)), self.max_contacts + 1)
+        partners = [cell_cats[i] for i in picks if cell_cats[i].cat_id != cat.cat_id][:self.max_contacts]
+        return partners, n_others / self.max_contacts
+
+    def _spread_attacks(self, cat, cell_cats, n):
+        """
+        Lands the extra attacks of a sampled partner that stands in for several cats (bounded contact mode) on
+        partners sampled independently and uniformly from the cell, instead of all on the one partner. Draws at most
+        8 * n partners, so that the cost does not depend on the number of cats in the cell.
+        :return: the attacked cats, once per attack
+        """
+        def candidates():
+            for _ in range(8 * n):
+                other_cat = cell_cats[self.contact_rng.randrange(len(cell_cats))]
+                if other_cat.cat_id != cat.cat_id:
+                    yield other_cat
+
+        return cat.attack_any(candidates(), n)
+
+    def _random_forces(self, cats):
+        """
+        Pre-generates the total random force of each cat for this step, in the vectorized random force modes.
+        A cat gets one uniform force in [-1, 1)^2 per neighbor cell, sleeping cats get none.
+        :return: list of (x, y) per cat, or None per cat in per neighbor mode
+        """
+        if self.random_force_mode == RandomForceMode.per_neighbor:
+            return [None] * len(cats)
+        counts = self.terrain.neighbor_counts([cat.position.x for cat in cats], [cat.position.y for cat in cats],
+                                              self.neighborhood_radius, self.neighborhood)
+        counts[[cat.is_sleeping() for cat in cats]] = 0
+        if self.random_force_mode == RandomForceMode.exact:
+            samples = self.np_rng.uniform(-1, 1, size=(int(counts.sum()), 2))
+            forces = np.zeros((len(cats), 2))
+            np.add.at(forces, np.repeat(np.arange(len(cats)), counts), samples)
+        else:
+            # Sum of n uniforms on [-1, 1] has mean 0 and variance n / 3
+            limits = counts[:, None]
+            forces = np.clip(self.np_rng.normal(0, 1, size=(len(cats), 2)) * np.sqrt(limits / 3), -limits, limits)
+        return forces.tolist()
+
+    def _update(self, cat, random_force=None):
+        """
+        :param random_force: pre-generated total random force (x, y). If None, a random force is drawn per neighbor.
+        """
+        if cat.is_sleeping():
+            # A sleeping cat neither interacts nor feels any force
+            return
 
-    def _update(self, cat):
         cell = self.terrain.cell_at(cat.position)
 
         # Interact
-        for other_cat in cell.cats:
+        partners, probability_scale = self._contacts(cat, cell.cats)
+        conceived = False
+        on_interaction = self._on_interaction
+        for other_cat in partners:
             if cat.cat_id == other_cat.cat_id:
                 continue
-            cat.interact(other_cat, self.temperature())
+            interaction, count = cat.interactions(other_cat, self.temperature(), probability_scale)
+            if count == 0:
+                continue
+            others = [other_cat]
+            if count > 1:
+                others += self._spread_attacks(cat, cell.cats, count - 1)
+            for other in others:
+                if on_interaction:
+                    for callback in on_interaction:
+                        callback(cat, other, interaction)
+                if interaction == Interaction.reproduction:
+                    conceived = True
+                elif interaction == Interaction.attack:
+                    if self.metrics is not None:
+                        self.metrics.record_attack()
+                    if self.heatmaps is not None:
+                        self.heatmaps.record_attack(cat)
+        if conceived and cell.cat_stats is not None:
+            # Pregnant cats are not sexually active
+            cell.cat_stats = CatGroupStats(cell.cats)
 
         # -- Calculate forces --
-        force = Vec2(0, 0)
+        # Forces are accumulated as scalars to avoid allocating a vector per contribution. Vectors are only built for
+        # logging.
+        log_forces = self.log_forces and Logger.is_enabled()
+        px, py = cat.position.x, cat.position.y
+        fx, fy = 0, 0
         food_radius = self.neighborhood_radius
         if cat.health < 10:
             food_radius = 3 * self.neighborhood_radius
         elif cat.health < 25:
             food_radius = 1.5 * self.neighborhood_radius
-        neighbors = self.terrain.neighbors(center=cat.position, r=food_radius,
-                                           neighborhood=self.neighborhood)
-        for other_cell in neighbors:
-            # Food attraction
-            if other_cell.cell_type == CellType.food:
+        if self.food_far_field_theta is not None:
+            # Food attraction, far field approximated
+            food_field_x, food_field_y = self.terrain.index.quadtree(CellType.food).field(
+                px, py, food_radius, self.neighborhood, self.food_far_field_theta)
+            food_attraction = cat.food_attraction() / 100
+            dfx, dfy = food_field_x * food_attraction, food_field_y * food_attraction
+            fx += dfx
+            fy += dfy
+            if log_forces:
+                Logger.log(f'[Force][Food] A force {Vec2(dfx, dfy)} is exerted on {cat}')
+        else:
+            food_cells = self.terrain.features_within(CellType.food, center=cat.position, r=food_radius,
+                                                      neighborhood=self.neighborhood)
+            for other_cell in food_cells:
+                # Food attraction
                 food_attraction = (other_cell.food_amount / 100) * cat.food_attraction()
-                food_force = calc_force(food_attraction, cat.position, other_cell.position)
-                force += food_force
-                if self.log_forces:
-                    Logger.log(f'[Force][Food] A force {food_force} is exerted on {cat}')
+                dfx, dfy = calc_force_xy(food_attraction, px, py, other_cell.position.x, other_cell.position.y)
+                fx += dfx
+                fy += dfy
+                if log_forces:
+                    Logger.log(f'[Force][Food] A force {Vec2(dfx, dfy)} is exerted on {cat}')
 
         neighbors = self.terrain.neighbors(center=cat.position, r=self.neighborhood_radius,
                                            neighborhood=self.neighborhood)
         for other_cell in neighbors:
+            ox, oy = other_cell.position.x, other_cell.position.y
             # Bed attraction
             if other_cell.cell_type == CellType.bed:
                 bed_attraction = cat.bed_attraction()
-                bed_force = calc_force(bed_attraction, cat.position, other_cell.position)
-                force += bed_force
-                if self.log_forces:
-                    Logger.log(f'[Force][Bed] A force {bed_force} is exerted on {cat}')
+                dfx, dfy = calc_force_xy(bed_attraction, px, py, ox, oy)
+                fx += dfx
+                fy += dfy
+                if log_forces:
+                    Logger.log(f'[Force][Bed] A force {Vec2(dfx, dfy)} is exerted on {cat}')
 
             # Box attraction
             if other_cell.cell_type == CellType.box:
                 box_attraction = cat.box_attraction()
-                box_force = calc_force(box_attraction, cat.position, other_cell.position)
-                force += box_force
-                if self.log_forces:
-                    Logger.log(f'[Force][Box] A force {box_force} is exerted on {cat}')
+                dfx, dfy = calc_force_xy(box_attraction, px, py, ox, oy)
+                fx += dfx
+                fy += dfy
+                if log_forces:
+                    Logger.log(f'[Force][Box] A force {Vec2(dfx, dfy)} is exerted on {cat}')
 
             # Mutual attraction
-            for other_cat in other_cell.cats:
-                if other_cat.cat_id == cat.cat_id:
-                    continue
-                mutual_attraction = cat.mutual_attraction(other_cat, self.temperature())
-                mututal_force = calc_force(mutual_attraction, cat.position, other_cell.position)
-                force += mututal_force
-                if self.log_forces:
-                    Logger.log(f'[Force][Mutual] A force {mututal_force} is exerted on {cat} by {other_cat}')
+            if self.aggregate_mutual_attraction:
+                # All cats of a cell pull in the same direction. Nothing to add for the own cell (zero direction).
+                if other_cell.cat_stats is not None and (ox != px or oy != py):
+                    mutual_attraction = cat.mutual_attraction_total(other_cell.cat_stats, self.temperature())
+                    dfx, dfy = calc_force_xy(mutual_attraction, px, py, ox, oy)
+                    fx += dfx
+                    fy += dfy
+                    if log_forces:
+                        Logger.log(f'[Force][Mutual] A force {Vec2(dfx, dfy)} is exerted on {cat} by '
+                                   f'{len(other_cell.cat_stats)} cats at {other_cell.position}')
+            else:
+                for other_cat in other_cell.cats:
+                    if other_cat.cat_id == cat.cat_id:
+                        continue
+                    mutual_attraction = cat.mutual_attraction(other_cat, self.temperature())
+                    dfx, dfy = calc_force_xy(mutual_attraction, px, py, ox, oy)
+                    fx += dfx
+                    fy += dfy
+                    if log_forces:
+                        Logger.log(f'[Force][Mutual] A force {Vec2(dfx, dfy)} is exerted on {cat} by {other_cat}')
 
             # Trace attraction
             if other_cell.x_trace > 0 or other_cell.y_trace > 0:
                 trace_attraction = cat.trace_attraction(other_cell.x_trace, other_cell.y_trace)
-                trace_force = calc_force(trace_attraction, cat.position, other_cell.position)
-                force += trace_force
-                if self.log_forces:
+                dfx, dfy = calc_force_xy(trace_attraction, px, py, ox, oy)
+                fx += dfx
+                fy += dfy
+                if log_forces:
                     Logger.log(
-                        f'[Force][Trace] A force {trace_force} is exerted on {cat} by cell at {other_cell.position} '
-                        f'x_trace={other_cell.x_trace} y_trace={other_cell.y_trace}')
+                        f'[Force][Trace] A force {Vec2(dfx, dfy)} is exerted on {cat} by cell at '
+                        f'{other_cell.position} x_trace={other_cell.x_trace} y_trace={other_cell.y_trace}')
 
             # Randomness
-            random_force = cat.random_force()
-            force += random_force
-            if self.log_forces:
-                Logger.log(f'[Force][Random] A force {random_force} is exerted on {cat} randomly')
-
-        cat.add_force(force)
-        if self.log_forces:
+            if random_force is None:
+                dfx, dfy = cat.random_force_xy()
+                fx += dfx
+                fy += dfy
+                if log_forces:
+                    Logger.log(f'[Force][Random] A force {Vec2(dfx, dfy)} is exerted on {cat} randomly')
+
+        if random_force is not None:
+            fx += random_force[0]
+            fy += random_force[1]
+            if log_forces:
+                Logger.log(f'[Force][Random] A force {Vec2(*random_force)} is exerted on {cat} randomly')
+
+        cat.add_force_xy(fx, fy)
+        if log_forces:
             Logger.log(f'[Force] Total force of {cat.get_force()} is exerted on {cat}')
 
-    def _post_update(self, cat, next_cats):
+    def _post_update(self, cat, next_cats, target_position=None):
         # Calculate movement with calculated force and elevation
-        Logger.log(f'From position {cat.position} Target position {cat.position + cat.get_force()}')
-        target_position = self.terrain.clamp(cat.position, cat.position + cat.get_force())
-        Logger.log(f'Target position {target_position}')
+        if target_position is None:
+            px, py = cat.position.x, cat.position.y
+            fx, fy = cat.get_force().xy()
+            if Logger.is_enabled():
+                Logger.log(f'From position {cat.position} Target position {Vec2(px + fx, py + fy)}')
+            target_position = Vec2(*self.terrain.clamp_xy(px, py, px + fx, py + fy))
+        if Logger.is_enabled():
+            Logger.log(f'Target position {target_position}')
         if cat.position != target_position:
             health_damage = self.terrain.health_damange_to_travel(cat.position, target_position)
             cat.move(target_position, health_damage)
 
+        # Conceived in this step
+        if cat.is_pregnant() and cat.hours_since_last_conception == 0:
+            self.scheduler.schedule(self.current_step + Config.hours_to_deliver_offspring, EventKind.deliver, cat)
+
         cat.finalize_step()
 
         if not cat.should_die():
             next_cats.append(cat)
+            if self.metrics is not None:
+                self.metrics.observe_cat(cat)
         else:
             cat.die()
+            if self.metrics is not None:
+                self.metrics.record_death()
+            if self._on_death:
+                for callback in self._on_death:
+                    callback(cat)
 
     def update(self):
-        step = self.step + 1
-        Logger.sep()
-        Logger.log(f'Starting step: {step}')
-        Logger.log(f'Day: {step // 24} Hour: {step % 24}')
-        Logger.log(f'Hour of day: {self.hour_of_day + 1}')
+        step = self.current_step + 1
+        if Logger.is_enabled():
+            Logger.sep()
+            Logger.log(f'Starting step: {step}')
+            Logger.log(f'Day: {step // 24} Hour: {step % 24}')
+            Logger.log(f'Hour of day: {self.hour_of_day + 1}')
         t = time.time()
-        print(f'Step {step}')
+        memory = self.memory
+        if memory is not None:
+            memory.begin_step()
 
         # Next states
-        next_terrain = Terrain(width=self.width, height=self.height, elevations=self.elevations,
-                               cell_types=self.cell_types, previous_terrain=self.terrain)
         next_cats = []
 
-        # Refill food
-        for y in range(self.height):
-            for x in range(self.width):
-                cell = self.terrain.at(x, y)
-                if cell.cell_type == CellType.food:
-                    if self.continuous_food:
-                        cell.food_amount = Config.continuous_food_amount
-                    elif self.hour_of_day == 12:
-                        cell.food_amount = Config.new_food_amount
-
-        for y in range(self.height):
-            for x in range(self.width):
-                for cat in self.terrain.cats_at(Vec2(x, y)):
-                    self._pre_update(cat, next_cats)
-
-        for y in range(self.height):
-            for x in range(self.width):
-                for cat in self.terrain.cats_at(Vec2(x, y)):
-                    self._update(cat)
-
-        for y in range(self.height):
-            for x in range(self.width):
-                for cat in self.terrain.cats_at(Vec2(x, y)):
-                    self._post_update(cat, next_cats)
+        due = self.scheduler.pop_due(self.current_step)
 
-        for cat in self._cats:
-            cat.update_state_hours()
+        # Refill food
+        if due[EventKind.refill_food]:
+            self.terrain.refill_food(Config.continuous_food_amount if self.continuous_food else Config.new_food_amount)
+            self._schedule_refill(self.current_step + 1)
+
+        # Only occupied cells are visited, in grid order
+        cats = self.terrain.cats()
+
+        wake_ups = {cat.cat_id for cat in due[EventKind.wake_up]}
+        deliveries = {cat.cat_id for cat in due[EventKind.deliver]}
+        for cat in cats:
+            self._pre_update(cat, next_cats, wake_ups, deliveries)
+        if memory is not None:
+            memory.mark('pre_update')
+
+        if self.aggregate_mutual_attraction:
+            for cell in self.terrain.occupied_cells():
+                cell.cat_stats = CatGroupStats(cell.cats)
+
+        if self.food_far_field_theta is not None:
+            self._update_food_masses()
+
+        random_forces = self._random_forces(cats)
+        for cat, random_force in zip(cats, random_forces):
+            self._update(cat, random_force)
+        if memory is not None:
+            memory.mark('update')
+
+        # Clamp the targets of all cats in one batch
+        origins = [(cat.position.x, cat.position.y) for cat in cats]
+        targets = [(cat.position.x + cat.get_force().x, cat.position.y + cat.get_force().y) for cat in cats]
+        target_positions = self.terrain.clamp_many(origins, targets).tolist()
+        for cat, (tx, ty) in zip(cats, target_positions):
+            self._post_update(cat, next_cats, Vec2(tx, ty))
+        if memory is not None:
+            memory.mark('post_update')
+
+        Cat.update_state_hours_many(self._cats)
+        Cat.summary_store.flush()
+        if self.precision == Precision.compact:
+            round_cat_state(next_cats)
+
+        # The next terrain takes the cells over, so it is built once the current one is no longer read
+        next_terrain = self.terrain_class(width=self.width, height=self.height, elevations=self.elevations,
+                                          cell_types=self.cell_types, previous_terrain=self.terrain)
+        if memory is not None:
+            memory.mark('next_terrain')
 
         # Put new cats to the next terrain
         for next_cat in next_cats:
@@ -403,7 +825,14 @@ class Simulation:
         self.current_population = len(next_cats)
 
         # Replace
-        self.terrain = next_terrain
+        previous_terrain, self.terrain = self.terrain, next_terrain
+        if memory is not None:
+            memory.mark('next_cats')
+
+        if self.metrics is not None:
+            self.metrics.end_step(step, self.hour_of_day, self.terrain)
+        if self.heatmaps is not None:
+            self.heatmaps.end_step(next_cats)
 
         # print('------------------')
         # print(self.terrain.console_render())
@@ -412,13 +841,34 @@ class Simulation:
         #         print(cell_type_to_char(cell.cell_type), end=' ')
         #     print()
 
-        Logger.log(f'Finished step: {self.step}')
-        Logger.log(f'Elapsed {time.time() - t} s')
+        if Logger.is_enabled():
+            Logger.log(f'Finished step: {self.current_step}')
+            Logger.log(f'Elapsed {time.time() - t} s')
 
-        self.step += 1
+        self.current_step += 1
         self.hour_of_day = (self.hour_of_day + 1) % 24
 
-        self.save_state()
+        if self.state_digest is not None:
+            self.state_digest.update(self.current_step, state_arrays(self))
+
+        if self.live_server is not None:
+            self.live_server.publish(self, previous_terrain.food_changes, previous_terrain.food_refilled)
+
+        if self.save_state_enabled:
+            self.save_state()
+
+        if memory is not None:
+            memory.mark('outputs')
+            if memory.end_step(self.current_step, self):
+                # Checkpoint before stopping, unless the state was just saved
+                if not self.save_state_enabled:
+                    self.save_state()
+                self.stop_reason = 'memory budget'
+
+        self.last_step_seconds = time.time() - t
+        if self._on_step_end:
+            for callback in self._on_step_end:
+                callback(self)
 
     def _render_init(self):
         if not self.render_enabled:
@@ -433,7 +883,7 @@ class Simulation:
 
         title_text = 'Cat Simulation'
         bottom_text = 'Press P to pause'
-        if self.step == self.n_steps:
+        if self.current_step == self.n_steps:
             title_text += ' (Completed)'
         if self.render_pause:
             title_text += ' (Paused)'
@@ -448,16 +898,161 @@ class Simulation:
         self.terrain.render(self.plots, self.axs, self.fig)
         return self.plots.values()
 
-    def _loop(self):
+    def setup(self):
         self._setup()
+
+    def step(self):
+        """
+        Advances the simulation by one step, even past `n_steps`.
+        """
+        self.update()
+
+    def run(self, n=None):
+        """
+        Advances the simulation by `n` steps, or until it is finished if `n` is None.
+        :return: number of steps taken
+        """
+        taken = 0
+        while (taken < n) if n is not None else not self.is_finished():
+            self.update()
+            taken += 1
+        return taken
+
+    def finalize(self):
+        """
+        Writes the results and the enabled outputs, and stops the live server.
+        """
+        self._finalize()
+
+    def _contact_seed(self):
+        """
+        Seed of the contact sampler, derived from the seed so that its stream differs from the random module's.
+        """
+        if self.seed is None:
+            return None
+        return int(np.random.SeedSequence(self.seed, spawn_key=(1,)).generate_state(1)[0])
+
+    def _branch_seed(self, branch):
+        return int(np.random.SeedSequence([self.seed or 0, self.current_step, branch]).generate_state(1)[0])
+
+    def fork(self, configs, wait=True):
+        """
+        Runs one branch per entry of `configs` to the end in a child process, from the current state. Children share
+        the memory of this process copy-on-write, so nothing is serialized. Each branch gets its own random streams
+        seeded from (seed, step, branch number) and writes its outputs to the paths of this simulation with -branch<k>
+        inserted. This simulation is not changed.
+        :param configs: Config overrides of each branch, e.g. [dict(new_food_amount=10), dict(new_food_amount=50)]
+        :param wait: wait for the branches to finish. If False, they are waited for when this simulation finishes.
+        :return: exit codes of the branches if `wait`, otherwise their pids
+        """
+        if not hasattr(os, 'fork'):
+            raise RuntimeError('Forking is not supported on this platform.')
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # Keep the garbage collector from touching (and thereby copying) the shared objects in the children
+        gc.freeze()
+        pids = []
+        try:
+            for branch, config in enumerate(configs):
+                pid = os.fork()
+                if pid == 0:
+                    self._run_branch(branch, config)
+                pids.append(pid)
+        finally:
+            gc.unfreeze()
+        if not wait:
+            self.branch_pids.extend(pids)
+            return pids
+        return [self._wait_branch(pid) for pid in pids]
+
+    @staticmethod
+    def _wait_branch(pid):
+        """
+        :return: exit code of the branch, or the negative signal number if it was killed
+        """
+        status = os.waitpid(pid, 0)[1]
+        return os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+
+    def _run_branch(self, branch, config):
+        """
+        Body of a forked child. Never returns.
+        """
+        status = 0
+        try:
+            Config.override(**config)
+            self.seed = self._branch_seed(branch)
+            random.seed(self.seed)
+            self.contact_rng = random.Random(self._contact_seed())
+            self.np_rng = np.random.default_rng(self.seed)
+
+            def branch_path(path):
+                root, ext = os.path.splitext(path)
+                return f'{root}-branch{branch}{ext}'
+
+            self.results_file_path = branch_path(self.results_file_path)
+            if self.metrics_file_path is not None:
+                self.metrics_file_path = branch_path(self.metrics_file_path)
+            if self.heatmaps_file_path is not None:
+                self.heatmaps_file_path = branch_path(self.heatmaps_file_path)
+            if self.digest_file_path is not None:
+                self.digest_file_path = branch_path(self.digest_file_path)
+            if self.memory_file_path is not None:
+                self.memory_file_path = branch_path(self.memory_file_path)
+            self.save_file = branch_path(self.save_file)
+            if self.memory is not None:
+                # Records and budget state of the parent do not belong to the branch
+                self.memory = MemoryMonitor(self.memory.budget, self.memory.trace_allocations, self.memory_file_path)
+                self.memory.start(self)
+            self.live_server = None  # Its thread is not forked
+            if self.progress is not None:
+                self.progress.detach(self)
+                self.progress = None
+            if self.telemetry is not None:
+                self.telemetry.detach(self)
+                self.telemetry = None
+                self.metrics_server = None
+            self.key_listener = None
+            self.render_enabled = False
+            self.branch_pids = []
+            self._recheck_cat_events()
+            while not self.is_finished():
+                self.update()
+            self._finalize()
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+
+    def _recheck_cat_events(self):
+        """
+        Wake-ups and deliveries were scheduled with the Config of the parent. Checks every sleeping and pregnant cat
+        at the next step, so that the ones due earlier under the current Config act then and the others are
+        rescheduled by `_pre_update`.
+        """
+        for cat in self.terrain.cats():
+            if cat.is_sleeping():
+                self.scheduler.schedule(self.current_step, EventKind.wake_up, cat)
+            if cat.is_pregnant():
+                self.scheduler.schedule(self.current_step, EventKind.deliver, cat)
+
+    def _loop(self, setup=True):
+        if setup:
+            self._setup()
         while not self.is_finished():
             self.update()
-            yield self.step,
+            if self.current_step == self.args.fork_step:
+                self.fork(self.args.fork_configs, wait=False)
+            yield self.current_step,
         self._finalize()
 
     @staticmethod
     def _show_window():
         # Show maximized window
+        import matplotlib.pyplot as plt
+
         backend = plt.get_backend()
         cfm = plt.get_current_fig_manager()
         if backend == "wxAgg":
@@ -479,12 +1074,18 @@ class Simulation:
 
     def start(self):
         if self.render_enabled:
+            # Imported only when rendering, so that headless runs do not need a display or backend
+            import matplotlib.animation as animation
+            import matplotlib.pyplot as plt
+
+            self._setup()  # Before the window opens, so that setup errors are raised here
             plt.rcParams['font.family'] = 'monospace'
             self.fig, self.axs = plt.subplots(1, 3)
+            self._render_init()
             self.ani = animation.FuncAnimation(
                 plt.gcf(),
                 self._render,
-                self._loop,
+                lambda: self._loop(setup=False),
                 save_count=1,
                 init_func=lambda: None,
                 interval=self.render_pause_interval * 1000,
@@ -496,18 +1097,17 @@ class Simulation:
                 continue
 
     def is_finished(self):
-        return self.step >= self.n_steps or self.population <= 0
+        return self.current_step >= self.n_steps or self.population <= 0 or self.stop_reason is not None
 
     def _finalize(self):
+        if self.progress is not None:
+            self.progress.finish()
         Logger.sep()
         Logger.log('Simulation is finishing')
 
         if not self.continuous_food:
-            for y in range(self.height):
-                for x in range(self.width):
-                    cell = self.terrain.at(x, y)
-                    if cell.cell_type == CellType.food:
-                        Logger.log(f'Cell at {cell.position} has {cell.food_amount} food remaining')
+            for cell in self.terrain.cells_of_type(CellType.food):
+                Logger.log(f'Cell at {cell.position} has {cell.food_amount} food remaining')
 
         self._cats.sort(key=lambda c: c.cat_id)
         alive = sum([cat.is_alive() for cat in self._cats])
@@ -520,9 +1120,38 @@ class Simulation:
             # Logger.log(f'This cat spent time doing {state_hours}')
             # Logger.log(f'This cat moved total distance of {cat.total_distance_moved:.2f} units')
 
-        with open(self.results_file_path, 'w') as rf:
-            data = self.serialize()
-            json.dump(data, rf, indent=4)
+        if self.results_format == 'ndjson':
+            write_ndjson(self, self.results_file_path)
+        else:
+            with open(self.results_file_path, 'w') as rf:
+                data = self.serialize()
+                json.dump(data, rf, indent=4)
+
+        if self.metrics is not None:
+            self.metrics.save(self.metrics_file_path)
+
+        if self.heatmaps is not None:
+            self.heatmaps.save(self.heatmaps_file_path)
+
+        if self.state_digest is not None:
+            with open(self.digest_file_path, 'w') as df:
+                for record in self.state_digest.records:
+                    df.write(json.dumps(record) + '\n')
+
+        if self.live_server is not None:
+            self.live_server.stop()
+
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+
+        if self.memory is not None:
+            self.memory.stop()
+            if self.memory.exceeded:
+                print(f'Stopped at step {self.current_step}. {self.memory.summary()}. State saved to {self.save_file}')
+
+        for pid in self.branch_pids:
+            self._wait_branch(pid)
+        self.branch_pids = []
 
         Logger.log('Simulation is finished')
         Logger.log(f'Elapsed {time.time() - self.start_time} s')
@@ -0,0 +1,261 @@
+"""
+Distributed seed sweeps. A coordinator hands out jobs (simulation parameters, Config overrides and a seed) to workers
+over TCP and collects their results.
+
+Messages are JSON objects, each prefixed with its length (LENGTH). A worker sends `ready` and gets a `job`, `wait` or
+`done`. After running a job it sends `result` (or `error`) and gets its next message in reply.
+Jobs of a worker whose connection drops, or that does not report back within the lease time, are handed out again.
+Only the first result of a job is kept.
+"""
+import collections
+import json
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+from .config import Config
+from .digest import isolated
+from .models import CatSummaryStore
+from .simulation import Simulation
+
+LENGTH = struct.Struct('<I')
+
+
+def send_message(sock, message):
+    data = json.dumps(message).encode('utf-8')
+    sock.sendall(LENGTH.pack(len(data)) + data)
+
+
+def recv_message(stream):
+    """
+    :param stream: binary file of a socket, see `socket.makefile`
+    :return: the next message, None if the connection is closed
+    """
+    prefix = stream.read(LENGTH.size)
+    if len(prefix) < LENGTH.size:
+        return None
+    (size,) = LENGTH.unpack(prefix)
+    data = stream.read(size)
+    if len(data) < size:
+        return None
+    return json.loads(data.decode('utf-8'))
+
+
+def make_jobs(parameters, configs, seeds):
+    """
+    One job per (Config overrides, seed) pair, all with the same simulation parameters.
+    """
+    return [dict(job_id=f'{i}-{seed}', parameters=parameters, config=config, seed=seed)
+            for i, config in enumerate(configs) for seed in seeds]
+
+
+def run_job(job):
+    """
+    Runs a job to the end in this process without writing any file.
+    :return: compact result: run metadata, alive cats and summary counter totals over every cat
+    """
+    defaults = Config.values()
+    t = time.time()
+    try:
+        with isolated({}):
+            parameters = dict(job['parameters'], seed=job['seed'], results_file_path=None, metrics_file_path=None,
+                              digest_file_path=None, memory_file_path=None, heatmaps_file_path=None,
+                              live_port=None, metrics_port=None)
+            simulation = Simulation.from_config(config=job['config'], **parameters)
+            simulation.run()
+            cats = list(simulation.iter_cats())
+            totals = {name: sum(getattr(cat.summary, name) for cat in cats) for name in CatSummaryStore.counters}
+            alive = sum(cat.is_alive() for cat in cats)
+            metadata = simulation.serialize_metadata()
+    finally:
+        Config.override(**defaults)
+    return dict(
+        job_id=job['job_id'],
+        seed=job['seed'],
+        config=job['config'],
+        metadata=metadata,
+        alive=alive,
+        totals=totals,
+        elapsed=time.time() - t,
+    )
+
+
+class Coordinator:
+    """
+    Hands out jobs to workers and collects their results.
+    """
+
+    def __init__(self, jobs, results_file_path, host='127.0.0.1', port=0, lease_timeout=None, max_attempts=3):
+        """
+        :param results_file_path: results are appended to this NDJSON file as they arrive
+        :param port: 0 picks a free port, see `address`
+        :param lease_timeout: seconds after which a job that has not been reported back is handed out again. None to
+        only hand out jobs of disconnected workers again.
+        :param max_attempts: attempts of a job before it is recorded as failed
+        """
+        self.jobs = {job['job_id']: job for job in jobs}
+        self.results_file_path = results_file_path
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.results = {}  # job id -> result
+        self.failures = {}  # job id -> last error
+        self.duplicates = 0
+        self._pending = collections.deque(self.jobs)
+        self._queued = set(self.jobs)  # Same job ids as `_pending`, for membership tests
+        self._leases = {}  # job id -> {worker: start time}
+        self._attempts = collections.Counter()
+        self._lock = threading.Condition()
+        self._results_file = None
+
+        coordinator = self
+
+        class _Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                coordinator._serve(self.request, self.rfile, self.client_address)
+
+        self._server = socketserver.ThreadingTCPServer((host, port), _Handler, bind_and_activate=True)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def is_finished(self):
+        return len(self.results) + len(self.failures) == len(self.jobs)
+
+    def start(self):
+        self._results_file = open(self.results_file_path, 'w')
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout=None):
+        """
+        Waits until every job has a result or failed.
+        :return: True if finished
+        """
+        with self._lock:
+            return self._lock.wait_for(self.is_finished, timeout)
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._results_file is not None:
+            self._results_file.close()
+
+    def _serve(self, sock, stream, worker):
+        job_ids = set()  # Leased to this worker and not reported back yet
+        try:
+            while True:
+                message = recv_message(stream)
+                if message is None:
+                    return
+                if message['type'] == 'result':
+                    self._complete(message['result'], worker)
+                    job_ids.discard(message['result']['job_id'])
+                elif message['type'] == 'error':
+                    self._fail(message['job_id'], worker, message['error'])
+                    job_ids.discard(message['job_id'])
+                job = self._next_job(worker)
+                if job is not None:
+                    job_ids.add(job['job_id'])
+                    send_message(sock, dict(type='job', job=job))
+                elif self.is_finished():
+                    send_message(sock, dict(type='done'))
+                    return
+                else:
+                    send_message(sock, dict(type='wait', seconds=0.5))
+        except OSError:
+            pass  # Treated as a dead worker
+        finally:
+            self._release(job_ids, worker)
+
+    def _next_job(self, worker):
+        with self._lock:
+            if self.lease_timeout is not None:
+                now = time.time()
+                for job_id, leases in list(self._leases.items()):
+                    if job_id not in self._queued and all(now - t > self.lease_timeout for t in leases.values()):
+                        self._requeue(job_id, 'lease expired')
+            while self._pending:
+                job_id = self._pending.popleft()
+                self._queued.discard(job_id)
+                if job_id in self.results or job_id in self.failures:
+                    continue
+                self._attempts[job_id] += 1
+                self._leases.setdefault(job_id, {})[worker] = time.time()
+                return self.jobs[job_id]
+            return None
+
+    def _complete(self, result, worker):
+        with self._lock:
+            job_id = result['job_id']
+            self._leases.pop(job_id, None)
+            if job_id in self.results or job_id not in self.jobs:
+                self.duplicates += 1
+                return
+            self.results[job_id] = result
+            self.failures.pop(job_id, None)
+            self._results_file.write(json.dumps(result) + '\n')
+            self._results_file.flush()
+            self._lock.notify_all()
+
+    def _fail(self, job_id, worker, error):
+        with self._lock:
+            leases = self._leases.get(job_id, {})
+            leases.pop(worker, None)
+            if job_id in self.results or leases:
+                return  # Done or still running elsewhere
+            self._requeue(job_id, error)
+
+    def _requeue(self, job_id, error):
+        """
+        Hands out a job that is not running anywhere again, or records it as failed after `max_attempts`. Called with
+        the lock held.
+        """
+        self._leases.pop(job_id, None)
+        if self._attempts[job_id] >= self.max_attempts:
+            self.failures[job_id] = error
+            self._lock.notify_all()
+        else:
+            self._pending.append(job_id)
+            self._queued.add(job_id)
+
+    def _release(self, job_ids, worker):
+        """
+        Hands out the unfinished jobs of a disconnected worker again.
+        """
+        for job_id in job_ids:
+            self._fail(job_id, worker, 'worker disconnected')
+
+
+def work(host, port, max_jobs=None):
+    """
+    Pulls and runs jobs from a coordinator until it has none left. Jobs change process wide state (Config, random
+    module), so run one worker per process.
+    :param max_jobs: stop after this many jobs. None for no limit.
+    :return: number of jobs run
+    """
+    n_jobs = 0
+    with socket.create_connection((host, port)) as sock:
+        stream = sock.makefile('rb')
+        send_message(sock, dict(type='ready'))
+        while True:
+            message = recv_message(stream)
+            if message is None or message['type'] == 'done':
+                return n_jobs
+            if message['type'] == 'wait':
+                time.sleep(message['seconds'])
+                send_message(sock, dict(type='ready'))
+                continue
+            job = message['job']
+            try:
+                reply = dict(type='result', result=run_job(job))
+            except Exception as e:
+                reply = dict(type='error', job_id=job['job_id'], error=repr(e))
+            n_jobs += 1
+            send_message(sock, reply)
+            if max_jobs is not None and n_jobs >= max_jobs:
+                return n_jobs
@@ -0,0 +1,191 @@
+import collections
+import sys
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .memory import current_rss
+
+# Upper bounds of the step latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Telemetry:
+    """
+    Run statistics fed by the observer hooks of a simulation, rendered in the Prometheus text format.
+    """
+
+    def __init__(self, rate_window=1000):
+        """
+        :param rate_window: steps/sec is measured over at most this many recent steps
+        """
+        self.steps = 0
+        self.current_step = 0
+        self.population = 0
+        self.births = 0
+        self.deaths = 0
+        self.latency_counts = [0] * (len(LATENCY_BUCKETS) + 1)  # Last one is +Inf
+        self.latency_sum = 0.0
+        self.checkpoint_time = None
+        self.checkpoint_step = None
+        self.start_time = time.time()
+        self._step_times = collections.deque(maxlen=rate_window)
+        self._lock = threading.Lock()
+
+    def attach(self, simulation):
+        simulation.subscribe('on_birth', self._on_birth)
+        simulation.subscribe('on_death', self._on_death)
+        simulation.subscribe('on_step_end', self._on_step_end)
+        self.population = simulation.current_population
+
+    def detach(self, simulation):
+        simulation.unsubscribe('on_birth', self._on_birth)
+        simulation.unsubscribe('on_death', self._on_death)
+        simulation.unsubscribe('on_step_end', self._on_step_end)
+
+    def _on_birth(self, _cat_baby, _mother):
+        self.births += 1
+
+    def _on_death(self, _cat):
+        self.deaths += 1
+
+    def _on_step_end(self, simulation):
+        now = time.time()
+        latency = simulation.last_step_seconds
+        bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if latency <= bound), len(LATENCY_BUCKETS))
+        with self._lock:
+            self.steps += 1
+            self.current_step = simulation.current_step
+            self.population = simulation.current_population
+            self.latency_counts[bucket] += 1
+            self.latency_sum += latency
+            self.checkpoint_time = simulation.checkpoint_time
+            self.checkpoint_step = simulation.checkpoint_step
+            self._step_times.append(now)
+
+    def steps_per_second(self):
+        with self._lock:
+            if len(self._step_times) < 2:
+                return 0.0
+            return (len(self._step_times) - 1) / max(1e-9, self._step_times[-1] - self._step_times[0])
+
+    def render(self):
+        rate = self.steps_per_second()
+        now = time.time()
+        with self._lock:
+            checkpoint_lag = now - (self.checkpoint_time or self.start_time)
+            checkpoint_lag_steps = self.current_step - (self.checkpoint_step or 0)
+            lines = []
+
+            def metric(name, kind, help_text, value):
+                lines.extend([f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', f'{name} {value}'])
+
+            metric('catsim_steps_total', 'counter', 'Steps simulated.', self.steps)
+            metric('catsim_current_step', 'gauge', 'Current step of the simulation.', self.current_step)
+            metric('catsim_steps_per_second', 'gauge', 'Steps per second over the recent steps.', rate)
+            lines.extend(['# HELP catsim_step_duration_seconds Time spent in one step.',
+                          '# TYPE catsim_step_duration_seconds histogram'])
+            cumulative = 0
+            for bound, count in zip((*LATENCY_BUCKETS, '+Inf'), self.latency_counts):
+                cumulative += count
+                lines.append(f'catsim_step_duration_seconds_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'catsim_step_duration_seconds_sum {self.latency_sum}')
+            lines.append(f'catsim_step_duration_seconds_count {cumulative}')
+            metric('catsim_population', 'gauge', 'Cats alive.', self.population)
+            metric('catsim_births_total', 'counter', 'Cats born.', self.births)
+            metric('catsim_deaths_total', 'counter', 'Cats died.', self.deaths)
+            metric('catsim_checkpoint_lag_seconds', 'gauge', 'Seconds since the last saved state.', checkpoint_lag)
+            metric('catsim_checkpoint_lag_steps', 'gauge', 'Steps since the last saved state.', checkpoint_lag_steps)
+        rss = current_rss()
+        if rss is not None:
+            metric('process_resident_memory_bytes', 'gauge', 'Resident memory size in bytes.', rss)
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """
+    Serves the telemetry at http://host:port/metrics from a daemon thread.
+    """
+
+    def __init__(self, telemetry: Telemetry, port, host='127.0.0.1'):
+        """
+        :param port: 0 picks a free port, see `address`
+        """
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = telemetry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass  # Keep scrapes off the console
+
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class ProgressReporter:
+    """
+    Console progress line, rewritten in place at most once per `interval` seconds.
+    """
+
+    def __init__(self, n_steps, interval=1.0, stream=None):
+        self.n_steps = n_steps
+        self.interval = interval
+        self.stream = stream or sys.stdout
+        self._start = None
+        self._start_step = 0
+        self._last = None
+        self._width = 0
+
+    def attach(self, simulation):
+        simulation.subscribe('on_step_end', self._on_step_end)
+        self._start = time.time()
+        self._start_step = simulation.current_step
+
+    def detach(self, simulation):
+        simulation.unsubscribe('on_step_end', self._on_step_end)
+
+    def _on_step_end(self, simulation):
+        now = time.time()
+        if self._last is not None and now - self._last < self.interval and not simulation.is_finished():
+            return
+        self._last = now
+        self._write(simulation, now)
+
+    def _write(self, simulation, now):
+        step = simulation.current_step
+        elapsed = now - self._start
+        rate = (step - self._start_step) / elapsed if elapsed > 0 else 0.0
+        remaining = max(0, self.n_steps - step)
+        eta = str(timedelta(seconds=round(remaining / rate))) if rate > 0 else '?'
+        line = f'Step {step}/{self.n_steps} ({100 * step / max(1, self.n_steps):.1f}%) {rate:.1f} steps/s ' \
+               f'population {simulation.current_population} ETA {eta}'
+        self.stream.write('\r' + line.ljust(self._width))
+        self.stream.flush()
+        self._width = len(line)
+
+    def finish(self):
+        if self._last is not None:
+            self.stream.write('\n')
+            self.stream.flush()
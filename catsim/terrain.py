@@ -1,31 +1,78 @@
 from typing import List
 
-import matplotlib.patches as mpatches
 import numpy as np
 
 from .config import Config
-from .math import Vec2
-from .enums import Personality, CellType, Neighborhood
+from .math import Vec2, norm_xy, cross_xy, dot_xy
+from .enums import Personality, CellType, Neighborhood, Precision
 from .models import Cat
-from .utils import cross, cell_type_to_char, cell_type_to_color
+from .utils import cell_type_to_char, cell_type_to_color
+from .quadtree import QuadTree
+from .precision import TRACE_LEVELS, FOOD_DTYPE, flat_dtype, to_float32, trace_level, trace_value
+
+
+class Clock:
+    """
+    Current step of a terrain. Its cells share it, so that they can be carried over to the next terrain without
+    touching every one of them.
+    """
+    __slots__ = ('step',)
+
+    def __init__(self, step=0):
+        self.step = step
 
 
 class Cell:
     def __init__(self, position: Vec2, cats, x_trace=0.0, y_trace=0.0, cell_type=CellType.floor, food_amount=0.0,
-                 elevation=0):
+                 elevation=0, trace_step=0, clock=None):
+        """
+        :param trace_step: step at which `x_trace` and `y_trace` were last updated. They fade once per step since then.
+        :param clock: `Clock` of the terrain, a new one at step 0 if None
+        """
         self.position = position
         self.cats = cats
-        self.x_trace = x_trace  # Trace of smell of x personality
-        self.y_trace = y_trace  # Trace of smell of y personality
+        self._x_trace = x_trace  # Trace of smell of x personality, as of `_trace_step`
+        self._y_trace = y_trace  # Trace of smell of y personality, as of `_trace_step`
+        self._trace_step = trace_step
+        self._clock = clock if clock is not None else Clock()
         self.cell_type = cell_type
         self.food_amount = food_amount
         self.elevation = elevation
+        self.cat_stats = None  # CatGroupStats of `cats`, only maintained when forces are aggregated
+
+    def _fade_traces(self):
+        """
+        Brings the traces up to the current step. They are multiplied once per elapsed step rather than by
+        `trace_fading_factor ** elapsed`, which rounds differently in the last bits: the values are bit for bit the
+        same as fading them every step. The loop stops early once both traces reach 0.
+        """
+        step = self._clock.step
+        if self._trace_step == step:
+            return
+        x_trace, y_trace = self._x_trace, self._y_trace
+        for _ in range(step - self._trace_step):
+            x_trace *= Config.trace_fading_factor
+            y_trace *= Config.trace_fading_factor
+            if x_trace == 0 and y_trace == 0:
+                break
+        self._x_trace, self._y_trace, self._trace_step = x_trace, y_trace, step
+
+    @property
+    def x_trace(self):
+        self._fade_traces()
+        return self._x_trace
+
+    @property
+    def y_trace(self):
+        self._fade_traces()
+        return self._y_trace
 
     def increment_trace(self, personality: Personality, value: float):
+        self._fade_traces()
         if personality == Personality.X:
-            self.x_trace = min(Config.max_trace, self.x_trace + value)
+            self._x_trace = min(Config.max_trace, self._x_trace + value)
         else:
-            self.y_trace = min(Config.max_trace, self.y_trace + value)
+            self._y_trace = min(Config.max_trace, self._y_trace + value)
 
     def put_cat(self, cat: 'Cat'):
         self.cats.append(cat)
@@ -72,32 +119,338 @@ class Cell:
                f'cell_type={self.cell_type},food_amount={self.food_amount},elevation={self.elevation}}}'
 
 
+class CompactCell(Cell):
+    """
+    Cell of a compact precision terrain. Traces are stored as integer levels (uint16 fixed point, see
+    `catsim.precision`) that fade by truncation, and food amounts are rounded to float32 whenever they are written.
+    Both are still Python numbers, so a cell is no smaller than a `Cell`.
+    """
+
+    @property
+    def food_amount(self):
+        return self._food_amount
+
+    @food_amount.setter
+    def food_amount(self, value):
+        self._food_amount = to_float32(value)
+
+    def _fade_traces(self):
+        step = self._clock.step
+        if self._trace_step == step:
+            return
+        x_level, y_level = self._x_trace, self._y_trace
+        for _ in range(step - self._trace_step):
+            x_level = int(x_level * Config.trace_fading_factor)
+            y_level = int(y_level * Config.trace_fading_factor)
+            if x_level == 0 and y_level == 0:
+                break
+        self._x_trace, self._y_trace, self._trace_step = x_level, y_level, step
+
+    @property
+    def x_trace(self):
+        self._fade_traces()
+        return trace_value(self._x_trace)
+
+    @property
+    def y_trace(self):
+        self._fade_traces()
+        return trace_value(self._y_trace)
+
+    def increment_trace(self, personality: Personality, value: float):
+        self._fade_traces()
+        if personality == Personality.X:
+            self._x_trace = min(TRACE_LEVELS, self._x_trace + trace_level(value))
+        else:
+            self._y_trace = min(TRACE_LEVELS, self._y_trace + trace_level(value))
+
+
+_CELL_TYPES = np.array(list(CellType), dtype=object)  # By value
+
+
+def elevation_row(elevations, y):
+    """
+    Row `y` of dense elevations given as rows or as a 2D array, as a list.
+    """
+    row = elevations[y]
+    return row.tolist() if isinstance(row, np.ndarray) else row
+
+
+def cell_type_row(cell_types, y):
+    """
+    Row `y` of dense cell types given as rows of CellType or as a 2D array of CellType values, as a list of CellType.
+    """
+    row = cell_types[y]
+    return _CELL_TYPES[row].tolist() if isinstance(row, np.ndarray) else row
+
+
+class SparseLayer:
+    """
+    Static per cell values of which only the ones that differ from `default` are stored, as ascending flat indices
+    (y * width + x) and their values. Lookups are binary searches on the indices.
+    """
+
+    def __init__(self, width: int, height: int, flat, values, default=0):
+        self.width = width
+        self.height = height
+        self.default = default
+        flat = np.asarray(flat, dtype=np.int64)
+        order = np.argsort(flat, kind='stable')
+        self.flat = flat[order]
+        self.values = np.asarray(values)[order]
+
+    def astype(self, dtype):
+        """
+        Copy with the values cast to `dtype` and the indices to the narrowest type that fits the map.
+        """
+        layer = SparseLayer(self.width, self.height, [], [], self.default)
+        layer.flat = self.flat.astype(flat_dtype(self.width, self.height))
+        layer.values = self.values.astype(dtype)
+        return layer
+
+    @classmethod
+    def from_dense(cls, rows, default=0):
+        values = np.asarray(rows)
+        height, width = values.shape
+        flat = np.flatnonzero(values != default)
+        return cls(width, height, flat, values.ravel()[flat], default)
+
+    def __len__(self):
+        return len(self.flat)
+
+    def get(self, i):
+        j = np.searchsorted(self.flat, self.flat.dtype.type(i))  # Same type, so that the indices are not converted
+        if j < len(self.flat) and self.flat[j] == i:
+            return self.values[j].item()
+        return self.default
+
+    def get_many(self, flat):
+        """
+        Vectorized `get` for an array of flat indices.
+        """
+        flat = np.asarray(flat, dtype=self.flat.dtype)
+        if len(self.flat) == 0:
+            return np.full(len(flat), self.default)
+        j = np.minimum(np.searchsorted(self.flat, flat), len(self.flat) - 1)
+        return np.where(self.flat[j] == flat, self.values[j], self.default)
+
+    def row(self, y):
+        """
+        Values of row `y` as a list.
+        """
+        row = np.full(self.width, self.default, dtype=self.values.dtype)
+        bounds = np.array((y * self.width, (y + 1) * self.width), dtype=self.flat.dtype)
+        lo, hi = np.searchsorted(self.flat, bounds)
+        row[self.flat[lo:hi] - y * self.width] = self.values[lo:hi]
+        return row.tolist()
+
+    def serialize(self, convert=None):
+        """
+        :param convert: applied to every value, e.g. to name cell types
+        :return: the default and [x, y, value] of the stored cells
+        """
+        convert = convert or (lambda value: value)
+        ys, xs = np.divmod(self.flat, self.width)
+        return dict(
+            default=convert(self.default),
+            cells=[[x, y, convert(value)] for x, y, value in zip(xs.tolist(), ys.tolist(), self.values.tolist())],
+        )
+
+
+class CellTypeIndex:
+    """
+    Static index of cells by `CellType`, built once when the terrain is loaded.
+    For each cell type, holds the coordinate arrays of its cells (row major order) and a grid of square buckets of
+    `bucket_size` cells, so that feature cells around a position can be found without visiting floor cells.
+    A compact index stores indices and coordinates in the narrowest type that fits the map, and the buckets as arrays
+    instead of lists: the cells sorted by bucket, the ascending ids (by * buckets per row + bx) of the non empty buckets
+    and where their cells start.
+    """
+
+    def __init__(self, width: int, height: int, cell_types, bucket_size=8, compact=False):
+        """
+        :param cell_types: rows of `CellType`, or a `SparseLayer` of their values. Floor cells of a sparse layer are
+        not indexed.
+        """
+        self.width = width
+        self.height = height
+        self.bucket_size = bucket_size
+        self.compact = compact
+        self._buckets_per_row = -(-width // bucket_size)
+        self.flat = {}
+        self.xs = {}
+        self.ys = {}
+        self._buckets = {}
+        self._quadtrees = {}
+        if isinstance(cell_types, SparseLayer):
+            codes = cell_types.values
+        elif isinstance(cell_types, np.ndarray):
+            codes = cell_types.astype(np.int64)
+        else:
+            codes = np.array([[cell_type.value for cell_type in row] for row in cell_types], dtype=np.int64)
+            codes = codes.reshape(height, width)
+        for cell_type in CellType:
+            if isinstance(cell_types, SparseLayer):
+                flat = cell_types.flat[codes == cell_type.value]
+            else:
+                flat = np.flatnonzero(codes == cell_type.value)
+            if compact:
+                flat = flat.astype(flat_dtype(width, height))
+            self.flat[cell_type] = flat
+            self.ys[cell_type], self.xs[cell_type] = np.divmod(flat, width)
+            if cell_type == CellType.floor:
+                continue  # Floor cells are never queried by position
+            if compact:
+                bucket_ids = (self.ys[cell_type] // bucket_size * self._buckets_per_row +
+                              self.xs[cell_type] // bucket_size)
+                order = np.argsort(bucket_ids, kind='stable')
+                ids, starts = np.unique(bucket_ids[order], return_index=True)
+                self._buckets[cell_type] = (flat[order], ids, np.append(starts, len(flat)).astype(flat.dtype))
+                continue
+            buckets = {}
+            for i, x, y in zip(flat.tolist(), self.xs[cell_type].tolist(), self.ys[cell_type].tolist()):
+                buckets.setdefault((x // bucket_size, y // bucket_size), []).append(i)
+            self._buckets[cell_type] = buckets
+
+    def count(self, cell_type: CellType):
+        return len(self.flat[cell_type])
+
+    def quadtree(self, cell_type: CellType) -> QuadTree:
+        """
+        Quadtree over the cells of `cell_type`, points in the same order as `flat`. Built on first use.
+        """
+        if cell_type not in self._quadtrees:
+            self._quadtrees[cell_type] = QuadTree(self.xs[cell_type], self.ys[cell_type])
+        return self._quadtrees[cell_type]
+
+    def within(self, cell_type: CellType, x, y, r, neighborhood: Neighborhood):
+        """
+        Flat indices (y * width + x) of the cells of `cell_type` in the neighborhood of radius `r` around (x, y), in
+        the same order as `Terrain.neighbors`.
+        """
+        r = round(r)
+        if self.compact:
+            return self._within_compact(cell_type, x, y, r, neighborhood)
+        buckets = self._buckets[cell_type]
+        if not buckets:
+            return []
+        b = self.bucket_size
+        width = self.width
+        x0, x1 = max(0, x - r) // b, min(self.width - 1, x + r) // b
+        y0, y1 = max(0, y - r) // b, min(self.height - 1, y + r) // b
+        found = []
+        moore = neighborhood == Neighborhood.Moore
+        for by in range(y0, y1 + 1):
+            for bx in range(x0, x1 + 1):
+                for i in buckets.get((bx, by), ()):
+                    dy, dx = divmod(i, width)
+                    dx, dy = abs(dx - x), abs(dy - y)
+                    if (dx <= r and dy <= r) if moore else (dx + dy <= r):
+                        found.append(i)
+        found.sort()
+        return found
+
+    def _within_compact(self, cell_type: CellType, x, y, r, neighborhood: Neighborhood):
+        cells, ids, starts = self._buckets[cell_type]
+        if not len(ids):
+            return []
+        b = self.bucket_size
+        width = self.width
+        x0, x1 = max(0, x - r) // b, min(self.width - 1, x + r) // b
+        y0, y1 = max(0, y - r) // b, min(self.height - 1, y + r) // b
+        # Buckets x0 to x1 of a row have consecutive ids, so their cells are one slice
+        row_ids = np.arange(y0, y1 + 1, dtype=ids.dtype) * self._buckets_per_row
+        lo = np.searchsorted(ids, row_ids + x0)
+        hi = np.searchsorted(ids, row_ids + x1 + 1)
+        found = []
+        moore = neighborhood == Neighborhood.Moore
+        for start, end in zip(starts[lo].tolist(), starts[hi].tolist()):
+            for i in cells[start:end].tolist():
+                dy, dx = divmod(i, width)
+                dx, dy = abs(dx - x), abs(dy - y)
+                if (dx <= r and dy <= r) if moore else (dx + dy <= r):
+                    found.append(i)
+        found.sort()
+        return found
+
+
 class Terrain:
-    def __init__(self, width: int, height: int, elevations, cell_types, previous_terrain=None):
+    def __init__(self, width: int, height: int, elevations, cell_types, previous_terrain=None,
+                 precision=Precision.full):
+        """
+        :param precision: storage precision of the cells, that of `previous_terrain` if given
+        """
         self.width = width
         self.height = height
+        self.precision = previous_terrain.precision if previous_terrain is not None else precision
+        self.cell_class = CompactCell if self.precision == Precision.compact else Cell
+        # Boundary segments as (q.x, q.y, s.x, s.y) i.e. from q to q + s
+        self._boundaries = (
+            (0, 0, width - 1, 0),
+            (0, 0, 0, height - 1),
+            (width - 1, height - 1, -width + 1, 0),
+            (width - 1, height - 1, 0, -height + 1),
+        )
+        # Layer totals are maintained incrementally, so that they never need a scan
+        if previous_terrain is not None:
+            self.step = previous_terrain.step + 1
+            self.index = previous_terrain.index
+            self.food_total = previous_terrain._start_food_total
+            self.x_trace_total = previous_terrain.x_trace_total * Config.trace_fading_factor
+            self.y_trace_total = previous_terrain.y_trace_total * Config.trace_fading_factor
+        else:
+            self.step = 0
+            self.index = CellTypeIndex(width, height, cell_types, compact=self.precision == Precision.compact)
+            self.food_total = self.index.count(CellType.food) * Config.start_food_amount
+            self.x_trace_total, self.y_trace_total = 0, 0
+        self.clock = Clock(self.step)
+        self._build_cells(elevations, cell_types, previous_terrain)
+        self._occupied = {}  # Cells with cats, keyed by flat index y * width + x
+        # The next terrain starts from the food of this one as it was built: refills and consumption of a step do not
+        # carry over
+        self._start_food_total = self.food_total
+        self._start_food = {}  # Food amounts before the first change, keyed by flat index
+        # Food changes of the step, for consumers that follow the terrain incrementally
+        self.food_changes = []  # Flat indices of the cells food was consumed from
+        self.food_refilled = False
+        self.food_refill_amount = None  # Amount every food cell was set to, if refilled
+
+    def _build_cells(self, elevations, cell_types, previous_terrain):
+        if previous_terrain is not None:
+            self._carry_cells_over(previous_terrain)
+            return
         self.grid = []
-        for y in range(height):
-            row = []
-            for x in range(width):
-                if previous_terrain is not None:
-                    food_amount = previous_terrain.grid[y][x].food_amount
-                    x_trace = previous_terrain.grid[y][x].x_trace * Config.trace_fading_factor
-                    y_trace = previous_terrain.grid[y][x].y_trace * Config.trace_fading_factor
-                else:
-                    food_amount = Config.start_food_amount if cell_types[y][x] == CellType.food else 0
-                    x_trace, y_trace = 0, 0
-                cell = Cell(
+        for y in range(self.height):
+            elevation_values, cell_type_values = elevation_row(elevations, y), cell_type_row(cell_types, y)
+            self.grid.append([
+                self.cell_class(
                     position=Vec2(x, y),
                     cats=[],
-                    cell_type=cell_types[y][x],
-                    elevation=elevations[y][x],
-                    food_amount=food_amount,
-                    x_trace=x_trace,
-                    y_trace=y_trace,
+                    cell_type=cell_type,
+                    elevation=elevation,
+                    food_amount=Config.start_food_amount if cell_type == CellType.food else 0,
+                    x_trace=0,
+                    y_trace=0,
+                    trace_step=self.step,
+                    clock=self.clock,
                 )
-                row.append(cell)
-            self.grid.append(row)
+                for x, (elevation, cell_type) in enumerate(zip(elevation_values, cell_type_values))
+            ])
+
+    def _carry_cells_over(self, previous_terrain):
+        """
+        Takes over the cells of `previous_terrain`, which must not be used afterwards. Only the cells that changed in
+        the step are touched: traces fade lazily against the shared clock, occupied cells are emptied and food is put
+        back to what it was when `previous_terrain` was built.
+        """
+        self.clock = previous_terrain.clock
+        self.clock.step = self.step
+        self.grid = previous_terrain.grid
+        for cell in previous_terrain._occupied.values():
+            cell.cats = []
+            cell.cat_stats = None
+        width = self.width
+        for i, food_amount in previous_terrain._start_food.items():
+            self.grid[i // width][i % width].food_amount = food_amount
 
     def put_cat(self, cat: 'Cat'):
         """
@@ -105,11 +458,64 @@ class Terrain:
         Ideally, should be used on a new terrain object.
         """
         if self.is_position_valid(cat.position):
-            self.cell_at(cat.position).put_cat(cat)
+            cell = self.cell_at(cat.position)
+            x_trace, y_trace = cell.x_trace, cell.y_trace
+            cell.put_cat(cat)
+            self.x_trace_total += cell.x_trace - x_trace
+            self.y_trace_total += cell.y_trace - y_trace
+            self._occupied[cat.position.y * self.width + cat.position.x] = cell
+
+    def refill_food(self, amount):
+        width = self.width
+        for cell in self.cells_of_type(CellType.food):
+            self._start_food.setdefault(cell.position.y * width + cell.position.x, cell.food_amount)
+            cell.food_amount = amount
+        self.food_total = self.index.count(CellType.food) * amount
+        self.food_changes = []
+        self.food_refilled = True
+        self.food_refill_amount = amount
+
+    def consume_food(self, cell: Cell, amount):
+        i = cell.position.y * self.width + cell.position.x
+        food_amount = cell.food_amount
+        self._start_food.setdefault(i, food_amount)
+        cell.get_consumed(amount)
+        self.food_total += cell.food_amount - food_amount
+        self.food_changes.append(i)
+
+    def food_amounts(self):
+        """
+        Food amounts of the food cells, in the order of `cells_of_type(CellType.food)`.
+        """
+        return [cell.food_amount for cell in self.cells_of_type(CellType.food)]
+
+    def built_food_amounts(self):
+        """
+        Food amounts of the food cells as the terrain was built, before the refill and consumption of the step. Same
+        for every terrain of a run.
+        """
+        width = self.width
+        return [self._start_food.get(cell.position.y * width + cell.position.x, cell.food_amount)
+                for cell in self.cells_of_type(CellType.food)]
+
+    def occupied_cells(self) -> List[Cell]:
+        """
+        Cells with at least one cat, in row major order (same order as scanning the grid).
+        """
+        return [self._occupied[i] for i in sorted(self._occupied)]
+
+    def cats(self) -> List['Cat']:
+        """
+        All cats on the terrain, in the same order as scanning the grid cell by cell.
+        """
+        return [cat for cell in self.occupied_cells() for cat in cell.cats]
 
     def is_position_valid(self, v: Vec2):
         return 0 <= v.x < self.width and 0 <= v.y < self.height
 
+    def is_position_valid_xy(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
     def at(self, x, y) -> Cell:
         return self.grid[y][x]
 
@@ -119,78 +525,171 @@ class Terrain:
     def cats_at(self, pos: Vec2):
         return self.cell_at(pos).cats
 
+    def cells_of_type(self, cell_type: CellType) -> List[Cell]:
+        width = self.width
+        return [self.grid[i // width][i % width] for i in self.index.flat[cell_type].tolist()]
+
+    def features_within(self, cell_type: CellType, center: Vec2, r, neighborhood: Neighborhood) -> List[Cell]:
+        """
+        Cells of `cell_type` among `neighbors(center, r, neighborhood)`, in the same order, found via the index.
+        """
+        width = self.width
+        return [self.grid[i // width][i % width]
+                for i in self.index.within(cell_type, center.x, center.y, r, neighborhood)]
+
     def neighbors(self, center: Vec2, r: int, neighborhood: Neighborhood) -> List[Cell]:
         r = round(r)
+        cx, cy = center.x, center.y
+        grid = self.grid
+        y0, y1 = max(0, cy - r), min(self.height, cy + r + 1)
         if neighborhood == Neighborhood.Moore:
-            positions = [center + Vec2(dx, dy) for dy in range(-r, r + 1) for dx in range(-r, r + 1)]
-        else:
-            positions = [center + Vec2(dx, dy) for dy in range(-r, r + 1) for dx in range(-r, r + 1) if
-                         abs(dx) + abs(dy) <= r]
-        valid_positions = [pos for pos in positions if self.is_position_valid(pos)]
-        return [self.cell_at(pos) for pos in valid_positions]
+            x0, x1 = max(0, cx - r), min(self.width, cx + r + 1)
+            return [cell for row in grid[y0:y1] for cell in row[x0:x1]]
+        cells = []
+        for y in range(y0, y1):
+            k = r - abs(y - cy)
+            cells.extend(grid[y][max(0, cx - k):min(self.width, cx + k + 1)])
+        return cells
+
+    def neighbor_counts(self, xs, ys, r: int, neighborhood: Neighborhood):
+        """
+        Vectorized `len(neighbors(...))` for arrays of center coordinates.
+        """
+        r = round(r)
+        xs, ys = np.asarray(xs, dtype=np.int64), np.asarray(ys, dtype=np.int64)
+        if neighborhood == Neighborhood.Moore:
+            n_cols = np.minimum(self.width, xs + r + 1) - np.maximum(0, xs - r)
+            n_rows = np.minimum(self.height, ys + r + 1) - np.maximum(0, ys - r)
+            return n_cols * n_rows
+        counts = np.zeros(len(xs), dtype=np.int64)
+        for dy in range(-r, r + 1):
+            k = r - abs(dy)
+            n_cols = np.minimum(self.width, xs + k + 1) - np.maximum(0, xs - k)
+            counts += np.where((0 <= ys + dy) & (ys + dy < self.height), n_cols, 0)
+        return counts
 
     def health_damange_to_travel(self, from_pos: Vec2, to_pos: Vec2):
         elevation_difference = self.cell_at(to_pos).elevation - self.cell_at(from_pos).elevation
-        return (max(0, elevation_difference) + (to_pos - from_pos).norm()) / 10
+        return (max(0, elevation_difference) + norm_xy(to_pos.x - from_pos.x, to_pos.y - from_pos.y)) / 10
 
     def _clamp_destination(self, from_vec, to_vec):
-        boundaries = [
-            [Vec2(0, 0), Vec2(self.width - 1, 0)],
-            [Vec2(0, 0), Vec2(0, self.height - 1)],
-            [Vec2(self.width - 1, self.height - 1), Vec2(-self.width + 1, 0)],
-            [Vec2(self.width - 1, self.height - 1), Vec2(0, -self.height + 1)],
-        ]
-        p, r = from_vec, to_vec - from_vec
-        for q, s in boundaries:
-            q_p = q - p
-            q_pxr = cross(q_p, r)
-            q_pxs = cross(q_p, s)
-            rxs = cross(r, s)
+        return Vec2(*self._clamp_destination_xy(from_vec.x, from_vec.y, to_vec.x, to_vec.y))
+
+    def _clamp_destination_xy(self, px, py, tx, ty):
+        """
+        Intersects the segment p -> p + r with the four boundaries. Works on scalars to avoid allocating vectors.
+        """
+        rx, ry = tx - px, ty - py
+        ex, ey = px + rx, py + ry  # p + r
+        cx, cy = self.width / 2, self.height / 2
+        for qx, qy, sx, sy in self._boundaries:
+            q_px, q_py = qx - px, qy - py
+            q_pxr = cross_xy(q_px, q_py, rx, ry)
+            q_pxs = cross_xy(q_px, q_py, sx, sy)
+            rxs = cross_xy(rx, ry, sx, sy)
             if q_pxs == 0.0:
                 # Starting position is on the boundary
-                if p == q or p == q + s:
+                if (px == qx and py == qy) or (px == qx + sx and py == qy + sy):
                     # starting point is a corner point
-                    if not self.is_position_valid(p + r):
-                        return p
-                c = Vec2(self.width / 2, self.height / 2)
-                a1 = cross(s, c - q)
-                a2 = cross(s, p + r - q)
+                    if not self.is_position_valid_xy(ex, ey):
+                        return px, py
+                a1 = cross_xy(sx, sy, cx - qx, cy - qy)
+                a2 = cross_xy(sx, sy, ex - qx, ey - qy)
                 if a2 == 0:
                     # Both p and p + r on the bundary line i.e. co-linear
-                    u1 = (p + r - q).dot(s) / s.dot(s)
-                    if u1 < 0:
-                        return q
-                    elif u1 <= 1:
-                        return p + r
-                    else:
-                        return q + s
+                    return self._clamp_colinear_xy(ex, ey, qx, qy, sx, sy)
                 if a1 * a2 < 0:
                     # Different sides of the boundary line
-                    return p
+                    return px, py
                 else:
                     # None of the cases
                     continue
             if q_pxr == 0.0 and rxs == 0.0:
                 # Co-linear
-                u1 = (p + r - q).dot(s) / s.dot(s)
-                if u1 < 0:
-                    return q
-                elif u1 <= 1:
-                    return p + r
-                else:
-                    return q + s
+                return self._clamp_colinear_xy(ex, ey, qx, qy, sx, sy)
             if rxs == 0.0:
                 continue  # Parallel, No intersection
             u = q_pxr / rxs
             t = q_pxs / rxs
             if 0 <= u <= 1 and 0 <= t <= 1:
-                return p + r * t  # If intersects, return
-        return p + r  # Intersects with none. All good!
+                return px + rx * t, py + ry * t  # If intersects, return
+        return ex, ey  # Intersects with none. All good!
+
+    @staticmethod
+    def _clamp_colinear_xy(ex, ey, qx, qy, sx, sy):
+        u1 = dot_xy(ex - qx, ey - qy, sx, sy) / dot_xy(sx, sy, sx, sy)
+        if u1 < 0:
+            return qx, qy
+        elif u1 <= 1:
+            return ex, ey
+        else:
+            return qx + sx, qy + sy
+
+    def clamp_many(self, origins, targets):
+        """
+        Batch version of `clamp` for the whole population in one NumPy pass.
+        Each boundary is clipped parametrically (same cases as `_clamp_destination_xy`, in the same order), cats that
+        got resolved by a boundary are masked out of the following ones.
+        :param origins: (n, 2) array of from positions
+        :param targets: (n, 2) array of to positions
+        :return: (n, 2) integer array of lattice destinations
+        """
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 2)
+        targets = np.asarray(targets, dtype=np.float64).reshape(-1, 2)
+        px, py = origins[:, 0], origins[:, 1]
+        rx, ry = targets[:, 0] - px, targets[:, 1] - py
+        ex, ey = px + rx, py + ry  # p + r
+        res_x, res_y = ex.copy(), ey.copy()
+        pending = np.ones(len(px), dtype=bool)
+        end_valid = (0 <= ex) & (ex < self.width) & (0 <= ey) & (ey < self.height)
+        cx, cy = self.width / 2, self.height / 2
+
+        def _resolve(mask, x, y):
+            res_x[mask] = x if np.isscalar(x) else x[mask]
+            res_y[mask] = y if np.isscalar(y) else y[mask]
+            pending[mask] = False
+
+        def _resolve_colinear(mask, qx, qy, sx, sy):
+            u1 = ((ex - qx) * sx + (ey - qy) * sy) / (sx * sx + sy * sy)
+            _resolve(mask & (u1 < 0), qx, qy)
+            _resolve(mask & (0 <= u1) & (u1 <= 1), ex, ey)
+            _resolve(mask & ~(u1 < 0) & ~(u1 <= 1), qx + sx, qy + sy)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for qx, qy, sx, sy in self._boundaries:
+                q_px, q_py = qx - px, qy - py
+                q_pxr = q_px * ry - q_py * rx
+                q_pxs = q_px * sy - q_py * sx
+                rxs = rx * sy - ry * sx
+
+                # Starting position is on the boundary
+                on_line = pending & (q_pxs == 0.0)
+                corner = ((px == qx) & (py == qy)) | ((px == qx + sx) & (py == qy + sy))
+                _resolve(on_line & corner & ~end_valid, px, py)
+                on_line &= pending
+                a1 = sx * (cy - qy) - sy * (cx - qx)
+                a2 = sx * (ey - qy) - sy * (ex - qx)
+                _resolve_colinear(on_line & (a2 == 0), qx, qy, sx, sy)
+                _resolve(on_line & (a2 != 0) & (a1 * a2 < 0), px, py)
+
+                # Starting position is off the boundary
+                off_line = pending & ~on_line & (q_pxs != 0.0)
+                _resolve_colinear(off_line & (q_pxr == 0.0) & (rxs == 0.0), qx, qy, sx, sy)
+                off_line &= pending & (rxs != 0.0)
+                u = q_pxr / rxs
+                t = q_pxs / rxs
+                _resolve(off_line & (0 <= u) & (u <= 1) & (0 <= t) & (t <= 1), px + rx * t, py + ry * t)
+
+        lattice = np.empty((len(px), 2), dtype=np.int64)
+        lattice[:, 0] = np.round(np.clip(res_x, 0, self.width - 1))
+        lattice[:, 1] = np.round(np.clip(res_y, 0, self.height - 1))
+        return lattice
 
     def make_lattice(self, v: Vec2):
-        x = round(max(0, min(v.x, self.width - 1)))
-        y = round(max(0, min(v.y, self.height - 1)))
-        return Vec2(x, y)
+        return Vec2(*self.make_lattice_xy(v.x, v.y))
+
+    def make_lattice_xy(self, x, y):
+        return round(max(0, min(x, self.width - 1))), round(max(0, min(y, self.height - 1)))
 
     def clamp(self, from_vec: Vec2, to_vec: Vec2):
         """
@@ -198,7 +697,10 @@ class Terrain:
         :param from_vec: from vector
         :param to_vec: to vector
         """
-        return self.make_lattice(self._clamp_destination(from_vec, to_vec))
+        return Vec2(*self.clamp_xy(from_vec.x, from_vec.y, to_vec.x, to_vec.y))
+
+    def clamp_xy(self, px, py, tx, ty):
+        return self.make_lattice_xy(*self._clamp_destination_xy(px, py, tx, ty))
 
     def console_render(self):
         cell_w = 5
@@ -250,6 +752,8 @@ class Terrain:
 
         ax1.title.set_text('Cat movement')
         plots['sc'] = ax1.scatter([], [])
+        import matplotlib.patches as mpatches
+
         patches = [mpatches.Patch(color=(*cell_type_to_color(cell_type), 0.3), label=str(cell_type))
                    for cell_type in CellType]
         plots['legend'] = ax1.legend(handles=patches, borderaxespad=0., loc='center',
@@ -273,7 +777,7 @@ class Terrain:
         plots['im3'] = ax3.imshow(y_trace_colors)
 
     def render(self, plots, axs, fig):
-        cat_offsets = [(cat.position.x, cat.position.y) for row in self.grid for cell in row for cat in cell.cats]
+        cat_offsets = [(cat.position.x, cat.position.y) for cat in self.cats()]
         x_trace_colors = [[cell.get_x_trace_color() for cell in row] for row in self.grid]
         y_trace_colors = [[cell.get_y_trace_color() for cell in row] for row in self.grid]
 
@@ -332,3 +836,220 @@ class Terrain:
                 res += str(self.grid[y][x])
             res += '\n'
         return res
+
+
+class StaticCell:
+    """
+    Read-only view of a cell of a `SparseTerrain` that is not kept: no cats and no traces. Elevation and food are
+    looked up in the layers when read.
+    """
+    __slots__ = ('position', 'cell_type', '_terrain')
+    cats = ()
+    cat_stats = None
+    x_trace = 0
+    y_trace = 0
+
+    def __init__(self, terrain: 'SparseTerrain', position: Vec2, cell_type: CellType):
+        self._terrain = terrain
+        self.position = position
+        self.cell_type = cell_type
+
+    @property
+    def elevation(self):
+        return self._terrain.elevations.get(self.position.y * self._terrain.width + self.position.x)
+
+    @property
+    def food_amount(self):
+        if self.cell_type != CellType.food:
+            return 0
+        return self._terrain._food_at(self.position.y * self._terrain.width + self.position.x)
+
+
+class SparseTerrain(Terrain):
+    """
+    Terrain for huge, mostly empty maps. Memory is proportional to the content instead of the area.
+    Elevations and cell types are `SparseLayer`s and initial food amounts a list (a float32 array with compact
+    precision) in the order of the food cells in the index. Refills and consumption of a step are kept on top of them.
+    Only cells with traces or cats are kept as `Cell` objects. Any other cell is built on demand whenever it is looked
+    up. Cells are only kept after mutating them through the terrain e.g. `put_cat`. Kept cells are carried over to
+    the next terrain.
+    """
+
+    prune_interval = 64  # Steps between checks for faded traces of unvisited cells
+    max_dense_cells = 1 << 22  # Largest map that may be viewed densely e.g. rendered or streamed live
+
+    def _build_cells(self, elevations: SparseLayer, cell_types: SparseLayer, previous_terrain):
+        self.elevations = elevations
+        self.cell_types = cell_types
+        if previous_terrain is None:
+            if self.precision == Precision.compact:
+                self._initial_food = np.full(self.index.count(CellType.food), Config.start_food_amount,
+                                             dtype=FOOD_DTYPE)
+            else:
+                self._initial_food = [Config.start_food_amount] * self.index.count(CellType.food)
+        else:
+            # Food does not carry over from one terrain to the next, so every terrain starts from the initial amounts
+            self._initial_food = previous_terrain._initial_food
+        # Food of the step on top of the initial amounts: the refill amount, if refilled, and the consumed cells
+        self._food_fill = None
+        self._food_overrides = {}  # Keyed by food ordinal
+        if previous_terrain is None:
+            self._cells = {}  # Kept cells, keyed by flat index y * width + x
+        else:
+            self._carry_cells_over(previous_terrain)
+
+    def _carry_cells_over(self, previous_terrain):
+        """
+        Takes over the kept cells of `previous_terrain`, which must not be used afterwards. Cells whose traces faded
+        away are dropped, the others are emptied and get their initial food back.
+        """
+        cells = previous_terrain._cells
+        faded = []
+        for i, cell in cells.items():
+            # Against the clock of the previous step
+            if (self.step - cell._trace_step) % self.prune_interval == 0:
+                cell._fade_traces()
+            if cell._x_trace == 0 and cell._y_trace == 0:
+                faded.append(i)
+        for i in faded:
+            del cells[i]
+        self.clock = previous_terrain.clock
+        self.clock.step = self.step
+        for cell in previous_terrain._occupied.values():
+            cell.cats = []
+            cell.cat_stats = None
+        for i, food_amount in previous_terrain._start_food.items():
+            cell = cells.get(i)
+            if cell is not None:
+                cell.food_amount = food_amount
+        self._cells = cells
+
+    def _new_cell(self, i, elevation=None, cell_type_value=None):
+        y, x = divmod(i, self.width)
+        if elevation is None:
+            elevation = self.elevations.get(i)
+        if cell_type_value is None:
+            cell_type_value = self.cell_types.get(i)
+        cell_type = CellType(cell_type_value)
+        food_amount = self._food_at(i) if cell_type == CellType.food else 0
+        return self.cell_class(position=Vec2(x, y), cats=[], cell_type=cell_type, elevation=elevation,
+                               food_amount=food_amount, trace_step=self.step, clock=self.clock)
+
+    def _food_ordinal(self, i):
+        food = self.index.flat[CellType.food]
+        return int(np.searchsorted(food, food.dtype.type(i)))
+
+    def _food_at(self, i):
+        """
+        Food amount of the food cell at flat index `i`, whether it is kept or not.
+        """
+        ordinal = self._food_ordinal(i)
+        food_amount = self._food_overrides.get(ordinal)
+        if food_amount is not None:
+            return food_amount
+        return self._food_fill if self._food_fill is not None else self._initial_food[ordinal]
+
+    def _food_value(self, amount):
+        """
+        `amount` as stored in the food layer, float32 with compact precision.
+        """
+        food = self._initial_food
+        return food.dtype.type(amount) if isinstance(food, np.ndarray) else amount
+
+    def _cell(self, i):
+        cell = self._cells.get(i)
+        return cell if cell is not None else self._new_cell(i)
+
+    @property
+    def grid(self):
+        """
+        Dense rows of cells, for rendering small maps.
+        """
+        return [[self._cell(y * self.width + x) for x in range(self.width)] for y in range(self.height)]
+
+    def put_cat(self, cat: 'Cat'):
+        if self.is_position_valid(cat.position):
+            i = cat.position.y * self.width + cat.position.x
+            if i not in self._cells:
+                self._cells[i] = self._new_cell(i)
+        super().put_cat(cat)
+
+    def refill_food(self, amount):
+        self._food_fill = self._food_value(amount)
+        self._food_overrides = {}
+        width = self.width
+        for cell in self._cells.values():
+            if cell.cell_type == CellType.food:
+                self._start_food.setdefault(cell.position.y * width + cell.position.x, cell.food_amount)
+                cell.food_amount = amount
+        self.food_total = self.index.count(CellType.food) * amount
+        self.food_changes = []
+        self.food_refilled = True
+        self.food_refill_amount = amount
+
+    def consume_food(self, cell: Cell, amount):
+        super().consume_food(cell, amount)
+        ordinal = self._food_ordinal(cell.position.y * self.width + cell.position.x)
+        self._food_overrides[ordinal] = self._food_value(cell.food_amount)
+
+    def food_amounts(self):
+        food = self._initial_food
+        if isinstance(food, np.ndarray):
+            food = food.copy() if self._food_fill is None else np.full(len(food), self._food_fill, dtype=food.dtype)
+            food[list(self._food_overrides)] = list(self._food_overrides.values())
+            return food.tolist()
+        food = list(food) if self._food_fill is None else [self._food_fill] * len(food)
+        for ordinal, food_amount in self._food_overrides.items():
+            food[ordinal] = food_amount
+        return food
+
+    def built_food_amounts(self):
+        food = self._initial_food
+        return food.tolist() if isinstance(food, np.ndarray) else list(food)
+
+    def at(self, x, y) -> Cell:
+        return self._cell(y * self.width + x)
+
+    def cell_at(self, pos: Vec2) -> Cell:
+        return self._cell(pos.y * self.width + pos.x)
+
+    def cells_of_type(self, cell_type: CellType) -> List[Cell]:
+        return [self._cell(i) for i in self.index.flat[cell_type].tolist()]
+
+    def features_within(self, cell_type: CellType, center: Vec2, r, neighborhood: Neighborhood) -> List[Cell]:
+        return [self._cell(i) for i in self.index.within(cell_type, center.x, center.y, r, neighborhood)]
+
+    def neighbors(self, center: Vec2, r: int, neighborhood: Neighborhood) -> List[Cell]:
+        """
+        Cells that are not kept are given as read-only `StaticCell`s, changes to them would not be kept anyway.
+        """
+        r = round(r)
+        cx, cy = center.x, center.y
+        width = self.width
+        flat = []
+        for y in range(max(0, cy - r), min(self.height, cy + r + 1)):
+            k = r if neighborhood == Neighborhood.Moore else r - abs(y - cy)
+            flat.extend(range(y * width + max(0, cx - k), y * width + min(width, cx + k + 1)))
+        # Cell types of the cells that are not kept, looked up in one batch
+        kept = self._cells
+        missing = [i for i in flat if i not in kept]
+        cell_types = iter(_CELL_TYPES[self.cell_types.get_many(missing)].tolist())
+        cells = []
+        for i in flat:
+            cell = kept.get(i)
+            if cell is None:
+                y, x = divmod(i, width)
+                cell = StaticCell(self, Vec2(x, y), next(cell_types))
+            cells.append(cell)
+        return cells
+
+    def serialize(self):
+        return dict(
+            width=self.width,
+            height=self.height,
+            sparse=True,
+            cells=[self._cells[i].serialize() for i in sorted(self._cells)],
+        )
+
+    def __repr__(self):
+        return ''.join(str(self._cells[i]) + '\n' for i in sorted(self._cells))
@@ -2,7 +2,7 @@ import random
 from zlib import crc32
 
 from .enums import CellType
-from .math import Vec2
+from .math import Vec2, unit_xy, cross_xy
 
 
 def char_cell_type_map():
@@ -24,17 +24,20 @@ def cell_type_to_char(value: CellType):
     }.get(value, '.')
 
 
-def random_cell_type_list(k):
-    """
-    :param k: Number of items in the returning list. Used for populating
-    """
-    cell_type_weights = {
+def cell_type_weights():
+    return {
         CellType.floor: 92,
         CellType.bed: 3,
         CellType.box: 2,
         CellType.food: 4,
     }
-    weights = [cell_type_weights[cell_type] for cell_type in CellType]
+
+
+def random_cell_type_list(k):
+    """
+    :param k: Number of items in the returning list. Used for populating
+    """
+    weights = [cell_type_weights()[cell_type] for cell_type in CellType]
     return random.choices(list(CellType), weights=weights, k=k)
 
 
@@ -42,6 +45,14 @@ def calc_force(magnitude: float, from_v: Vec2, to_v: Vec2):
     return magnitude * (to_v - from_v).unit()
 
 
+def calc_force_xy(magnitude: float, from_x, from_y, to_x, to_y):
+    """
+    Allocation free version of `calc_force`. Returns the force as an (x, y) tuple.
+    """
+    ux, uy = unit_xy(to_x - from_x, to_y - from_y)
+    return ux * magnitude, uy * magnitude
+
+
 def get_sleep_probability(cell_type, health):
     p = {
         CellType.floor: 0.05,
@@ -62,7 +73,7 @@ def max_health(age):
 
 
 def cross(a: Vec2, b: Vec2):
-    return a.x * b.y - a.y * b.x
+    return cross_xy(a.x, a.y, b.x, b.y)
 
 
 def int_to_float_hash(a):
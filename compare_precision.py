@@ -0,0 +1,69 @@
+import argparse
+import json
+import shlex
+import sys
+
+from args import parse_args
+from catsim.memory import layer_sizes
+from catsim.precision import drift
+from catsim.simulation import Simulation
+from catsim.logging import Logger, LogMethod
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Runs one simulation configuration with full and with compact precision side by side, and reports '
+                    'how far the compact run drifts and how much smaller its layers are.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        '--args',
+        type=str,
+        default='',
+        help='Simulation arguments of both runs, as one string e.g. --args="--t_sparse --t_width 4000 --t_height 4000". '
+             'Compact precision needs --t_sparse. --precision is ignored.',
+    )
+    parser.add_argument(
+        '--n_steps',
+        type=int,
+        help='Number of steps to compare. If not specified, n_steps of the simulation arguments.',
+    )
+    parser.add_argument(
+        '--report_file_path',
+        type=str,
+        help='Per step drift and the layer sizes go into this JSON file.',
+    )
+    args = parser.parse_args()
+
+    Logger.setup(LogMethod.none)
+
+    args_full = parse_args(shlex.split(args.args) + ['--precision', 'full'])
+    args_compact = parse_args(shlex.split(args.args) + ['--precision', 'compact'])
+    n_steps = args.n_steps if args.n_steps is not None else args_full.n_steps
+
+    simulations = []
+    for simulation_args in (args_full, args_compact):
+        simulation = Simulation(simulation_args, interactive=False)
+        simulation.show_progress = False
+        simulations.append(simulation)
+    report = drift(*simulations, n_steps)
+    report['layer_sizes'] = dict(full=layer_sizes(simulations[0]), compact=layer_sizes(simulations[1]))
+
+    for name, step in report['first_divergence'].items():
+        print(f'{name:>8}: ' + ('no divergence' if step is None else f'diverged at step {step}'))
+    final = report['final']
+    if final is not None:
+        print(f'After step {final["step"]}: population {final["population"]} (compact {final["population_compact"]}), '
+              f'{final["moved_apart"]:.1%} of the common cats moved apart, health error {final["health_error"]:.3g}, '
+              f'food error {final["food_error"]:.3g}, trace total error {final["trace_total_error"]:.3g}')
+    full_bytes, compact_bytes = (sum(sizes.values()) for sizes in report['layer_sizes'].values())
+    print(f'Layers: {full_bytes} bytes full, {compact_bytes} bytes compact ({compact_bytes / max(1, full_bytes):.0%})')
+
+    if args.report_file_path is not None:
+        with open(args.report_file_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
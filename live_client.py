@@ -0,0 +1,63 @@
+import argparse
+import socket
+import threading
+
+import matplotlib.pyplot as plt
+import matplotlib.animation as animation
+import numpy as np
+
+from catsim.enums import CellType
+from catsim.live import FrameDecoder, read_frames
+from catsim.utils import cell_type_to_color
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Minimal viewer of a simulation started with --live_port.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Simulation host.')
+    parser.add_argument('--port', type=int, required=True, help='Simulation live port.')
+    args = parser.parse_args()
+
+    decoder = FrameDecoder()
+    lock = threading.Lock()
+
+    def _receive():
+        with socket.create_connection((args.host, args.port)) as sock:
+            for frame in read_frames(sock):
+                with lock:
+                    decoder.apply(frame)
+
+    threading.Thread(target=_receive, daemon=True).start()
+
+    fig, (ax1, ax2, ax3) = plt.subplots(1, 3)
+    colors = np.array([(*cell_type_to_color(cell_type), 1.0) for cell_type in CellType])
+    plots = dict()
+
+    def _render(_frame):
+        with lock:
+            if decoder.step is None:
+                return ()
+            shape = (decoder.height, decoder.width)
+            if not plots:
+                plots['im1'] = ax1.imshow(colors[decoder.cell_types], alpha=0.3)
+                plots['sc'] = ax1.scatter([], [])
+                plots['im2'] = ax2.imshow(np.zeros(shape), cmap='Reds', vmin=0, vmax=255)
+                plots['im3'] = ax3.imshow(np.zeros(shape), cmap='Blues', vmin=0, vmax=255)
+                ax1.title.set_text('Cat movement')
+                ax2.title.set_text('X traces')
+                ax3.title.set_text('Y traces')
+            plots['sc'].set_offsets(np.column_stack((decoder.cats['x'], decoder.cats['y'])) if len(decoder.cats)
+                                    else np.zeros((0, 2)))
+            plots['im2'].set_array(decoder.x_trace.reshape(shape))
+            plots['im3'].set_array(decoder.y_trace.reshape(shape))
+            fig.suptitle(f'Step {decoder.step}, population {len(decoder.cats)}')
+        return plots.values()
+
+    _ani = animation.FuncAnimation(fig, _render, interval=100)
+    plt.show()
+
+
+if __name__ == '__main__':
+    main()
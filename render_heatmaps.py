@@ -0,0 +1,70 @@
+import argparse
+import os
+import sys
+
+import matplotlib
+
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt  # noqa: E402
+import numpy as np  # noqa: E402
+from matplotlib.colors import LogNorm  # noqa: E402
+
+from catsim.heatmaps import HeatmapRecorder, load  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Renders the heatmaps saved with --heatmaps_file_path into one image per layer, with a panel per '
+                    'personality and one for all cats.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        'heatmaps_file_path',
+        type=str,
+        help='Heatmaps .npz file.',
+    )
+    parser.add_argument(
+        '--output_dir',
+        type=str,
+        default='heatmaps',
+        help='Images go into this directory as <layer>.png.',
+    )
+    parser.add_argument(
+        '--linear',
+        action='store_true',
+        help='Flag to use a linear color scale. If not set, counts are shown on a log scale.',
+    )
+    parser.add_argument(
+        '--max_side',
+        type=int,
+        default=2000,
+        help='Larger maps are shown with counts summed over square blocks of cells, so that no image side exceeds '
+             'this many pixels.',
+    )
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    personalities, block, layers = load(args.heatmaps_file_path, args.max_side)
+    suffix = '' if block == 1 else f', {block}x{block} blocks'
+    for layer in HeatmapRecorder.layers:
+        counts = layers[layer]
+        panels = [(f'{layer} ({p}{suffix})', counts[i]) for i, p in enumerate(personalities)]
+        panels.append((f'{layer} (all{suffix})', counts.sum(axis=0)))
+        fig, axs = plt.subplots(1, len(panels), figsize=(5 * len(panels), 5), squeeze=False)
+        for ax, (title, values) in zip(axs[0], panels):
+            norm = None if args.linear or values.max() == 0 else LogNorm(vmin=1, vmax=values.max())
+            # Cells with no counts are left blank on the log scale
+            image = ax.imshow(np.ma.masked_equal(values, 0) if norm is not None else values, norm=norm,
+                              cmap='viridis', origin='upper')
+            ax.set_title(title)
+            ax.axis('off')
+            fig.colorbar(image, ax=ax, fraction=0.046, pad=0.04)
+        path = os.path.join(args.output_dir, f'{layer}.png')
+        fig.savefig(path, bbox_inches='tight', dpi=120)
+        plt.close(fig)
+        print(f'Saved {path}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
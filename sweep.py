@@ -0,0 +1,115 @@
+import argparse
+import json
+import shlex
+import sys
+import time
+
+from args import parse_args
+from catsim.sweep import Coordinator, make_jobs, work
+from catsim.logging import Logger, LogMethod
+
+
+def parse_seeds(value):
+    """
+    Comma separated seeds or ranges e.g. 0-63 or 1,5,10-12
+    """
+    seeds = []
+    for part in value.split(','):
+        first, _, last = part.partition('-')
+        seeds.extend(range(int(first), int(last or first) + 1))
+    return seeds
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Distributed seed sweeps. A coordinator hands out one job per Config variant and seed to workers '
+                    'connecting over TCP, from this or other hosts.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        'role',
+        choices=('coordinator', 'worker'),
+        help='Run the coordinator, or a worker pulling jobs from it.',
+    )
+    parser.add_argument(
+        '--host',
+        type=str,
+        default='127.0.0.1',
+        help='Coordinator host. The coordinator binds to it, use 0.0.0.0 to accept workers from other hosts.',
+    )
+    parser.add_argument(
+        '--port',
+        type=int,
+        default=5556,
+        help='Coordinator port.',
+    )
+    parser.add_argument(
+        '--seeds',
+        type=parse_seeds,
+        default='0-7',
+        help='Coordinator only. Seeds to sweep, comma separated seeds or ranges e.g. 0-63 or 1,5,10-12.',
+    )
+    parser.add_argument(
+        '--args',
+        type=str,
+        default='',
+        help='Coordinator only. Simulation arguments shared by all jobs, as one string e.g. '
+             '--args="--population 50 --n_steps 100". --seed and output file arguments are ignored.',
+    )
+    parser.add_argument(
+        '--configs',
+        type=json.loads,
+        default=[{}],
+        help='Coordinator only. Config overrides to sweep as a JSON list e.g. \'[{}, {"new_food_amount": 10}]\'.',
+    )
+    parser.add_argument(
+        '--results_file_path',
+        type=str,
+        default='sweep-results.ndjson',
+        help='Coordinator only. One result per line, in order of completion.',
+    )
+    parser.add_argument(
+        '--lease_timeout',
+        type=float,
+        help='Coordinator only. Seconds after which an unreported job is handed out again. If not specified, only '
+             'jobs of disconnected workers are.',
+    )
+    parser.add_argument(
+        '--connect_timeout',
+        type=float,
+        default=30,
+        help='Worker only. Seconds to keep retrying to connect to the coordinator.',
+    )
+    args = parser.parse_args()
+
+    Logger.setup(LogMethod.none)
+
+    if args.role == 'worker':
+        deadline = time.time() + args.connect_timeout
+        while True:
+            try:
+                n_jobs = work(args.host, args.port)
+                break
+            except ConnectionRefusedError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.5)
+        print(f'Ran {n_jobs} jobs')
+        return 0
+
+    parameters = vars(parse_args(shlex.split(args.args)))
+    jobs = make_jobs(parameters, args.configs, args.seeds)
+    coordinator = Coordinator(jobs, args.results_file_path, args.host, args.port, args.lease_timeout)
+    coordinator.start()
+    print(f'Serving {len(jobs)} jobs on {coordinator.address[0]}:{coordinator.address[1]}')
+    try:
+        coordinator.wait()
+    finally:
+        coordinator.stop()
+    print(f'{len(coordinator.results)} jobs done, {len(coordinator.failures)} failed, '
+          f'{coordinator.duplicates} duplicate results ignored')
+    return 1 if coordinator.failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
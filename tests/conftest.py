@@ -0,0 +1,10 @@
+import pytest
+
+from catsim.enums import LogMethod
+from catsim.logging import Logger
+
+
+@pytest.fixture(autouse=True)
+def no_logging(monkeypatch):
+    # As in the scripts. Logging every action to the console slows simulations down many times over.
+    monkeypatch.setattr(Logger, 'method', LogMethod.none)
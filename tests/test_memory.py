@@ -0,0 +1,17 @@
+import json
+
+from catsim.simulation import Simulation
+
+
+def test_records_are_streamed_to_the_file(tmp_path):
+    path = tmp_path / 'memory.ndjson'
+    simulation = Simulation.from_config(population=10, t_width=6, t_height=6, n_steps=15, seed=1,
+                                        results_file_path=str(tmp_path / 'results.json'), memory_file_path=str(path))
+    simulation.run()
+    simulation.finalize()
+    with open(path) as f:
+        lines = [json.loads(line) for line in f]
+    assert [line['step'] for line in lines[:-1]] == list(range(1, 16))
+    assert set(lines[0]['phases']) >= {'pre_update', 'update', 'outputs'}
+    assert 'growth' in lines[-1]['report']
+    assert simulation.memory.last_record['step'] == lines[-2]['step']
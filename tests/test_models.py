@@ -0,0 +1,33 @@
+import itertools
+import math
+import random
+
+from catsim.enums import Gender, Personality, State
+from catsim.math import Vec2
+from catsim.models import Cat, CatGroupStats
+
+
+def mixed_cats(rng, n):
+    """
+    Cats of every gender, personality, sexual activity and sleep state, with random health.
+    """
+    cats = []
+    for i in range(n):
+        gender, personality, young, pregnant, state = rng.choice(list(itertools.product(
+            Gender, Personality, (True, False), (True, False), (State.active, State.sleeping))))
+        cats.append(Cat(position=Vec2(0, 0), age=0.2 if young else rng.uniform(0.5, 10), gender=gender,
+                        personality=personality, health=rng.uniform(1, 100), state=state,
+                        fetus=object() if pregnant else None))
+    return cats
+
+
+def test_mutual_attraction_total_matches_the_pairwise_sum():
+    rng = random.Random(0)
+    for n in (1, 2, 5, 40):
+        cats = mixed_cats(rng, n)
+        for temperature in (20, 30):
+            for cat in cats:
+                others = [other_cat for other_cat in cats if other_cat is not cat]
+                pairwise = sum(cat.mutual_attraction(other_cat, temperature) for other_cat in others)
+                total = cat.mutual_attraction_total(CatGroupStats(others), temperature)
+                assert math.isclose(total, pairwise, rel_tol=1e-9, abs_tol=1e-9)
@@ -0,0 +1,53 @@
+import pytest
+
+from catsim.enums import CellType
+from catsim.math import norm_xy
+from catsim.quadtree import QuadTree
+from catsim.simulation import Simulation
+
+
+def exact_food_field(terrain, x, y, r, neighborhood):
+    fx, fy = 0.0, 0.0
+    for cell in terrain.features_within(CellType.food, center=terrain.at(x, y).position, r=r,
+                                        neighborhood=neighborhood):
+        dx, dy = cell.position.x - x, cell.position.y - y
+        distance = norm_xy(dx, dy)
+        if distance > 0:
+            fx += cell.food_amount * dx / distance
+            fy += cell.food_amount * dy / distance
+    return fx, fy
+
+
+class CheckedSimulation(Simulation):
+    """
+    Checks the incrementally updated food quadtree against the food of the terrain every step.
+    """
+    checked_steps = 0
+    consuming_steps = 0
+
+    def _update_food_masses(self):
+        super()._update_food_masses()
+        terrain = self.terrain
+        tree = terrain.index.quadtree(CellType.food)
+        rebuilt = QuadTree(tree.xs, tree.ys)
+        rebuilt.set_masses(terrain.food_amounts())
+        assert tree.masses == rebuilt.masses
+        assert tree.mass == pytest.approx(rebuilt.mass)
+        for x, y in ((0, 0), (5, 7), (11, 3)):
+            for r in (2, 6):
+                assert tree.field(x, y, r, self.neighborhood, 0) == \
+                    pytest.approx(exact_food_field(terrain, x, y, r, self.neighborhood), abs=1e-9)
+        self.checked_steps += 1
+        self.consuming_steps += bool(terrain.food_changes)
+
+
+@pytest.mark.parametrize('continuous_food', [False, True])
+def test_theta_zero_is_the_exact_food_force(tmp_path, continuous_food):
+    simulation = CheckedSimulation.from_config(
+        population=60, t_width=12, t_height=12, n_steps=40, seed=5, food_far_field_theta=0.0,
+        continuous_food=continuous_food,
+        results_file_path=str(tmp_path / 'results.json'))
+    assert simulation.terrain.index.count(CellType.food) > 0
+    simulation.run()
+    assert simulation.checked_steps == 40
+    assert simulation.consuming_steps > 0
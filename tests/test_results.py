@@ -0,0 +1,29 @@
+import json
+
+import pytest
+
+from catsim.enums import CellType
+from catsim.results import iter_records, read_ndjson_chunks
+from catsim.simulation import Simulation
+
+
+@pytest.mark.parametrize('sparse', [False, True])
+def test_ndjson_results_read_back_in_chunks(tmp_path, sparse):
+    path = tmp_path / 'results.ndjson'
+    simulation = Simulation.from_config(population=30, t_width=6, t_height=5, n_steps=20, seed=1, t_sparse=sparse,
+                                        results_format='ndjson', results_file_path=str(path))
+    simulation.run()
+    simulation.finalize()
+    expected = [json.loads(json.dumps(record)) for record in iter_records(simulation)]
+
+    chunks = list(read_ndjson_chunks(path, chunk_size=7))
+    assert all(len(chunk) == 7 for chunk in chunks[:-1]) and 0 < len(chunks[-1]) <= 7
+    assert [record for chunk in chunks for record in chunk] == expected
+    assert expected[0]['type'] == 'metadata'
+
+    cats = [record for chunk in read_ndjson_chunks(path, record_type='cat') for record in chunk]
+    assert [cat['cat_id'] for cat in cats] == [cat.cat_id for cat in simulation.iter_cats()]
+    food_cells = [record for chunk in read_ndjson_chunks(path, record_type='food_cell') for record in chunk]
+    assert len(food_cells) == len(list(simulation.terrain.cells_of_type(CellType.food)))
+    terrain_type = 'terrain_cell' if sparse else 'terrain_row'
+    assert any(record['type'] == terrain_type for record in expected)
@@ -0,0 +1,41 @@
+from catsim.enums import EventKind
+from catsim.scheduler import Scheduler
+from catsim.simulation import Simulation
+
+
+def test_events_fire_at_their_step_in_scheduling_order():
+    scheduler = Scheduler()
+    scheduler.schedule(5, EventKind.wake_up, 'a')
+    scheduler.schedule(3, EventKind.deliver, 'b')
+    scheduler.schedule(5, EventKind.wake_up, 'c')
+    scheduler.schedule(3, EventKind.wake_up, 'd')
+    assert scheduler.pop_due(2) == {kind: [] for kind in EventKind}
+    due = scheduler.pop_due(3)
+    assert (due[EventKind.wake_up], due[EventKind.deliver]) == (['d'], ['b'])
+    # Events of missed steps fire late rather than never
+    assert scheduler.pop_due(7)[EventKind.wake_up] == ['a', 'c']
+    assert len(scheduler) == 0
+
+
+def run_states(tmp_path, polling):
+    simulation = Simulation.from_config(population=40, t_width=8, t_height=8, n_steps=120, seed=5,
+                                        results_file_path=str(tmp_path / f'results-{polling}.json'))
+    first_id = min(cat.cat_id for cat in simulation.iter_cats())  # Cat ids keep counting across simulations
+    states = []
+    while not simulation.is_finished():
+        simulation.update()
+        states.append([(cat.cat_id - first_id, str(cat.state), cat.sleep_duration, cat.hours_since_last_conception)
+                       for cat in simulation.iter_cats()])
+    return states
+
+
+def test_scheduled_wake_ups_and_deliveries_match_polling(tmp_path, monkeypatch):
+    scheduled = run_states(tmp_path, False)
+    pre_update = Simulation._pre_update
+    with monkeypatch.context() as m:
+        # Checks every cat every step, as before the scheduler
+        m.setattr(Simulation, '_pre_update',
+                  lambda self, cat, next_cats, wake_ups=None, deliveries=None: pre_update(self, cat, next_cats))
+        polling = run_states(tmp_path, True)
+    assert any(state == 'sleeping' for states in scheduled for _, state, _, _ in states)
+    assert scheduled == polling
@@ -0,0 +1,68 @@
+import collections
+import json
+import statistics
+
+from catsim.enums import Interaction
+from catsim.simulation import Simulation
+
+
+def small_simulation(tmp_path, **parameters):
+    parameters = dict(population=40, t_width=8, t_height=8, n_steps=60, seed=3,
+                      results_file_path=str(tmp_path / 'results.json'), **parameters)
+    return Simulation.from_config(**parameters)
+
+
+def test_branch_with_longer_durations_still_wakes_and_delivers(tmp_path):
+    simulation = small_simulation(tmp_path)
+    for _ in range(20):
+        simulation.update()
+    cats = list(simulation.terrain.cats())
+    assert any(cat.is_sleeping() for cat in cats)
+    assert any(cat.is_pregnant() for cat in cats)
+
+    sleep_time, hours_to_deliver = 12, 25
+    assert simulation.fork([dict(sleep_time=sleep_time, hours_to_deliver_offspring=hours_to_deliver)]) == [0]
+
+    with open(tmp_path / 'results-branch0.json') as f:
+        cats = json.load(f)['cats']
+    # Events queued before the fork were due too early for the branch. Missed, they leave cats asleep or pregnant.
+    alive = [cat for cat in cats if cat['state'] != 'dead']
+    assert all(cat['sleep_duration'] <= sleep_time for cat in alive)
+    assert all(cat['hours_since_last_conception'] <= hours_to_deliver for cat in alive if cat['fetus'] is not None)
+
+
+def crowded_outcomes(tmp_path, max_contacts, seeds=range(8)):
+    """
+    :return: mean over `seeds` of the deaths, mean and standard deviation of the health of survivors, and the share
+    of attacks on a cat that the same attacker already attacked in the step
+    """
+    outcomes = []
+    for seed in seeds:
+        attacks = collections.Counter()
+        simulation = Simulation.from_config(population=150, t_width=2, t_height=2, n_steps=6, seed=seed,
+                                            max_contacts=max_contacts,
+                                            results_file_path=str(tmp_path / 'results.json'))
+
+        def count_attack(cat, other_cat, interaction, simulation=simulation):
+            if interaction == Interaction.attack:
+                attacks[simulation.current_step, cat.cat_id, other_cat.cat_id] += 1
+
+        simulation.subscribe('on_interaction', count_attack)
+        simulation.run()
+        cats = list(simulation.iter_cats())
+        health = [cat.health for cat in cats if cat.is_alive()]
+        repeated = sum(count - 1 for count in attacks.values()) / sum(attacks.values())
+        outcomes.append((sum(not cat.is_alive() for cat in cats), statistics.mean(health), statistics.pstdev(health),
+                         repeated))
+    return [statistics.mean(values) for values in zip(*outcomes)]
+
+
+def test_bounded_contacts_keep_deaths_and_health(tmp_path):
+    deaths, health_mean, health_std, repeated = crowded_outcomes(tmp_path, None)
+    bounded_deaths, bounded_health_mean, bounded_health_std, bounded_repeated = crowded_outcomes(tmp_path, 5)
+    assert repeated == 0
+    assert abs(bounded_deaths - deaths) < 0.1 * deaths
+    assert abs(bounded_health_mean - health_mean) < 3
+    assert abs(bounded_health_std - health_std) < 2
+    # Extra attacks are spread over the cell instead of piling up on the sampled partner
+    assert bounded_repeated < 0.5
@@ -0,0 +1,96 @@
+import socket
+import time
+
+from catsim.sweep import Coordinator, recv_message, send_message
+
+LEASE_TIMEOUT = 0.05
+
+
+def job(job_id):
+    return dict(job_id=job_id, parameters={}, config={}, seed=0)
+
+
+def result(job_id):
+    return dict(job_id=job_id, seed=0, config={}, metadata={}, alive=0, totals={}, elapsed=0.0)
+
+
+class FakeWorker:
+    """
+    Speaks the protocol directly, so that tests decide when (and whether) a job is reported back.
+    """
+
+    def __init__(self, coordinator):
+        self.sock = socket.create_connection(coordinator.address)
+        self.stream = self.sock.makefile('rb')
+
+    def send(self, message):
+        """
+        :return: the reply, waiting out `wait` replies. The job, or None for `done`.
+        """
+        send_message(self.sock, message)
+        while True:
+            reply = recv_message(self.stream)
+            if reply['type'] == 'job':
+                return reply['job']
+            if reply['type'] == 'done':
+                return None
+            time.sleep(LEASE_TIMEOUT / 5)
+            send_message(self.sock, dict(type='ready'))
+
+    def close(self):
+        self.stream.close()
+        self.sock.close()
+
+
+def start(tmp_path, jobs, **kwargs):
+    coordinator = Coordinator(jobs, tmp_path / 'results.ndjson', **kwargs)
+    coordinator.start()
+    return coordinator
+
+
+def test_expired_leases_count_as_attempts(tmp_path):
+    coordinator = start(tmp_path, [job('a')], lease_timeout=LEASE_TIMEOUT, max_attempts=2)
+    workers = [FakeWorker(coordinator) for _ in range(3)]
+    try:
+        # Two workers take the job and never answer
+        assert workers[0].send(dict(type='ready'))['job_id'] == 'a'
+        assert workers[1].send(dict(type='ready'))['job_id'] == 'a'
+        # The second lease expiring uses up the last attempt
+        assert workers[2].send(dict(type='ready')) is None
+        assert coordinator.wait(1)
+        assert coordinator.failures == {'a': 'lease expired'}
+        assert coordinator.results == {}
+    finally:
+        for worker in workers:
+            worker.close()
+        coordinator.stop()
+
+
+def test_failed_jobs_are_retried(tmp_path):
+    coordinator = start(tmp_path, [job('a')], max_attempts=3)
+    worker = FakeWorker(coordinator)
+    try:
+        assert worker.send(dict(type='ready'))['job_id'] == 'a'
+        assert worker.send(dict(type='error', job_id='a', error='boom'))['job_id'] == 'a'
+        assert worker.send(dict(type='result', result=result('a'))) is None
+        assert list(coordinator.results) == ['a']
+        assert coordinator.failures == {}
+    finally:
+        worker.close()
+        coordinator.stop()
+
+
+def test_only_the_first_result_is_kept(tmp_path):
+    coordinator = start(tmp_path, [job('a')], lease_timeout=LEASE_TIMEOUT)
+    workers = [FakeWorker(coordinator) for _ in range(2)]
+    try:
+        assert workers[0].send(dict(type='ready'))['job_id'] == 'a'
+        assert workers[1].send(dict(type='ready'))['job_id'] == 'a'  # Once the first lease expired
+        assert workers[0].send(dict(type='result', result=result('a'))) is None
+        assert workers[1].send(dict(type='result', result=result('a'))) is None
+        assert coordinator.duplicates == 1
+    finally:
+        for worker in workers:
+            worker.close()
+        coordinator.stop()
+    assert len((tmp_path / 'results.ndjson').read_text().splitlines()) == 1
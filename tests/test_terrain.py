@@ -0,0 +1,103 @@
+import numpy as np
+
+from catsim.config import Config
+from catsim.enums import CellType, Gender, Personality, State
+from catsim.math import Vec2
+from catsim.models import Cat
+from catsim.precision import trace_value
+from catsim.terrain import Cell, Clock, CompactCell, SparseLayer, SparseTerrain, Terrain
+
+
+def faded_every_step(value, n_steps):
+    for _ in range(n_steps):
+        value *= Config.trace_fading_factor
+    return value
+
+
+def test_lazy_fading_matches_fading_every_step():
+    for value in (1.0, 0.7, 0.3337):
+        clock = Clock()
+        read_once = Cell(Vec2(0, 0), [], x_trace=value, y_trace=value / 3, clock=clock)
+        read_every_step = Cell(Vec2(0, 0), [], x_trace=value, y_trace=value / 3, clock=clock)
+        for step in range(1, 200):
+            clock.step = step
+            assert read_every_step.x_trace == faded_every_step(value, step)
+            assert read_every_step.y_trace == faded_every_step(value / 3, step)
+        assert read_once.x_trace == read_every_step.x_trace
+        assert read_once.y_trace == read_every_step.y_trace
+
+
+def test_fading_by_a_power_is_not_bit_identical():
+    # Why `_fade_traces` loops instead of multiplying by trace_fading_factor ** elapsed
+    assert any(faded_every_step(1.0, n) != 1.0 * Config.trace_fading_factor ** n for n in range(1, 20))
+
+
+def test_lazy_fading_of_compact_cells_matches_fading_every_step():
+    clock = Clock()
+    read_once = CompactCell(Vec2(0, 0), [], x_trace=50000, y_trace=123, clock=clock)
+    read_every_step = CompactCell(Vec2(0, 0), [], x_trace=50000, y_trace=123, clock=clock)
+    level = 50000
+    for step in range(1, 120):
+        clock.step = step
+        level = int(level * Config.trace_fading_factor)
+        assert read_every_step.x_trace == trace_value(level)
+    assert (read_once.x_trace, read_once.y_trace) == (read_every_step.x_trace, read_every_step.y_trace)
+
+
+def test_next_terrain_carries_cells_over():
+    cell_types = [[CellType.floor, CellType.food], [CellType.bed, CellType.floor]]
+    terrain = Terrain(2, 2, [[0, 1], [2, 3]], cell_types)
+    cat = Cat(position=Vec2(1, 0), age=1, gender=Gender.female, personality=Personality.X, health=100,
+              state=State.active)
+    terrain.put_cat(cat)
+    food_cell = terrain.at(1, 0)
+    terrain.consume_food(food_cell, 30)
+
+    next_terrain = Terrain(2, 2, [[0, 1], [2, 3]], cell_types, previous_terrain=terrain)
+    assert next_terrain.at(1, 0) is food_cell
+    assert food_cell.cats == []
+    # Food of a step does not carry over
+    assert food_cell.food_amount == Config.start_food_amount
+    assert next_terrain.food_total == Config.start_food_amount
+    assert food_cell.x_trace == Config.trace_fading_factor
+    assert next_terrain.x_trace_total == Config.trace_fading_factor
+
+
+def test_next_sparse_terrain_carries_kept_cells_over():
+    elevations = SparseLayer.from_dense([[0, 1, 0], [2, 3, 0]])
+    cell_types = SparseLayer.from_dense([[CellType.floor.value, CellType.food.value, CellType.food.value],
+                                         [CellType.bed.value, CellType.floor.value, CellType.floor.value]])
+    terrain = SparseTerrain(3, 2, elevations, cell_types)
+    cat = Cat(position=Vec2(1, 0), age=1, gender=Gender.female, personality=Personality.X, health=100,
+              state=State.active)
+    terrain.put_cat(cat)
+    food_cell = terrain.at(1, 0)
+    terrain.consume_food(food_cell, 30)
+    assert terrain.food_amounts() == [Config.start_food_amount - 30, Config.start_food_amount]
+    terrain.refill_food(7)
+    terrain.consume_food(food_cell, 2)
+    assert terrain.food_amounts() == [5, 7]
+    assert terrain.at(2, 0).food_amount == 7
+
+    next_terrain = SparseTerrain(3, 2, elevations, cell_types, previous_terrain=terrain)
+    assert next_terrain.at(1, 0) is food_cell
+    assert food_cell.cats == []
+    # Food of a step does not carry over
+    assert food_cell.food_amount == Config.start_food_amount
+    assert next_terrain.food_amounts() == [Config.start_food_amount] * 2
+    assert next_terrain.at(2, 0).food_amount == Config.start_food_amount
+    assert food_cell.x_trace == Config.trace_fading_factor
+
+
+def test_clamp_many_matches_clamp_xy():
+    width, height = 7, 5
+    terrain = Terrain(width, height, [[0] * width] * height, [[CellType.floor] * width] * height)
+    rng = np.random.default_rng(0)
+    # Lattice origins, border and corner cells included, with whole and fractional moves going out of the map
+    origins = rng.integers(0, (width, height), size=(2000, 2))
+    origins[:40] = [(0, 0), (width - 1, 0), (0, height - 1), (width - 1, height - 1)] * 10
+    moves = rng.integers(-12, 13, size=(2000, 2)).astype(np.float64)
+    moves[1000:] += rng.uniform(-1, 1, size=(1000, 2))
+    targets = origins + moves
+    expected = [terrain.clamp_xy(px, py, tx, ty) for (px, py), (tx, ty) in zip(origins.tolist(), targets.tolist())]
+    assert [tuple(xy) for xy in terrain.clamp_many(origins, targets).tolist()] == expected
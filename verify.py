@@ -0,0 +1,61 @@
+import argparse
+import shlex
+import sys
+
+from args import parse_args
+from catsim.digest import verify
+from catsim.simulation import Simulation
+from catsim.logging import Logger, LogMethod
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Replays two simulation configurations side by side and reports the first step where their '
+                    'states diverge.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        '--a',
+        type=str,
+        default='',
+        help='Simulation arguments of the reference, as one string e.g. --a="--seed 1 --population 50".',
+    )
+    parser.add_argument(
+        '--b',
+        type=str,
+        default='',
+        help='Simulation arguments to verify against the reference, as one string.',
+    )
+    parser.add_argument(
+        '--n_steps',
+        type=int,
+        help='Number of steps to compare. If not specified, n_steps of the reference.',
+    )
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=0.0,
+        help='Absolute tolerance when comparing float fields.',
+    )
+    args = parser.parse_args()
+
+    Logger.setup(LogMethod.none)
+
+    args_a = parse_args(shlex.split(args.a))
+    args_b = parse_args(shlex.split(args.b))
+    n_steps = args.n_steps if args.n_steps is not None else args_a.n_steps
+
+    # Without keyboard listeners, so that it runs on hosts without a display
+    simulation_a = Simulation(args_a, interactive=False)
+    simulation_b = Simulation(args_b, interactive=False)
+    divergence = verify(simulation_a, simulation_b, n_steps, args.tolerance)
+    if divergence is None:
+        print(f'No divergence in {n_steps} steps')
+        return 0
+    step, fields = divergence
+    print(f'First divergence at step {step} in fields: {", ".join(fields)}')
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())